@@ -5,26 +5,41 @@ import sys
 import json
 import time
 import random
+import asyncio
 import urllib.request
 import numpy as np
 
-def test_throughput(nodes, num_runs=3):
-    key_value_to_test = [(uuid.uuid4(), uuid.uuid4()) for _ in range(1000)]
-    
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import load_generator
+
+CONCURRENCY_LEVELS = [1, 16, 64]
+
+def test_throughput(nodes):
+    """ Closed loop load at a few concurrency levels, on keep-alive connections"""
+    return [asyncio.run(load_generator.run_load(nodes, mode="closed", concurrency=concurrency, duration=10))
+            for concurrency in CONCURRENCY_LEVELS]
+
+def post_batch(node, batch):
+    req = urllib.request.Request(
+        url=f"http://{node}/storage/_batch",
+        data=json.dumps(batch).encode("utf-8"),
+        method="POST"
+    )
+    req.add_header("Content-type", "application/json")
+    return json.loads(urllib.request.urlopen(req).read())
+
+def test_batch_throughput(nodes, batch_size=100, num_runs=3):
+    key_value_to_test = [(str(uuid.uuid4()), str(uuid.uuid4())) for _ in range(1000)]
+    batches = [key_value_to_test[i:i + batch_size] for i in range(0, len(key_value_to_test), batch_size)]
+
     put_times = []
     get_times = []
 
     for _ in range(num_runs):
-        # Measure PUT time
+        # Measure PUT time, one request per batch
         put_start_time = time.time()
-        for key, value in key_value_to_test:
-            req = urllib.request.Request(
-                url=f"http://{random.choice(nodes)}/storage/{key}", 
-                data=bytes(str(value).encode("utf-8")), 
-                method="PUT"
-            )
-            req.add_header("Content-type", "text/plain")
-            urllib.request.urlopen(req)
+        for batch in batches:
+            post_batch(random.choice(nodes), {"put": [{"key": key, "value": value} for key, value in batch]})
         put_end_time = time.time()
         put_times.append(put_end_time - put_start_time)
 
@@ -32,26 +47,22 @@ def test_throughput(nodes, num_runs=3):
         success_counter = 0
         failure_counter = 0
         get_start_time = time.time()
-        for key, value in key_value_to_test:
-            response = urllib.request.urlopen(f"http://{random.choice(nodes)}/storage/{key}").read()
-            if response.decode("utf-8") == str(value):
-                success_counter += 1
-            else:
-                failure_counter += 1
+        for batch in batches:
+            response = post_batch(random.choice(nodes), {"get": [key for key, _ in batch]})
+            found = {entry["key"]: entry["value"] for entry in response["found"]}
+            for key, value in batch:
+                if found.get(key) == value:
+                    success_counter += 1
+                else:
+                    failure_counter += 1
         get_end_time = time.time()
         get_times.append(get_end_time - get_start_time)
 
-    # Calculate mean and standard deviation
-    put_avg = np.mean(put_times)
-    put_std = np.std(put_times)
-    get_avg = np.mean(get_times)
-    get_std = np.std(get_times)
-
     return {
-        "put_avg": put_avg,
-        "put_std": put_std,
-        "get_avg": get_avg,
-        "get_std": get_std,
+        "put_avg": np.mean(put_times),
+        "put_std": np.std(put_times),
+        "get_avg": np.mean(get_times),
+        "get_std": np.std(get_times),
         "successes": success_counter,
         "failures": failure_counter
     }
@@ -85,9 +96,13 @@ if __name__ == "__main__":
         # print(f"Debug, output from run script: {run_script_json_list} EOS")
         print(f"Running test with {node_count} nodes and finger table size {finger_table_size}")
         deployed_nodes = json.loads(run_script_json_list)
-        test_results.append({"test": test, "result": test_throughput(deployed_nodes)})
+        test_results.append({
+            "test": test,
+            "result": test_throughput(deployed_nodes),
+            "batch_result": test_batch_throughput(deployed_nodes)
+        })
 
         shutdown_nodes(deployed_nodes)
 
     print("Tests done!")
-    print(test_results)
+    print(json.dumps(test_results, indent=2))
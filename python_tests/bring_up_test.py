@@ -0,0 +1,96 @@
+import os
+import re
+import sys
+import json
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+RING_SIZE = 65535
+ITERATIONS = 3
+NODE_COUNTS = [2, 4, 8, 16, 32, 64]
+MAX_NODES = max(NODE_COUNTS)
+
+# Get the absolute path of the current script directory
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def start_nodes():
+    print(f"Starting {MAX_NODES} nodes...")
+    nodesstr = os.popen(f" sh {os.path.join(SCRIPT_DIR, '../src/run-unjoined.sh')} {MAX_NODES}").read()
+
+    nodesmatch = re.findall("\\[.*\\]", nodesstr)
+    return json.loads(nodesmatch[0])
+
+def post(url):
+    req = urllib.request.Request(url=url, method="POST")
+    return urllib.request.urlopen(req).read()
+
+def get_json(url):
+    return json.loads(urllib.request.urlopen(url).read())
+
+def join_in_parallel(nodes):
+    """ Join every node to the first one at the same time, returns the time until all joins answered"""
+    n_prime = nodes[0]
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=len(nodes)) as executor:
+        results = list(executor.map(
+            lambda node: post(f"http://{node}/join?nprime={n_prime}"), nodes[1:]))
+    return time.time() - start_time, len(results)
+
+def ring_is_consistent(nodes):
+    """ Walk the successors from the first node, the ring must visit every node once and cover the whole ring"""
+    visited = []
+    covered = 0
+    current = nodes[0]
+    for _ in range(len(nodes)):
+        local = get_json(f"http://{current}/ring/local")
+        visited.append(current)
+        covered += local["range"]
+        successor = get_json(f"http://{current}/ring/successor")
+        current = f"{successor['hostname']}:{successor['port']}"
+
+    return current == nodes[0] and sorted(visited) == sorted(nodes) and covered == RING_SIZE
+
+def leave_nodes(nodes):
+    for node in reversed(nodes[1:]):
+        post(f"http://{node}/leave")
+
+def shutdown_nodes(nodes):
+    for node in nodes:
+        try:
+            urllib.request.urlopen(f"http://{node}/shutdown").read()
+        except OSError:
+            pass
+
+if __name__ == "__main__":
+    if len(sys.argv) > 1:
+        nodes = json.loads(sys.argv[1])
+        NODE_COUNTS = [count for count in NODE_COUNTS if count <= len(nodes)]
+    else:
+        nodes = start_nodes()
+
+    results = []
+    for node_count in NODE_COUNTS:
+        bring_up_times = []
+        consistent_runs = 0
+
+        for _ in range(ITERATIONS):
+            bring_up_time, _ = join_in_parallel(nodes[:node_count])
+            bring_up_times.append(bring_up_time)
+            if ring_is_consistent(nodes[:node_count]):
+                consistent_runs += 1
+            leave_nodes(nodes[:node_count])
+
+        result = {
+            'nodes': node_count,
+            'bring_up_avg': np.mean(bring_up_times),
+            'bring_up_std': np.std(bring_up_times),
+            'consistent_runs': consistent_runs,
+            'runs': ITERATIONS
+        }
+        print(f'{result}, ')
+        results.append(result)
+
+    if len(sys.argv) <= 1:
+        shutdown_nodes(nodes)
@@ -132,6 +132,31 @@ def get_neighbours(node):
     conn.close()
     return neighbors
 
+def snapshot_members(node):
+    """ All alive members from the node's gossiped view of the ring, or None if the view is not complete"""
+    conn = http.client.HTTPConnection(node)
+    conn.request("GET", "/ring/snapshot")
+    resp = conn.getresponse()
+    body = resp.read()
+    conn.close()
+    if resp.status != 200:
+        return None
+    snapshot = json.loads(body)
+    if not snapshot["complete"]:
+        return None
+    return {"{}:{}".format(member["hostname"], member["port"]) for member in snapshot["members"] if member["alive"]}
+
+def find_nodes(start_nodes):
+    """ One request if a start node knows the whole ring, otherwise crawl the neighbour lists"""
+    for node in start_nodes:
+        try:
+            members = snapshot_members(node)
+        except (OSError, http.client.HTTPException):
+            continue
+        if members:
+            return members
+    return walk_neighbours(list(start_nodes))
+
 def walk_neighbours(start_nodes):
     to_visit = start_nodes
     visited = set()
@@ -242,7 +267,7 @@ def get_nonexistent_key(nodes):
 def main(args):
 
     nodes = set(args.nodes)
-    nodes |= walk_neighbours(args.nodes)
+    nodes |= find_nodes(args.nodes)
     nodes = list(nodes)
     print("%d nodes registered: %s" % (len(nodes), ", ".join(nodes)))
 
@@ -0,0 +1,248 @@
+#!/usr/bin/env python3
+
+import hashlib
+import http.client
+import json
+import sys
+import urllib.parse
+import uuid
+
+# Must match RING_SIZE in src/main.rs
+RING_SIZE = 65535
+
+# What _request raises when a node is gone or breaks off its answer, e.g. IncompleteRead or RemoteDisconnected
+REQUEST_ERRORS = (OSError, http.client.HTTPException)
+
+def key_to_location(key):
+    """ Location of a key on the ring, the first two bytes of its SHA-1 like key_to_location in main.rs"""
+    digest = hashlib.sha1(key.encode("utf-8")).digest()
+    return int.from_bytes(digest[:2], "big")
+
+def is_location_in_range(location, position, range_):
+    # Same wrap around rule as is_location_in_range in main.rs
+    if RING_SIZE - position < range_:
+        return location >= position or location < range_ - (RING_SIZE - position)
+    return position <= location < position + range_
+
+class ChordClient(object):
+    """ Sends every request straight to the owner of the key.
+
+    The client caches the position and range of the nodes it has seen, and finds owners it does not know
+    with /ring/lookup. Requests are sent in redirect mode, so a stale cache entry costs one redirect and is
+    corrected from it. Connections are kept alive and reused per node.
+    """
+
+    def __init__(self, seed_nodes, timeout=5):
+        self.seed_nodes = list(seed_nodes)
+        self.timeout = timeout
+        # address -> (position, range)
+        self.ring = {}
+        self.connections = {}
+        self.stats = {"requests": 0, "cache_hits": 0, "lookups": 0, "redirects": 0, "reconnects": 0}
+
+    # Connections
+
+    def _connection(self, address):
+        conn = self.connections.get(address)
+        if conn is None:
+            conn = http.client.HTTPConnection(address, timeout=self.timeout)
+            self.connections[address] = conn
+        return conn
+
+    def _drop_connection(self, address):
+        conn = self.connections.pop(address, None)
+        if conn is not None:
+            conn.close()
+
+    def _request(self, address, method, path, body=None, headers=None):
+        """ One request on the pooled connection, retried once on a fresh connection if the old one was closed.
+        The connection is dropped on any failure, a timeout can leave an unread response on it."""
+        for attempt in range(2):
+            conn = self._connection(address)
+            try:
+                conn.request(method, path, body, headers or {})
+                response = conn.getresponse()
+                return response.status, dict(response.getheaders()), response.read()
+            except REQUEST_ERRORS as error:
+                self._drop_connection(address)
+                stale = isinstance(error, (http.client.HTTPException, ConnectionError))
+                if attempt == 1 or not stale:
+                    raise
+                self.stats["reconnects"] += 1
+
+    def close(self):
+        for address in list(self.connections):
+            self._drop_connection(address)
+
+    # Ring layout
+
+    def learn(self, address):
+        """ Ask a node for its position and range, returns False if it does not answer"""
+        try:
+            status, _, body = self._request(address, "GET", "/ring/local")
+        except REQUEST_ERRORS:
+            self.forget(address)
+            return False
+        if status != 200:
+            self.forget(address)
+            return False
+
+        try:
+            node = json.loads(body)
+            self.ring[address] = (node["position"], node["range"])
+        except (ValueError, KeyError):
+            self.forget(address)
+            return False
+        return True
+
+    def forget(self, address):
+        self.ring.pop(address, None)
+        self._drop_connection(address)
+
+    def learn_snapshot(self, address):
+        """ Learn every alive member from one node's gossiped view, returns False if the view is not
+        complete, so that the caller can fall back to asking the nodes one by one"""
+        try:
+            status, _, body = self._request(address, "GET", "/ring/snapshot")
+        except REQUEST_ERRORS:
+            return False
+        if status != 200:
+            return False
+
+        try:
+            snapshot = json.loads(body)
+        except ValueError:
+            return False
+        if not snapshot["complete"]:
+            return False
+        for member in snapshot["members"]:
+            if member["alive"]:
+                self.ring[f"{member['hostname']}:{member['port']}"] = (member["position"], member["range"])
+        return True
+
+    def refresh(self):
+        """ Drop the cache and learn the ring again, from the view of one seed node if it knows the
+        whole ring, otherwise from the seed nodes and their successor lists"""
+        self.ring = {}
+        for address in self.seed_nodes:
+            if self.learn_snapshot(address):
+                return
+        for address in self.seed_nodes:
+            if not self.learn(address):
+                continue
+            try:
+                status, _, body = self._request(address, "GET", "/ring/successor_list")
+                successors = json.loads(body) if status == 200 else []
+            except (*REQUEST_ERRORS, ValueError):
+                continue
+            for node in successors:
+                self.learn(f"{node['hostname']}:{node['port']}")
+
+    def _cached_owner(self, location):
+        for address, (position, range_) in self.ring.items():
+            if is_location_in_range(location, position, range_):
+                return address
+        return None
+
+    def _lookup_owner(self, location):
+        """ Follow /ring/lookup from a known node until the owner answers"""
+        self.stats["lookups"] += 1
+        start_nodes = list(self.ring) + self.seed_nodes
+
+        for address in start_nodes:
+            try:
+                for _ in range(64):
+                    status, _, body = self._request(address, "GET", f"/ring/lookup/{location}")
+                    if status != 200:
+                        break
+                    lookup = json.loads(body)
+                    node = lookup["node"]
+                    address = f"{node['hostname']}:{node['port']}"
+                    if lookup["owner"]:
+                        self.ring[address] = (node["position"], node["range"])
+                        return address
+            except REQUEST_ERRORS:
+                self.forget(address)
+                continue
+            except (ValueError, KeyError):
+                # Not a lookup answer, try the next start node
+                continue
+
+        raise ConnectionError(f"No node could find the owner of location {location}")
+
+    def owner(self, key):
+        location = key_to_location(key)
+        address = self._cached_owner(location)
+        if address is not None:
+            self.stats["cache_hits"] += 1
+            return address
+        return self._lookup_owner(location)
+
+    # Storage
+
+    def _storage_request(self, key, method, body=None, headers=None):
+        path = "/storage/" + urllib.parse.quote(key, safe="")
+        headers = dict(headers or {})
+        headers["X-Routing-Mode"] = "redirect"
+        address = self.owner(key)
+
+        for _ in range(8):
+            self.stats["requests"] += 1
+            try:
+                status, response_headers, response_body = self._request(address, method, path, body, headers)
+            except REQUEST_ERRORS:
+                # The node is gone, find the new owner
+                self.forget(address)
+                address = self._lookup_owner(key_to_location(key))
+                continue
+
+            if status == 307:
+                # Our cache pointed at the wrong node, the redirect names a better one
+                self.stats["redirects"] += 1
+                self.ring.pop(address, None)
+                location = urllib.parse.urlsplit(response_headers.get("Location", ""))
+                address = location.netloc or response_body.decode("utf-8")
+                self.learn(address)
+                continue
+
+            if status == 503:
+                self.forget(address)
+                address = self._lookup_owner(key_to_location(key))
+                continue
+
+            return status, response_body
+
+        raise ConnectionError(f"Gave up on {method} {key} after repeated redirects and failures")
+
+    def get(self, key):
+        """ Value of the key as a string, None if it is not stored"""
+        status, body = self._storage_request(key, "GET")
+        if status == 404:
+            return None
+        if status != 200:
+            raise RuntimeError(f"GET {key} failed with status {status}: {body!r}")
+        return body.decode("utf-8")
+
+    def put(self, key, value, consistency=None):
+        headers = {"Content-Type": "text/plain"}
+        if consistency is not None:
+            headers["X-Consistency-Level"] = consistency
+        status, body = self._storage_request(key, "PUT", value.encode("utf-8"), headers)
+        if status != 200:
+            raise RuntimeError(f"PUT {key} failed with status {status}: {body!r}")
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2: print(f"Usage: python3 {sys.argv[0]} <host:port> [host:port ...]") ; sys.exit(1)
+
+    client = ChordClient(sys.argv[1:])
+    client.refresh()
+    print(f"Learned {len(client.ring)} nodes")
+
+    pairs = {str(uuid.uuid4()): str(uuid.uuid4()) for _ in range(100)}
+    for key, value in pairs.items():
+        client.put(key, value)
+    correct = sum(1 for key, value in pairs.items() if client.get(key) == value)
+
+    print(f"{correct}/{len(pairs)} values read back correctly")
+    print(client.stats)
+    client.close()
@@ -1,20 +1,32 @@
 import os
 import re
+import sys
 import json
 import time
-import urllib.error
-import urllib.request
+import uuid
 import random
-
-MAX_NODES = 4
-MAX_CRASHED_NODES = 4
+import argparse
+import threading
+import http.client
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from local_cluster import LocalCluster
+
+CLUSTER_SIZES = [8, 16]
+BURST_SIZES = [1, 2, 3]
+REPETITIONS = 3
+PROBE_KEYS = 100
+POLL_INTERVAL = 0.02
+REPAIR_TIMEOUT = 60
+BASELINE_SECONDS = 1
+REQUEST_TIMEOUT = 2
 
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
-def start_nodes():
-    print(f'Starting {MAX_NODES} nodes...')
+def start_nodes(count):
+    print(f'Starting {count} nodes...')
     try:
-        nodesstr = os.popen(f"sh {os.path.join(SCRIPT_DIR, '../src/run-unjoined.sh')} {MAX_NODES}").read()
+        nodesstr = os.popen(f"sh {os.path.join(SCRIPT_DIR, '../src/run-unjoined.sh')} {count}").read()
     except PermissionError as e:
         print(f'Error: {e}')
         return []
@@ -23,132 +35,217 @@ def start_nodes():
     nodes = json.loads(nodesmatch[0])
     return nodes
 
-def initialize_network(nodes):
-    print("Initializing the network...")
-    n_prime = nodes[0]
-    for i in range(1, len(nodes)):
-        try: 
-            join_url = f"http://{nodes[i]}/join?nprime={n_prime}"
-            req = urllib.request.Request(url=join_url, method="POST")
-            urllib.request.urlopen(req)
-            print(f"Node {nodes[i]} joined network.")
-        except Exception as e: 
-            print(f"Error initializing node {nodes[i]}: {e}")
-    print("Network Initialized") 
+def request(node, method, path, body=None, headers=None):
+    """ One request on a fresh connection, returns (status, body) or (None, None) if the node did not answer"""
+    try:
+        conn = http.client.HTTPConnection(node, timeout=REQUEST_TIMEOUT)
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        result = response.status, response.read()
+        conn.close()
+        return result
+    except (OSError, http.client.HTTPException):
+        return None, None
+
+def form_ring(members):
+    body = json.dumps({"members": members})
+    status, response = request(members[0], "POST", "/network/form", body, {"Content-Type": "application/json"})
+    if status != 200:
+        raise RuntimeError(f"Could not form ring of {len(members)} nodes: {status} {response}")
 
 def crash_node(node):
-    print(f'Crashing node: {node}')
-    try: 
-        crash_url = f"http://{node}/sim-crash"
-        req = urllib.request.Request(url=crash_url, method="POST")
-        urllib.request.urlopen(req)
-    except Exception as e:
-        print(f"Error crashing node {node}: {e}")
+    request(node, "POST", "/sim-crash")
 
 def recover_node(node):
-    print(f'Recovering node: {node}')
-    try: 
-        recover_url = f"http://{node}/sim-recover"
-        req = urllib.request.Request(url=recover_url, method="POST")
-        urllib.request.urlopen(req)
-    except Exception as e:
-        print(f"Error recovering node {node}: {e}")
+    request(node, "POST", "/sim-recover")
 
 def get_node_info(node):
-    """Get node information such as node_hash, successor, and others."""
-    try:
-        node_info_url = f"http://{node}/node-info"
-        response = urllib.request.urlopen(node_info_url)
-        data = json.loads(response.read().decode())
-        return data
-    except urllib.error.HTTPError as e:
-        if e.code == 503:
-            print(f"Node {node} is currently crashed.")
-            return None
-        else:
-            print(f"Error getting node info for {node}: {e}")
-    except Exception as e:
-        print(f"General error getting node info for {node}: {e}")
-    return None
-
-def validate_network(nodes):
-    """Validate that the network is stable by checking successor/predecessor relationships."""
-    all_ok = True
+    """Get node information such as node_hash, successor, and others, or None if the node is crashed."""
+    status, body = request(node, "GET", "/node-info")
+    return json.loads(body) if status == 200 else None
+
+def reported_addresses(nodes):
+    """ The address every node uses for itself in /node-info, which may differ from the one we reach it on"""
+    addresses = {}
     for node in nodes:
-        info = get_node_info(node)
-        if not info:
-            continue
-        successor = info['successor']
-        others = info['others']
-        if not (successor and others):
-            print(f"Node {node} has inconsistent state: Successor: {successor}, Others: {others}")
-            all_ok = False
-    return all_ok
-
-def test_burst_crashes(nodes, max_crashes):
-    results = []
-    for burst_size in range(1, max_crashes + 1):
-        print(f"Testing burst of {burst_size} node(s) crash...")
-        crashed_nodes = random.sample(nodes, burst_size)
-
-        # Simulate burst of crashes 
-        for node in crashed_nodes:
-            crash_node(node)
-            time.sleep(1)
-            if get_node_info(node) is not None:
-                print(f"Node {node} is still operational after crash attempt.")
-                results.append("no")
-                break
-        else:
-            # Allow time for the network to stabilize after crashes
-            time.sleep(5)
-
-            # Validate the network state after the crashes
-            if validate_network([node for node in nodes if node not in crashed_nodes]):
-                # Attempt to recover nodes
-                for node in crashed_nodes:
-                    recover_node(node)
-                    time.sleep(1)
-                    if get_node_info(node) is None:
-                        print(f"Node {node} did not recover correctly.")
-                        results.append("no")
-                        break
-                else:
-                    # Allow time for the network to stabilize after recovery
-                    time.sleep(5)
-
-                    # Validate the network state after recovery
-                    if validate_network(nodes):
-                        results.append("ok")
-                    else:
-                        results.append("no")
+        status, body = request(node, "GET", "/ring/local")
+        local = json.loads(body)
+        addresses[node] = f"{local['hostname']}:{local['port']}"
+    return addresses
+
+class StorageLoad(threading.Thread):
+    """ Reads and writes keys through the surviving nodes for the whole burst, and records every
+    request so the error rate and latency can be split into before and during the repair"""
+    def __init__(self, nodes, probes):
+        super().__init__(daemon=True)
+        self.nodes = nodes
+        self.probes = probes
+        self.samples = []
+        self.running = True
+
+    def run(self):
+        keys = list(self.probes)
+        while self.running:
+            node = random.choice(self.nodes)
+            start_time = time.time()
+            if random.random() < 0.8:
+                key = random.choice(keys)
+                status, body = request(node, "GET", f"/storage/{key}")
+                ok = status == 200 and body == self.probes[key]
             else:
-                results.append("no")
-
-        # If the last test resulted in "no", stop further testing
-        if results[-1] == "no":
-            break
-
-    # Print all results at the end
-    for i, result in enumerate(results, 1):
-        print(f"burst of node(s) {i}: {result}")
+                status, _ = request(node, "PUT", f"/storage/repair-{uuid.uuid4()}", "x", {"Content-Type": "text/plain"})
+                ok = status == 200
+            self.samples.append((start_time, time.time() - start_time, ok))
+
+    def window(self, start_time, end_time):
+        samples = [sample for sample in self.samples if start_time <= sample[0] < end_time]
+        latencies = [latency for _, latency, ok in samples if ok]
+        return {
+            'requests': len(samples),
+            'error_rate': np.round(1 - len(latencies) / len(samples), 4) if samples else None,
+            'latency_p50_ms': np.round(np.percentile(latencies, 50) * 1000, 3) if latencies else None,
+            'latency_p99_ms': np.round(np.percentile(latencies, 99) * 1000, 3) if latencies else None
+        }
+
+def ring_state(survivors, crashed, addresses, executor):
+    """ Polls /node-info on every survivor at once. Returns whether no survivor points at a crashed node
+    any more (detected), and whether the survivors form a correct ring on their own (repaired)."""
+    infos = list(executor.map(get_node_info, survivors))
+    if any(info is None for info in infos):
+        return False, False
+
+    crashed_addresses = {addresses[node] for node in crashed}
+    detected = all(info['successor'] not in crashed_addresses for info in infos)
+
+    # Neighbours by position, node_hash is the position of the node
+    ring = sorted(zip(infos, survivors), key=lambda entry: int(entry[0]['node_hash']))
+    repaired = detected
+    for i, (info, _node) in enumerate(ring):
+        successor = addresses[ring[(i + 1) % len(ring)][1]]
+        precessor = addresses[ring[i - 1][1]]
+        if info['successor'] != successor or not info['others'] or info['others'][0] != precessor:
+            repaired = False
+    return detected, repaired
+
+def write_probes(members):
+    probes = {}
+    for _ in range(PROBE_KEYS):
+        key, value = str(uuid.uuid4()), str(uuid.uuid4()).encode("utf-8")
+        status, _ = request(random.choice(members), "PUT", f"/storage/{key}", value, {"Content-Type": "text/plain"})
+        if status == 200:
+            probes[key] = value
+    return probes
+
+def crash_burst(nodes, addresses, cluster_size, burst_size):
+    """ Forms a fresh ring, crashes burst_size of its nodes at once and times detection and repair"""
+    members = nodes[:cluster_size]
+    for node in nodes:
+        recover_node(node)
+    # Nodes outside this ring are formed on their own, so they leave its members alone
+    for node in nodes[cluster_size:]:
+        form_ring([node])
+    form_ring(members)
+
+    crashed = random.sample(members, burst_size)
+    survivors = [node for node in members if node not in crashed]
+    probes = write_probes(survivors)
+
+    load = StorageLoad(survivors, probes)
+    load.start()
+    time.sleep(BASELINE_SECONDS)
+
+    with ThreadPoolExecutor(max_workers=max(len(members), 1)) as executor:
+        crash_time = time.time()
+        list(executor.map(crash_node, crashed))
+
+        detection = None
+        repair = None
+        while time.time() - crash_time < REPAIR_TIMEOUT:
+            detected, repaired = ring_state(survivors, crashed, addresses, executor)
+            now = time.time()
+            if detected and detection is None:
+                detection = now - crash_time
+            if repaired:
+                repair = now - crash_time
+                break
+            time.sleep(POLL_INTERVAL)
+    end_time = time.time()
+
+    load.running = False
+    load.join()
+
+    return {
+        'cluster_size': cluster_size,
+        'burst_size': burst_size,
+        'detection_s': np.round(detection, 3) if detection is not None else None,
+        'repair_s': np.round(repair, 3) if repair is not None else None,
+        'baseline': load.window(crash_time - BASELINE_SECONDS, crash_time),
+        'during_repair': load.window(crash_time, end_time)
+    }
+
+def summarize(trials):
+    detection = [trial['detection_s'] for trial in trials if trial['detection_s'] is not None]
+    repair = [trial['repair_s'] for trial in trials if trial['repair_s'] is not None]
+    error_rates = [trial['during_repair']['error_rate'] for trial in trials if trial['during_repair']['error_rate'] is not None]
+    p99 = [trial['during_repair']['latency_p99_ms'] for trial in trials if trial['during_repair']['latency_p99_ms'] is not None]
+    return {
+        'cluster_size': trials[0]['cluster_size'],
+        'burst_size': trials[0]['burst_size'],
+        'trials': len(trials),
+        'detection_avg_s': np.round(np.mean(detection), 3) if detection else None,
+        'repair_avg_s': np.round(np.mean(repair), 3) if repair else None,
+        'repair_max_s': max(repair) if repair else None,
+        'unrepaired': len(trials) - len(repair),
+        'error_rate_avg': np.round(np.mean(error_rates), 4) if error_rates else None,
+        'latency_p99_ms_avg': np.round(np.mean(p99), 3) if p99 else None
+    }
 
 def shutdown_nodes(nodes):
     for node in nodes:
-        try:
-            shutdown_url = f"http://{node}/shutdown"
-            req = urllib.request.Request(url=shutdown_url)
-            urllib.request.urlopen(req)
-            print(f"Node {node} shut down.")
-        except Exception as e:
-            print(f"Error shutting down node {node}: {e}")
+        request(node, "GET", "/shutdown")
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Times crash detection and ring repair, and storage errors while it happens, printed as JSON")
+    parser.add_argument("--nodes", help="JSON list of started nodes, as many as the largest cluster size. Started with run-unjoined.sh if not given")
+    parser.add_argument("--local", action="store_true", help="Start the nodes on this machine with local_cluster.py instead")
+    parser.add_argument("--cluster-sizes", type=json.loads, default=CLUSTER_SIZES, help="e.g. '[8, 16]'")
+    parser.add_argument("--burst-sizes", type=json.loads, default=BURST_SIZES, help="Nodes crashed at once, e.g. '[1, 2, 3]'")
+    parser.add_argument("--repetitions", type=int, default=REPETITIONS)
+    parser.add_argument("--output", help="Write the JSON result to this file as well")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    nodes = start_nodes()
-    
-    if nodes: 
-        initialize_network(nodes)
-        test_burst_crashes(nodes, MAX_CRASHED_NODES)
+    args = parse_args(sys.argv[1:])
+    cluster = None
+    if args.local:
+        cluster = LocalCluster(max(args.cluster_sizes))
+        print(f"Started {cluster.count} local nodes in {cluster.start()['total_s']} s", file=sys.stderr)
+        nodes = cluster.nodes
+    else:
+        nodes = json.loads(args.nodes) if args.nodes else start_nodes(max(args.cluster_sizes))
+    addresses = reported_addresses(nodes)
+
+    trials = []
+    summary = []
+    for cluster_size in args.cluster_sizes:
+        for burst_size in args.burst_sizes:
+            if burst_size >= cluster_size:
+                continue
+            print(f"Crashing {burst_size} of {cluster_size} nodes, {args.repetitions} times...", file=sys.stderr)
+            runs = [crash_burst(nodes, addresses, cluster_size, burst_size) for _ in range(args.repetitions)]
+            trials += runs
+            summary.append(summarize(runs))
+
+    for node in nodes:
+        recover_node(node)
+
+    output = {'summary': summary, 'trials': trials}
+    print(json.dumps(output, indent=2, default=float))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=2, default=float)
+
+    if cluster is not None:
+        cluster.stop()
+    elif not args.nodes:
         shutdown_nodes(nodes)
-    else: 
-        print(f'No nodes')
@@ -0,0 +1,82 @@
+import os
+import sys
+import json
+import time
+import uuid
+import shutil
+import tempfile
+import subprocess
+import http.client
+import numpy as np
+
+FSYNC_MODES = ["always", "batched", "off"]
+KEY_COUNT = 5000
+VALUE_SIZE = 1024
+PORT = 58231
+
+# Get the absolute path of the current script directory
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_BINARY = os.path.join(SCRIPT_DIR, "../target/release/INF3200-1A")
+
+def start_node(binary, data_dir, fsync_mode):
+    env = dict(os.environ,
+               ROCKET_PORT=str(PORT), A1_HOSTNAME="localhost", A1_PORT=str(PORT),
+               A1_DATA_DIR=data_dir, A1_FSYNC=fsync_mode)
+    process = subprocess.Popen([binary], env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    # Time from launch until the node answers, this includes recovering the data directory
+    start_time = time.time()
+    while True:
+        try:
+            conn = http.client.HTTPConnection("localhost", PORT, timeout=1)
+            conn.request("GET", "/helloworld")
+            if conn.getresponse().status == 200:
+                return process, time.time() - start_time
+        except OSError:
+            time.sleep(0.01)
+
+def stop_node(process):
+    process.terminate()
+    process.wait()
+
+def write_throughput(pairs):
+    conn = http.client.HTTPConnection("localhost", PORT)
+    start_time = time.time()
+    for key, value in pairs:
+        conn.request("PUT", f"/storage/{key}", value, {"Content-Type": "text/plain"})
+        conn.getresponse().read()
+    return len(pairs) / (time.time() - start_time)
+
+def write_log_stats():
+    conn = http.client.HTTPConnection("localhost", PORT)
+    conn.request("GET", "/stats/write_log")
+    return json.loads(conn.getresponse().read())
+
+if __name__ == "__main__":
+    binary = sys.argv[1] if len(sys.argv) > 1 else DEFAULT_BINARY
+    value = "x" * VALUE_SIZE
+
+    results = []
+    for fsync_mode in FSYNC_MODES:
+        data_dir = tempfile.mkdtemp(prefix=f"a1-{fsync_mode}-")
+        pairs = [(str(uuid.uuid4()), value) for _ in range(KEY_COUNT)]
+
+        process, _ = start_node(binary, data_dir, fsync_mode)
+        writes_per_second = write_throughput(pairs)
+        stop_node(process)
+
+        # Restart on the same directory to measure recovery
+        process, restart_time = start_node(binary, data_dir, fsync_mode)
+        stats = write_log_stats()
+        stop_node(process)
+        shutil.rmtree(data_dir)
+
+        result = {
+            'fsync_mode': fsync_mode,
+            'writes_per_second': np.round(writes_per_second, 1),
+            'restart_seconds': np.round(restart_time, 3),
+            'recovered_keys': stats['recovered_keys'],
+            'recovery_ms': stats['recovery_ms']
+        }
+        print(f'{result}, ')
+        results.append(result)
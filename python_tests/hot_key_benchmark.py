@@ -0,0 +1,59 @@
+import sys
+import json
+import time
+import uuid
+import http.client
+import numpy as np
+
+KEY_COUNT = 1000
+READ_COUNT = 20000
+ZIPF_EXPONENT = 1.2
+
+def request(conn, method, path, body=None, headers=None):
+    conn.request(method, path, body, headers or {})
+    response = conn.getresponse()
+    return response.status, response.read()
+
+def read_cache_stats(node):
+    conn = http.client.HTTPConnection(node)
+    _, body = request(conn, "GET", "/stats/read_cache")
+    return json.loads(body)
+
+def skewed_reads(node, keys):
+    """ Reads keys picked from a Zipf distribution, so a few keys get most of the reads"""
+    conn = http.client.HTTPConnection(node)
+    ranks = np.random.zipf(ZIPF_EXPONENT, READ_COUNT) % len(keys)
+
+    latencies = []
+    for rank in ranks:
+        start_time = time.time()
+        status, _ = request(conn, "GET", "/storage/" + keys[rank])
+        latencies.append(time.time() - start_time)
+        if status != 200:
+            print(f"Read of {keys[rank]} failed with status {status}")
+    return latencies
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2: print(f"Usage: python3 {sys.argv[0]} <host:port>, with A1_READ_CACHE_BYTES set on the nodes") ; sys.exit(1)
+    node = sys.argv[1]
+
+    conn = http.client.HTTPConnection(node)
+    keys = [str(uuid.uuid4()) for _ in range(KEY_COUNT)]
+    for key in keys:
+        request(conn, "PUT", "/storage/" + key, str(uuid.uuid4()), {"Content-Type": "text/plain"})
+
+    before = read_cache_stats(node)
+    latencies = skewed_reads(node, keys)
+    after = read_cache_stats(node)
+
+    hits = after["hits"] - before["hits"]
+    misses = after["misses"] - before["misses"]
+    result = {
+        'reads': len(latencies),
+        'latency_avg_ms': np.round(np.mean(latencies) * 1000, 3),
+        'latency_p99_ms': np.round(np.percentile(latencies, 99) * 1000, 3),
+        'cache_hit_rate': np.round(hits / max(hits + misses, 1), 3),
+        'cache_entries': after["entries"],
+        'cache_bytes': after["bytes"]
+    }
+    print(result)
@@ -1,116 +1,298 @@
 import os
 import re
+import sys
 import json
 import time
-import statistics
-import urllib.request
+import uuid
+import random
+import argparse
+import threading
+import http.client
 import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from local_cluster import LocalCluster
 
-RESULTS_FILE = "res.txt"
-ITERATIONS = 1000
 NODE_COUNTS = [2, 4, 8, 16, 32]
 MAX_NODES = max(NODE_COUNTS)
+ITERATIONS = 3
+PROBE_KEYS = 50
+CONVERGENCE_TIMEOUT = 60
+POLL_INTERVAL = 0.05
+REQUEST_TIMEOUT = 5
+
+# Must match RING_SIZE in src/main.rs
+RING_SIZE = 65535
 
 # Get the absolute path of the current script directory
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 
-
-
 def start_nodes():
-    print("Starting 32 nodes...")
+    print(f"Starting {MAX_NODES} nodes...")
     try:
         nodesstr = os.popen(f" sh {os.path.join(SCRIPT_DIR, '../src/run-unjoined.sh')} {MAX_NODES}").read()
     except PermissionError as e:
         print(f'error {e}')
-    # print("nodes started")
 
     nodesmatch = re.findall("\\[.*\\]", nodesstr)
     nodes = json.loads(nodesmatch[0])
 
     return nodes
 
-def join_nodes(nodes):
-    n_prime = nodes[0]
-    node_count = 1 
-    join_times = [] 
+def request(node, method, path, body=None, headers=None):
+    """ One request on a fresh connection, returns (status, body) or (None, None) if the node did not answer"""
+    try:
+        conn = http.client.HTTPConnection(node, timeout=REQUEST_TIMEOUT)
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        result = response.status, response.read()
+        conn.close()
+        return result
+    except (OSError, http.client.HTTPException):
+        return None, None
 
-    for target_node_count in NODE_COUNTS:
-        # print(f"Target node count: {target_node_count}")
-        join_start_time = time.time()
-        while node_count < target_node_count:
-            # print(f"Joining {nodes[node_count-1]} to {n_prime}") 
-            join_url = f"http://{nodes[node_count-1]}/join?nprime={n_prime}"
-            req = urllib.request.Request(url=join_url, method="POST")
+def get_json(node, path):
+    status, body = request(node, "GET", path)
+    return json.loads(body) if status == 200 else None
+
+def join(node, n_prime):
+    """ Returns how long the join request took and whether it succeeded"""
+    start_time = time.time()
+    status, body = request(node, "POST", f"/join?nprime={n_prime}")
+    if status != 200:
+        print(f"Join of {node} failed: {status} {body}")
+    return time.time() - start_time, status == 200
+
+def leave(node):
+    start_time = time.time()
+    status, body = request(node, "POST", "/leave")
+    if status != 200:
+        print(f"Leave of {node} failed: {status} {body}")
+    return time.time() - start_time, status == 200
+
+def pointers_agree(members):
+    """ True when every member's successor and predecessor are its neighbours by position, and the
+    ranges of the members cover the ring exactly once"""
+    locals_ = {}
+    for member in members:
+        local = get_json(member, "/ring/local")
+        if local is None:
+            return False
+        locals_[member] = local
+
+    positions = sorted(local["position"] for local in locals_.values())
+    if len(set(positions)) != len(positions) or sum(local["range"] for local in locals_.values()) != RING_SIZE:
+        return False
+
+    for member, local in locals_.items():
+        index = positions.index(local["position"])
+        successor = get_json(member, "/ring/successor")
+        precessor = get_json(member, "/ring/precessor")
+        if successor is None or precessor is None:
+            return False
+        if successor["position"] != positions[(index + 1) % len(positions)]:
+            return False
+        if precessor["position"] != positions[index - 1]:
+            return False
+    return True
+
+def keys_reachable(members, probes):
+    """ True when every probe key can be read back, each from a random member"""
+    for key, value in probes.items():
+        status, body = request(random.choice(members), "GET", f"/storage/{key}")
+        if status != 200 or body != value:
+            return False
+    return True
 
-            node_count += 1
+def wait_for_convergence(members, probes, started_at):
+    """ Seconds from started_at until the ring over members is consistent again, or None on timeout"""
+    while time.time() - started_at < CONVERGENCE_TIMEOUT:
+        if pointers_agree(members) and keys_reachable(members, probes):
+            return time.time() - started_at
+        time.sleep(POLL_INTERVAL)
+    return None
 
-        join_end_time = time.time()
-        join_times.append(join_end_time - join_start_time)
-    print(f' join times {join_times}')
+class AvailabilityProbe(threading.Thread):
+    """ Keeps reading and writing keys through the members that are not churning, and records how
+    every request went so the window of each operation can be looked at afterwards"""
+    def __init__(self, probes):
+        super().__init__(daemon=True)
+        self.probes = probes
+        self.stable_members = []
+        self.samples = []
+        self.lock = threading.Lock()
+        self.running = True
 
-    return join_times
-    
-def leave_nodes(nodes):
-    leave_times = [] 
-    node_count = NODE_COUNTS[-1]
+    def set_stable_members(self, members):
+        with self.lock:
+            self.stable_members = list(members)
 
-    for target_node_count in reversed(NODE_COUNTS):
-        # print(f"Target node count: {target_node_count}")
+    def run(self):
+        keys = list(self.probes)
+        while self.running:
+            with self.lock:
+                members = list(self.stable_members)
+            if not members:
+                time.sleep(POLL_INTERVAL)
+                continue
 
-        leave_start_time = time.time()
-        while node_count > target_node_count: 
-            leave_url = f'https://{nodes[node_count-1]}/leave'
-            req = urllib.request.Request(url=leave_url, method="POST")
+            node = random.choice(members)
+            start_time = time.time()
+            if random.random() < 0.5:
+                key = random.choice(keys)
+                status, body = request(node, "GET", f"/storage/{key}")
+                ok = status == 200 and body == self.probes[key]
+            else:
+                status, _ = request(node, "PUT", f"/storage/availability-{uuid.uuid4()}", "x",
+                                    {"Content-Type": "text/plain"})
+                ok = status == 200
+            self.samples.append((start_time, time.time() - start_time, ok))
 
-            node_count -= 1
-        leave_end_time = time.time()
-        leave_times.append(leave_end_time - leave_start_time)
-    print(f' leave times {leave_times}')
+    def window(self, start_time, end_time):
+        samples = [sample for sample in self.samples if start_time <= sample[0] <= end_time]
+        latencies = [latency for _, latency, ok in samples if ok]
+        return {
+            'requests': len(samples),
+            'availability': np.round(len(latencies) / len(samples), 4) if samples else None,
+            'latency_p99_ms': np.round(np.percentile(latencies, 99) * 1000, 3) if latencies else None
+        }
 
-    return leave_times
+def churn(phase, operation, churning, members_after, stable, probes, availability):
+    """ Runs the joins or leaves of one step together, then waits until the ring has converged"""
+    availability.set_stable_members(stable)
+    start_time = time.time()
+    with ThreadPoolExecutor(max_workers=len(churning)) as executor:
+        outcomes = list(executor.map(operation, churning))
+    convergence = wait_for_convergence(members_after, probes, start_time)
+    end_time = time.time()
+
+    return {
+        'phase': phase,
+        'nodes': len(members_after),
+        'changed': len(churning),
+        'request_latencies': [np.round(latency, 4) for latency, _ in outcomes],
+        'failed_requests': sum(1 for _, ok in outcomes if not ok),
+        'convergence_s': np.round(convergence, 4) if convergence is not None else None,
+        **availability.window(start_time, end_time)
+    }
+
+def grow_and_shrink(nodes, probes, availability, batch_size):
+    """ Joins nodes until each count in NODE_COUNTS is reached, then leaves back down to one.
+    batch_size nodes join or leave at the same time, 1 runs every operation on its own."""
+    n_prime = nodes[0]
+    members = [n_prime]
+    joins = []
+    leaves = []
+
+    # A phase is named by the larger ring size it grows to or shrinks from
+    for target_node_count in NODE_COUNTS:
+        while len(members) < target_node_count:
+            batch = nodes[len(members):min(target_node_count, len(members) + batch_size)]
+            step = churn(target_node_count, lambda node: join(node, n_prime), batch, members + batch,
+                         members, probes, availability)
+            members += batch
+            joins.append(step)
+
+    for phase, target_node_count in reversed(list(zip(NODE_COUNTS, [1] + NODE_COUNTS[:-1]))):
+        while len(members) > target_node_count:
+            batch = members[max(target_node_count, len(members) - batch_size):]
+            remaining = members[:len(members) - len(batch)]
+            step = churn(phase, leave, batch, remaining, remaining, probes, availability)
+            members = remaining
+            leaves.append(step)
+
+    return joins, leaves
+
+def write_probes(node):
+    """ Keys written into the one node ring before any churn, every one must stay readable"""
+    probes = {}
+    for _ in range(PROBE_KEYS):
+        key, value = str(uuid.uuid4()), str(uuid.uuid4()).encode("utf-8")
+        status, _ = request(node, "PUT", f"/storage/{key}", value, {"Content-Type": "text/plain"})
+        if status == 200:
+            probes[key] = value
+    return probes
+
+def summarize(steps, phase):
+    """ Per operation latency, and convergence and availability per step, over the steps of one phase"""
+    steps = [step for step in steps if step['phase'] == phase]
+    latencies = [latency for step in steps for latency in step['request_latencies']]
+    convergence = [step['convergence_s'] for step in steps if step['convergence_s'] is not None]
+    availability = [step['availability'] for step in steps if step['availability'] is not None]
+    return {
+        'avg': np.round(np.mean(latencies), 4) if latencies else None,
+        'std': np.round(np.std(latencies), 4) if latencies else None,
+        'convergence_avg': np.round(np.mean(convergence), 4) if convergence else None,
+        'convergence_timeouts': sum(1 for step in steps if step['convergence_s'] is None),
+        'availability_min': min(availability) if availability else None
+    }
 
 def shutdown_nodes(nodes):
     for node in nodes:
-        # print(f"Shutting down node: {node}")
-        response = urllib.request.urlopen(f"http://{node}/shutdown").read()
+        request(node, "GET", "/shutdown")
 
-def calculate_stats(times):
-    avg = sum(times) / len(times) if times else 0
-    std = statistics.stdev(times) if len(times) > 1 else 0
-    return avg, std
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Churn benchmark, prints join and leave latency, ring convergence and availability as JSON")
+    parser.add_argument("--nodes", help=f"JSON list of {MAX_NODES} unjoined nodes, started with run-unjoined.sh if not given")
+    parser.add_argument("--iterations", type=int, default=ITERATIONS)
+    parser.add_argument("--local", action="store_true", help="Start the nodes on this machine with local_cluster.py instead")
+    parser.add_argument("--batch-size", type=int, default=1, help="Nodes that join or leave at the same time")
+    parser.add_argument("--output", help="Write the JSON result to this file as well")
+    return parser.parse_args(argv)
 
 if __name__ == "__main__":
-    nodes = start_nodes()
-    # print(f'nodes: {nodes}')
-    all_join_times = {node_count: [] for node_count in NODE_COUNTS}
-    all_leave_times = {node_count: [] for node_count in NODE_COUNTS}
-    
-    for i in range(ITERATIONS): 
-        join_times = join_nodes(nodes)
-        leave_times = leave_nodes(nodes)
-        
-        for idx, node_count in enumerate(NODE_COUNTS):
-            all_join_times[node_count].append(join_times[idx])
-            all_leave_times[node_count].append(leave_times[idx])
+    args = parse_args(sys.argv[1:])
+    cluster = None
+    if args.local:
+        cluster = LocalCluster(MAX_NODES)
+        print(f"Started {MAX_NODES} local nodes in {cluster.start()['total_s']} s", file=sys.stderr)
+        nodes = cluster.nodes
+    else:
+        nodes = json.loads(args.nodes) if args.nodes else start_nodes()
 
+    probes = write_probes(nodes[0])
+    availability = AvailabilityProbe(probes)
+    availability.start()
+
+    all_joins = []
+    all_leaves = []
+    for i in range(args.iterations):
+        joins, leaves = grow_and_shrink(nodes, probes, availability, args.batch_size)
+        all_joins += joins
+        all_leaves += leaves
+    availability.running = False
+
+    # One row per node count, shaped like the rows plot/A2/plot_networktest_res.py reads
+    results = []
     for node_count in NODE_COUNTS:
-        join_avg = np.mean(all_join_times[node_count])
-        join_std = np.std(all_join_times[node_count])
-        leave_avg = np.mean(all_leave_times[node_count])
-        leave_std = np.std(all_leave_times[node_count])
-
-        result = {
-                'nodes': node_count,
-                'join_avg': join_avg,
-                'join_std': join_std,
-                'leave_avg': leave_avg,
-                'leave_std': leave_std
-            }
-        print(f'{result}, ')
-        
-        # print(f'Node count: {node_count}')
-        # print(f'  Join - Avg: {join_avg:.6f}, Std: {join_std:.6f}')
-        # print(f'  Leave - Avg: {leave_avg:.6f}, Std: {leave_std:.6f}')
-
-    shutdown_nodes(nodes)
+        join = summarize(all_joins, node_count)
+        leave = summarize(all_leaves, node_count)
+        results.append({
+            'nodes': node_count,
+            'join_avg': join['avg'],
+            'join_std': join['std'],
+            'leave_avg': leave['avg'],
+            'leave_std': leave['std'],
+            'join_convergence_avg': join['convergence_avg'],
+            'leave_convergence_avg': leave['convergence_avg'],
+            'convergence_timeouts': join['convergence_timeouts'] + leave['convergence_timeouts'],
+            'join_availability_min': join['availability_min'],
+            'leave_availability_min': leave['availability_min']
+        })
+
+    output = {
+        'batch_size': args.batch_size,
+        'iterations': args.iterations,
+        'probe_keys': len(probes),
+        'summary': results,
+        'joins': all_joins,
+        'leaves': all_leaves
+    }
+    print(json.dumps(output, indent=2, default=float))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(output, file, indent=2, default=float)
 
+    if cluster is not None:
+        cluster.stop()
+    elif not args.nodes:
+        shutdown_nodes(nodes)
@@ -0,0 +1,327 @@
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+import bisect
+
+PERCENTILES = [50, 95, 99, 99.9]
+CONNECT_TIMEOUT = 5
+REQUEST_TIMEOUT = 30
+
+class Connection:
+    """ A keep-alive HTTP/1.1 connection to one node, reopened when the node closes it"""
+    def __init__(self, node):
+        self.host, port = node.rsplit(":", 1)
+        self.port = int(port)
+        self.node = node
+        self.reader = None
+        self.writer = None
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host, self.port), CONNECT_TIMEOUT)
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, path, body=b"", headers=None):
+        if self.writer is None:
+            await self.open()
+
+        head = f"{method} {path} HTTP/1.1\r\nHost: {self.node}\r\nContent-Length: {len(body)}\r\n"
+        for name, value in (headers or {}).items():
+            head += f"{name}: {value}\r\n"
+        self.writer.write(head.encode("latin-1") + b"\r\n" + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionError("Connection closed by node")
+        status = int(status_line.split()[1])
+
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            response_headers[name.strip().lower()] = value.strip()
+
+        if response_headers.get("transfer-encoding", "").lower() == "chunked":
+            response_body = b""
+            while True:
+                size = int((await self.reader.readline()).split(b";")[0], 16)
+                chunk = await self.reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                response_body += chunk[:-2]
+        else:
+            response_body = await self.reader.readexactly(int(response_headers.get("content-length", 0)))
+
+        if response_headers.get("connection", "").lower() == "close":
+            self.close()
+        return status, response_body
+
+class ConnectionPool:
+    """ Idle connections per node, so every request after the first reuses one"""
+    def __init__(self):
+        self.idle = {}
+
+    async def request(self, node, method, path, body=b"", headers=None):
+        idle = self.idle.setdefault(node, [])
+        connection = idle.pop() if idle else Connection(node)
+        try:
+            result = await asyncio.wait_for(connection.request(method, path, body, headers), REQUEST_TIMEOUT)
+        except Exception:
+            connection.close()
+            raise
+        idle.append(connection)
+        return result
+
+    def close(self):
+        for connections in self.idle.values():
+            for connection in connections:
+                connection.close()
+        self.idle = {}
+
+class KeyChooser:
+    """ Picks keys either uniformly or by a Zipf distribution over their popularity rank"""
+    def __init__(self, keys, distribution, exponent):
+        self.keys = keys
+        self.cumulative = None
+        if distribution == "zipf":
+            total = 0.0
+            self.cumulative = []
+            for rank in range(1, len(keys) + 1):
+                total += 1.0 / rank ** exponent
+                self.cumulative.append(total)
+
+    def choose(self):
+        if self.cumulative is None:
+            return random.choice(self.keys)
+        index = bisect.bisect_left(self.cumulative, random.random() * self.cumulative[-1])
+        return self.keys[min(index, len(self.keys) - 1)]
+
+def parse_value_size(value):
+    """ A fixed size like 1024 or a range like 100-4096"""
+    low, _, high = value.partition("-")
+    return int(low), int(high or low)
+
+def percentile(sorted_values, p):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, int(round(p / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+def summarize(latencies):
+    """ Latency summary in milliseconds"""
+    latencies = sorted(latencies)
+    summary = {"count": len(latencies)}
+    summary["mean_ms"] = round(sum(latencies) / len(latencies) * 1000, 3) if latencies else None
+    for p in PERCENTILES:
+        value = percentile(latencies, p)
+        summary[f"p{str(p).replace('.', '')}_ms"] = round(value * 1000, 3) if value is not None else None
+    summary["max_ms"] = round(latencies[-1] * 1000, 3) if latencies else None
+    return summary
+
+class Recorder:
+    def __init__(self, interval):
+        self.interval = interval
+        self.start_time = None
+        self.latencies = {"GET": [], "PUT": []}
+        self.errors = {"GET": 0, "PUT": 0}
+        self.statuses = {}
+        self.timeline = {}
+
+    def record(self, method, latency, status):
+        succeeded = status is not None and 200 <= status < 300
+        self.statuses[str(status)] = self.statuses.get(str(status), 0) + 1
+        if succeeded:
+            self.latencies[method].append(latency)
+        else:
+            self.errors[method] += 1
+
+        bucket = self.timeline.setdefault(int((time.monotonic() - self.start_time) / self.interval), [[], 0])
+        if succeeded:
+            bucket[0].append(latency)
+        else:
+            bucket[1] += 1
+
+    def result(self, elapsed):
+        completed = sum(len(latencies) for latencies in self.latencies.values())
+        errors = sum(self.errors.values())
+        timeline = []
+        for index in sorted(self.timeline):
+            latencies, bucket_errors = self.timeline[index]
+            latencies.sort()
+            timeline.append({
+                "t_s": round(index * self.interval, 3),
+                "throughput_rps": round(len(latencies) / self.interval, 1),
+                "errors": bucket_errors,
+                "p50_ms": round(percentile(latencies, 50) * 1000, 3) if latencies else None,
+                "p99_ms": round(percentile(latencies, 99) * 1000, 3) if latencies else None
+            })
+        return {
+            "elapsed_s": round(elapsed, 3),
+            "completed": completed,
+            "errors": errors,
+            "throughput_rps": round(completed / elapsed, 1) if elapsed > 0 else None,
+            "latency": summarize([l for latencies in self.latencies.values() for l in latencies]),
+            "get": dict(summarize(self.latencies["GET"]), errors=self.errors["GET"]),
+            "put": dict(summarize(self.latencies["PUT"]), errors=self.errors["PUT"]),
+            "statuses": self.statuses,
+            "timeline": timeline
+        }
+
+class LoadGenerator:
+    def __init__(self, nodes, keys, read_ratio, distribution, zipf_exponent, value_size):
+        self.nodes = nodes
+        self.keys = keys
+        self.chooser = KeyChooser(keys, distribution, zipf_exponent)
+        self.read_ratio = read_ratio
+        self.value_size = value_size
+        self.pool = ConnectionPool()
+
+    def value(self):
+        return random.randbytes(random.randint(*self.value_size))
+
+    async def operation(self, recorder, scheduled_at=None):
+        """ One read or write on a random node. Open loop latency counts from when the request was due,
+        so a cluster that falls behind is charged for the queueing, not just the service time"""
+        key = self.chooser.choose()
+        node = random.choice(self.nodes)
+        started_at = scheduled_at if scheduled_at is not None else time.monotonic()
+        status = None
+        try:
+            if random.random() < self.read_ratio:
+                method = "GET"
+                status, _ = await self.pool.request(node, "GET", f"/storage/{key}")
+            else:
+                method = "PUT"
+                status, _ = await self.pool.request(node, "PUT", f"/storage/{key}", self.value(),
+                                                    {"Content-Type": "application/octet-stream"})
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+            pass
+        recorder.record(method, time.monotonic() - started_at, status)
+
+    async def preload(self, concurrency):
+        """ Writes every key once so reads find a value"""
+        queue = list(self.keys)
+        failed = 0
+
+        async def worker():
+            nonlocal failed
+            while queue:
+                key = queue.pop()
+                try:
+                    status, _ = await self.pool.request(random.choice(self.nodes), "PUT", f"/storage/{key}",
+                                                        self.value(), {"Content-Type": "application/octet-stream"})
+                    failed += status != 200
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError):
+                    failed += 1
+
+        start_time = time.monotonic()
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+        return {"keys": len(self.keys), "failed": failed, "elapsed_s": round(time.monotonic() - start_time, 3)}
+
+    async def closed_loop(self, recorder, concurrency, duration):
+        """ Each worker sends its next request as soon as the last one is answered"""
+        deadline = time.monotonic() + duration
+
+        async def worker():
+            while time.monotonic() < deadline:
+                await self.operation(recorder)
+
+        await asyncio.gather(*[worker() for _ in range(concurrency)])
+
+    async def open_loop(self, recorder, concurrency, duration, rate):
+        """ Requests arrive at a fixed rate however fast they are answered, with at most concurrency in flight"""
+        in_flight = asyncio.Semaphore(concurrency)
+        tasks = set()
+        start_time = time.monotonic()
+
+        async def bounded(scheduled_at):
+            async with in_flight:
+                await self.operation(recorder, scheduled_at)
+
+        sent = 0
+        while sent < duration * rate:
+            scheduled_at = start_time + sent / rate
+            delay = scheduled_at - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            task = asyncio.create_task(bounded(scheduled_at))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            sent += 1
+        await asyncio.gather(*tasks)
+
+async def run_load(nodes, mode="closed", concurrency=64, rate=1000, duration=10, read_ratio=0.9,
+                   key_count=1000, distribution="uniform", zipf_exponent=1.1, value_size=(1024, 1024),
+                   interval=1.0, preload=True):
+    """ Runs one load test against the nodes and returns the result as a dict"""
+    keys = [str(uuid.uuid4()) for _ in range(key_count)]
+    generator = LoadGenerator(nodes, keys, read_ratio, distribution, zipf_exponent, value_size)
+
+    result = {
+        "config": {
+            "nodes": nodes, "mode": mode, "concurrency": concurrency,
+            "rate_rps": rate if mode == "open" else None, "duration_s": duration,
+            "read_ratio": read_ratio, "keys": key_count, "distribution": distribution,
+            "zipf_exponent": zipf_exponent if distribution == "zipf" else None,
+            "value_size": list(value_size)
+        }
+    }
+    try:
+        if preload:
+            result["preload"] = await generator.preload(concurrency)
+
+        recorder = Recorder(interval)
+        recorder.start_time = time.monotonic()
+        if mode == "open":
+            await generator.open_loop(recorder, concurrency, duration, rate)
+        else:
+            await generator.closed_loop(recorder, concurrency, duration)
+        result.update(recorder.result(time.monotonic() - recorder.start_time))
+    finally:
+        generator.pool.close()
+    return result
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Load generator for the storage API, prints the result as JSON")
+    parser.add_argument("nodes", help="JSON list of host:port, or a comma separated list")
+    parser.add_argument("--mode", choices=["closed", "open"], default="closed",
+                        help="closed: fixed number of clients, open: fixed arrival rate")
+    parser.add_argument("--concurrency", type=int, default=64, help="Clients, or the most requests in flight for open loop")
+    parser.add_argument("--rate", type=float, default=1000, help="Requests per second for open loop")
+    parser.add_argument("--duration", type=float, default=10, help="Seconds of load after the preload")
+    parser.add_argument("--read-ratio", type=float, default=0.9, help="Share of requests that are GETs")
+    parser.add_argument("--keys", type=int, default=1000, help="Distinct keys")
+    parser.add_argument("--distribution", choices=["uniform", "zipf"], default="uniform", help="Key popularity")
+    parser.add_argument("--zipf-exponent", type=float, default=1.1)
+    parser.add_argument("--value-size", type=parse_value_size, default=(1024, 1024),
+                        help="Value size in bytes, fixed (1024) or a range (100-4096)")
+    parser.add_argument("--interval", type=float, default=1.0, help="Seconds per point of the throughput timeline")
+    parser.add_argument("--no-preload", action="store_true", help="Skip writing every key before the run")
+    parser.add_argument("--output", help="Write the JSON result to this file as well")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    nodes = json.loads(args.nodes) if args.nodes.startswith("[") else args.nodes.split(",")
+
+    result = asyncio.run(run_load(
+        nodes, mode=args.mode, concurrency=args.concurrency, rate=args.rate, duration=args.duration,
+        read_ratio=args.read_ratio, key_count=args.keys, distribution=args.distribution,
+        zipf_exponent=args.zipf_exponent, value_size=args.value_size, interval=args.interval,
+        preload=not args.no_preload))
+
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(result, file, indent=2)
@@ -0,0 +1,217 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import json
+import time
+import socket
+import shutil
+import signal
+import atexit
+import argparse
+import tempfile
+import subprocess
+import http.client
+
+READY_TIMEOUT = 30
+POLL_INTERVAL = 0.02
+STOP_TIMEOUT = 5
+REQUEST_TIMEOUT = 2
+
+# Get the absolute path of the current script directory
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.join(SCRIPT_DIR, "..")
+DEFAULT_BINARY = os.path.join(REPO_DIR, "target/release/INF3200-1A")
+
+def build_binary():
+    """ Builds the release binary the cluster runs by default"""
+    subprocess.run(["cargo", "build", "--release"], cwd=REPO_DIR, check=True)
+
+def free_ports(count):
+    """ Ports nothing listens on right now, the sockets are held until all are picked so none repeats"""
+    sockets = []
+    try:
+        for _ in range(count):
+            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            sock.bind(("localhost", 0))
+            sockets.append(sock)
+        return [sock.getsockname()[1] for sock in sockets]
+    finally:
+        for sock in sockets:
+            sock.close()
+
+def request(node, method, path, body=None, headers=None):
+    """ One request on a fresh connection, returns (status, body) or (None, None) if the node did not answer"""
+    try:
+        conn = http.client.HTTPConnection(node, timeout=REQUEST_TIMEOUT)
+        conn.request(method, path, body, headers or {})
+        response = conn.getresponse()
+        result = response.status, response.read()
+        conn.close()
+        return result
+    except (OSError, http.client.HTTPException):
+        return None, None
+
+class LocalCluster(object):
+    """ Runs N nodes as processes on localhost, for benchmarks on one machine without the cluster scripts.
+
+        with LocalCluster(8, form=True) as cluster:
+            run_benchmark(cluster.nodes)
+
+    Every node gets its own free port and a log file in a temporary directory, which is kept if a node
+    fails to start so the reason can be read. Extra environment variables, e.g. A1_REPLICATION_FACTOR,
+    are passed to every node. With durable=True every node also gets its own A1_DATA_DIR.
+    """
+
+    def __init__(self, count, binary=DEFAULT_BINARY, form=False, env=None, durable=False,
+                 ready_timeout=READY_TIMEOUT):
+        self.count = count
+        self.binary = binary
+        self.form_ring = form
+        self.env = dict(env or {})
+        self.durable = durable
+        self.ready_timeout = ready_timeout
+        self.nodes = []
+        self.processes = []
+        self.work_dir = None
+        self.timings = {}
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """ Launches every node, waits until all answer /helloworld and forms the ring if asked to.
+        Stops whatever was started and raises RuntimeError if a node exits or does not become ready."""
+        if not os.access(self.binary, os.X_OK):
+            raise RuntimeError(f"No node binary at {self.binary}, build it with cargo build --release or pass --build")
+
+        self.work_dir = tempfile.mkdtemp(prefix="a1-cluster-")
+        atexit.register(self.stop)
+
+        start_time = time.time()
+        try:
+            for port in free_ports(self.count):
+                self._launch(port)
+            launched_time = time.time()
+            self._wait_until_ready()
+            ready_time = time.time()
+            if self.form_ring:
+                self.form()
+        except BaseException:
+            self.stop(keep_logs=True)
+            raise
+        end_time = time.time()
+
+        self.timings = {
+            'nodes': self.count,
+            'launch_s': round(launched_time - start_time, 3),
+            'ready_s': round(ready_time - start_time, 3),
+            'form_s': round(end_time - ready_time, 3) if self.form_ring else None,
+            'total_s': round(end_time - start_time, 3)
+        }
+        return self.timings
+
+    def _launch(self, port):
+        env = dict(os.environ, ROCKET_PORT=str(port), A1_HOSTNAME="localhost", A1_PORT=str(port), **self.env)
+        if self.durable:
+            data_dir = os.path.join(self.work_dir, f"data-{port}")
+            os.makedirs(data_dir)
+            env["A1_DATA_DIR"] = data_dir
+
+        log = open(os.path.join(self.work_dir, f"node-{port}.log"), "wb")
+        # A new session keeps Ctrl-C in the terminal from reaching the nodes before we stop them
+        process = subprocess.Popen([self.binary], env=env, stdout=log, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+        log.close()
+
+        self.processes.append(process)
+        self.nodes.append(f"localhost:{port}")
+
+    def _wait_until_ready(self):
+        waiting = dict(zip(self.nodes, self.processes))
+        deadline = time.time() + self.ready_timeout
+        while waiting:
+            for node, process in list(waiting.items()):
+                if process.poll() is not None:
+                    raise RuntimeError(f"Node {node} exited with code {process.returncode}, see {self.log_path(node)}")
+                status, _ = request(node, "GET", "/helloworld")
+                if status == 200:
+                    del waiting[node]
+            if time.time() > deadline:
+                raise RuntimeError(f"Nodes not ready after {self.ready_timeout} seconds: {', '.join(waiting)}")
+            if waiting:
+                time.sleep(POLL_INTERVAL)
+
+    def log_path(self, node):
+        port = node.rsplit(":", 1)[1]
+        return os.path.join(self.work_dir, f"node-{port}.log")
+
+    def form(self, members=None):
+        """ Forms one ring of the given nodes, all of them by default, with /network/form"""
+        members = members or self.nodes
+        body = json.dumps({"members": members})
+        status, response = request(members[0], "POST", "/network/form", body, {"Content-Type": "application/json"})
+        if status != 200:
+            raise RuntimeError(f"Could not form ring of {len(members)} nodes: {status} {response}")
+
+    def stop(self, keep_logs=False):
+        """ Stops every node, killing those that do not exit in time. Safe to call more than once."""
+        for process in self.processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGTERM)
+        deadline = time.time() + STOP_TIMEOUT
+        for process in self.processes:
+            try:
+                process.wait(timeout=max(deadline - time.time(), 0))
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        self.processes = []
+
+        if self.work_dir is not None and not keep_logs:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            self.work_dir = None
+        atexit.unregister(self.stop)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Starts nodes on localhost, prints them as a JSON list and stops them on Ctrl-C")
+    parser.add_argument("count", type=int, help="Number of nodes to start")
+    parser.add_argument("--binary", default=DEFAULT_BINARY)
+    parser.add_argument("--build", action="store_true", help="Run cargo build --release first")
+    parser.add_argument("--form", action="store_true", help="Form one ring of all nodes once they are ready")
+    parser.add_argument("--durable", action="store_true", help="Give every node its own A1_DATA_DIR")
+    parser.add_argument("--env", action="append", default=[], metavar="NAME=VALUE",
+                        help="Environment variable for every node, may be repeated")
+    parser.add_argument("--timings", action="store_true", help="Print the startup times as JSON and stop again")
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args(sys.argv[1:])
+    if args.build:
+        build_binary()
+
+    env = dict(variable.split("=", 1) for variable in args.env)
+    cluster = LocalCluster(args.count, binary=args.binary, form=args.form, env=env, durable=args.durable)
+    timings = cluster.start()
+    print(f"Started {args.count} nodes in {timings['total_s']} s", file=sys.stderr)
+
+    if args.timings:
+        print(json.dumps(timings, indent=2))
+        cluster.stop()
+        sys.exit(0)
+
+    # Printed like run-unjoined.sh, so it can be passed to the testers with --nodes
+    print(json.dumps(cluster.nodes), flush=True)
+    try:
+        signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+        while all(process.poll() is None for process in cluster.processes):
+            time.sleep(1)
+        print("A node exited, stopping the cluster", file=sys.stderr)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        cluster.stop()
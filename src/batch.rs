@@ -0,0 +1,139 @@
+use rocket::serde::{Deserialize, Serialize};
+use rocket::tokio;
+
+use crate::http_connect;
+use crate::replication::CONSISTENCY_HEADER;
+use crate::transfer::TransferEntry;
+use crate::{is_same_node, Node};
+
+#[derive(Serialize, Deserialize, Clone, Debug, Default)]
+#[serde(crate = "rocket::serde")]
+pub struct BatchRequest {
+    #[serde(default)]
+    pub get: Vec<String>,
+    #[serde(default)]
+    pub put: Vec<TransferEntry>,
+}
+
+#[derive(Serialize, Deserialize, Clone, Debug, Default)]
+#[serde(crate = "rocket::serde")]
+pub struct BatchResponse {
+    pub found: Vec<TransferEntry>,
+    pub missing: Vec<String>,
+    pub stored: Vec<String>,
+    // Keys that could not be read or written, the client may retry them
+    pub failed: Vec<String>,
+}
+
+impl BatchResponse {
+    // Every key of the request failed
+    pub fn failed(request: &BatchRequest) -> Self {
+        let mut failed = request.get.clone();
+        failed.extend(request.put.iter().map(|entry| entry.key.clone()));
+
+        BatchResponse {
+            failed: failed,
+            ..BatchResponse::default()
+        }
+    }
+
+    pub fn merge(&mut self, other: BatchResponse) {
+        self.found.extend(other.found);
+        self.missing.extend(other.missing);
+        self.stored.extend(other.stored);
+        self.failed.extend(other.failed);
+    }
+}
+
+// The sub-batch going to the next hop of a key, created the first time a key is routed to it. The
+// candidates are the next hop and its fallbacks, see NodeConfig::forward_candidates. A sub-batch keeps
+// the fallbacks of its key closest to us, they do not pass any of its keys.
+pub fn sub_batch<'a>(
+    sub_batches: &'a mut Vec<(Vec<Node>, BatchRequest)>,
+    candidates: Vec<Node>,
+) -> &'a mut BatchRequest {
+    let index = match sub_batches
+        .iter()
+        .position(|(known, _request)| is_same_node(&known[0], &candidates[0]))
+    {
+        Some(index) => {
+            // Fallbacks of a closer key are a subset of those of a key further away
+            if candidates.len() < sub_batches[index].0.len() {
+                sub_batches[index].0 = candidates;
+            }
+            index
+        }
+        None => {
+            sub_batches.push((candidates, BatchRequest::default()));
+            sub_batches.len() - 1
+        }
+    };
+
+    return &mut sub_batches[index].1;
+}
+
+// Send every sub-batch to its next hop in parallel and combine the answers. A sub-batch falls over
+// to the next candidate while the one before it cannot be reached.
+pub async fn send_sub_batches(
+    sub_batches: Vec<(Vec<Node>, BatchRequest)>,
+    consistency: &'static str,
+    trace_headers: Vec<(&'static str, String)>,
+) -> BatchResponse {
+    let mut tasks = Vec::new();
+
+    for (candidates, request) in sub_batches {
+        let trace_headers = trace_headers.clone();
+
+        tasks.push(tokio::spawn(async move {
+            let body = match rocket::serde::json::to_string(&request) {
+                Ok(body) => body,
+                Err(_err) => return BatchResponse::failed(&request),
+            };
+
+            let mut headers = vec![(CONSISTENCY_HEADER, consistency)];
+            headers.extend(trace_headers.iter().map(|(name, value)| (*name, value.as_str())));
+
+            for node in candidates.iter() {
+                let response = http_connect::write_body_to_node_async(
+                    http_connect::WriteOperations::Post,
+                    &node.hostname,
+                    node.port,
+                    "storage/_batch",
+                    "application/json",
+                    &headers,
+                    body.as_bytes(),
+                )
+                .await;
+
+                match response {
+                    Ok(response) => match response.json::<BatchResponse>() {
+                        Ok(batch_response) => return batch_response,
+                        Err(_err) => (),
+                    },
+                    Err(node_connection_error) if node_connection_error.is_unreachable() => {
+                        continue
+                    }
+                    Err(_node_connection_error) => (),
+                };
+
+                log_warn!(
+                    "Sub-batch to {}:{} failed, reporting its keys as failed",
+                    node.hostname, node.port
+                );
+                return BatchResponse::failed(&request);
+            }
+
+            log_warn!("No candidate for a sub-batch could be reached, reporting its keys as failed");
+            return BatchResponse::failed(&request);
+        }));
+    }
+
+    let mut combined = BatchResponse::default();
+    for task in tasks {
+        if let Ok(batch_response) = task.await {
+            combined.merge(batch_response);
+        }
+    }
+
+    return combined;
+}
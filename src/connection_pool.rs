@@ -0,0 +1,141 @@
+use rocket::serde::Serialize;
+use std::collections::HashMap;
+use std::io;
+use std::net::TcpStream;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::{Mutex, OnceLock};
+use std::time::{Duration, Instant};
+
+// Maximum number of idle keep-alive connections kept open towards a single peer
+const MAX_IDLE_CONNECTIONS_PER_PEER: usize = 8;
+
+// Rocket closes idle keep-alive connections after 5 seconds, so we give up on them slightly earlier
+const IDLE_CONNECTION_TIMEOUT: Duration = Duration::from_secs(4);
+
+struct IdleConnection {
+    stream: TcpStream,
+    returned_at: Instant,
+}
+
+#[derive(Serialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct PoolStatistics {
+    pub hits: u64,
+    pub misses: u64,
+    pub stale: u64,
+    pub evictions: u64,
+    pub idle_connections: usize,
+    pub peers: usize,
+}
+
+pub struct ConnectionPool {
+    idle: Mutex<HashMap<String, Vec<IdleConnection>>>,
+    hits: AtomicU64,
+    misses: AtomicU64,
+    stale: AtomicU64,
+    evictions: AtomicU64,
+}
+
+pub fn peer_key(hostname: &str, port: u16) -> String {
+    return format!("{}:{}", hostname, port);
+}
+
+// Process wide pool shared by every outgoing request to other nodes
+pub fn pool() -> &'static ConnectionPool {
+    static POOL: OnceLock<ConnectionPool> = OnceLock::new();
+    return POOL.get_or_init(ConnectionPool::new);
+}
+
+fn is_healthy(stream: &TcpStream) -> bool {
+    // Peek without blocking, an idle connection should have nothing to read.
+    // Reading 0 bytes means the peer closed the connection, any data is unsolicited and unusable.
+    if stream.set_nonblocking(true).is_err() {
+        return false;
+    }
+
+    let mut probe = [0u8; 1];
+    let healthy = match stream.peek(&mut probe) {
+        Err(err) => err.kind() == io::ErrorKind::WouldBlock,
+        Ok(_) => false,
+    };
+
+    return healthy && stream.set_nonblocking(false).is_ok();
+}
+
+impl ConnectionPool {
+    pub fn new() -> Self {
+        ConnectionPool {
+            idle: Mutex::new(HashMap::new()),
+            hits: AtomicU64::new(0),
+            misses: AtomicU64::new(0),
+            stale: AtomicU64::new(0),
+            evictions: AtomicU64::new(0),
+        }
+    }
+
+    // Take an idle connection to the peer, if a healthy one is available
+    pub fn checkout(&self, peer: &str) -> Option<TcpStream> {
+        let mut idle = self.idle.lock().expect("Mutex poisoned");
+
+        if let Some(connections) = idle.get_mut(peer) {
+            // Most recently returned connections are the most likely to still be alive
+            while let Some(connection) = connections.pop() {
+                if connection.returned_at.elapsed() < IDLE_CONNECTION_TIMEOUT
+                    && is_healthy(&connection.stream)
+                {
+                    self.hits.fetch_add(1, Ordering::Relaxed);
+                    return Some(connection.stream);
+                }
+                self.stale.fetch_add(1, Ordering::Relaxed);
+            }
+            idle.remove(peer);
+        }
+
+        self.misses.fetch_add(1, Ordering::Relaxed);
+        return None;
+    }
+
+    // Return a connection after a completed request so it can be reused
+    pub fn checkin(&self, peer: &str, stream: TcpStream) {
+        let mut idle = self.idle.lock().expect("Mutex poisoned");
+        let connections = idle.entry(peer.to_string()).or_insert_with(Vec::new);
+
+        if connections.len() >= MAX_IDLE_CONNECTIONS_PER_PEER {
+            // Dropping the stream closes the connection
+            return;
+        }
+
+        connections.push(IdleConnection {
+            stream: stream,
+            returned_at: Instant::now(),
+        });
+    }
+
+    // A reused connection turned out to be closed while sending a request
+    pub fn record_stale(&self) {
+        self.stale.fetch_add(1, Ordering::Relaxed);
+    }
+
+    // Close all idle connections to a peer, used when it leaves the ring or stops responding
+    pub fn evict_peer(&self, hostname: &str, port: u16) {
+        let mut idle = self.idle.lock().expect("Mutex poisoned");
+
+        if let Some(connections) = idle.remove(&peer_key(hostname, port)) {
+            self.evictions
+                .fetch_add(connections.len() as u64, Ordering::Relaxed);
+        }
+    }
+
+    pub fn statistics(&self) -> PoolStatistics {
+        let idle = self.idle.lock().expect("Mutex poisoned");
+
+        PoolStatistics {
+            hits: self.hits.load(Ordering::Relaxed),
+            misses: self.misses.load(Ordering::Relaxed),
+            stale: self.stale.load(Ordering::Relaxed),
+            evictions: self.evictions.load(Ordering::Relaxed),
+            idle_connections: idle.values().map(|connections| connections.len()).sum(),
+            peers: idle.len(),
+        }
+    }
+}
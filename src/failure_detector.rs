@@ -0,0 +1,333 @@
+use rocket::serde::Serialize;
+use std::collections::VecDeque;
+use std::env;
+use std::fmt::Write;
+use std::sync::{Mutex, OnceLock};
+use std::time::{Duration, Instant};
+
+use crate::metrics::Histogram;
+
+const DEFAULT_HEARTBEAT_INTERVAL_MS: u64 = 200; // Time between heartbeats to each neighbour, override with A1_HEARTBEAT_INTERVAL_MS
+const DEFAULT_HEARTBEAT_TIMEOUT_MS: u64 = 500; // A heartbeat or stabilization request not answered by then has failed, override with A1_HEARTBEAT_TIMEOUT_MS
+const DEFAULT_PHI_THRESHOLD: f64 = 8.0; // Suspicion level at which a neighbour is taken as failed, override with A1_PHI_THRESHOLD
+
+// Heartbeat intervals remembered per neighbour
+const HISTORY_LENGTH: usize = 100;
+
+// Floor for the deviation of the intervals, so that a very regular neighbour is not suspected
+// as soon as one heartbeat comes in a little late
+const MIN_DEVIATION_MS: f64 = 50.0;
+
+#[derive(Clone, Copy, PartialEq, Debug)]
+pub enum Neighbour {
+    Successor,
+    Predecessor,
+}
+
+impl Neighbour {
+    pub fn as_str(&self) -> &'static str {
+        match self {
+            Neighbour::Successor => "successor",
+            Neighbour::Predecessor => "predecessor",
+        }
+    }
+}
+
+#[derive(Default)]
+struct WatchedNode {
+    // host:port of the node currently in this position, None until the first heartbeat
+    peer: Option<String>,
+    // Time between heartbeats that were answered, in milliseconds
+    intervals: VecDeque<f64>,
+    last_heartbeat: Option<Instant>,
+    suspected: bool,
+    heartbeats: u64,
+    missed: u64,
+    suspicions: u64,
+    last_detection_ms: Option<f64>,
+}
+
+#[derive(Serialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct NeighbourStatistics {
+    pub peer: Option<String>,
+    pub phi: f64,
+    pub suspected: bool,
+    pub heartbeats: u64,
+    pub missed: u64,
+    pub suspicions: u64,
+    pub mean_interval_ms: f64,
+    // Time from the last answered heartbeat until the node was suspected, at the last suspicion
+    pub last_detection_ms: Option<f64>,
+}
+
+#[derive(Serialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct FailureDetectorStatistics {
+    pub heartbeat_interval_ms: u64,
+    pub heartbeat_timeout_ms: u64,
+    pub phi_threshold: f64,
+    pub successor: NeighbourStatistics,
+    pub predecessor: NeighbourStatistics,
+}
+
+// Accrual failure detector for our two neighbours. Rather than declaring a node dead after one
+// failed request, it keeps the distribution of the intervals between answered heartbeats and
+// turns the time since the last one into a suspicion level, phi. phi = 1 means the neighbour
+// would have answered by now with 90% likelihood, phi = 2 with 99%, and so on.
+pub struct FailureDetector {
+    heartbeat_interval: Duration,
+    heartbeat_timeout: Duration,
+    phi_threshold: f64,
+    successor: Mutex<WatchedNode>,
+    predecessor: Mutex<WatchedNode>,
+    heartbeat_latency: [Histogram; 2],
+    detection_time: [Histogram; 2],
+}
+
+pub fn failure_detector() -> &'static FailureDetector {
+    static DETECTOR: OnceLock<FailureDetector> = OnceLock::new();
+    return DETECTOR.get_or_init(|| {
+        let heartbeat_interval_ms = env::var("A1_HEARTBEAT_INTERVAL_MS")
+            .ok()
+            .and_then(|interval| interval.parse().ok())
+            .unwrap_or(DEFAULT_HEARTBEAT_INTERVAL_MS);
+        let heartbeat_timeout_ms = env::var("A1_HEARTBEAT_TIMEOUT_MS")
+            .ok()
+            .and_then(|timeout| timeout.parse().ok())
+            .unwrap_or(DEFAULT_HEARTBEAT_TIMEOUT_MS);
+        let phi_threshold = env::var("A1_PHI_THRESHOLD")
+            .ok()
+            .and_then(|threshold| threshold.parse().ok())
+            .unwrap_or(DEFAULT_PHI_THRESHOLD);
+        FailureDetector::new(
+            Duration::from_millis(heartbeat_interval_ms),
+            Duration::from_millis(heartbeat_timeout_ms),
+            phi_threshold,
+        )
+    });
+}
+
+// -log10 of the likelihood that a heartbeat comes later than elapsed_ms, for normally distributed
+// intervals. Uses the logistic approximation of the normal distribution, which stays finite far out
+// in the tail.
+fn phi(elapsed_ms: f64, mean_ms: f64, deviation_ms: f64) -> f64 {
+    let y = (elapsed_ms - mean_ms) / deviation_ms;
+    let e = (-y * (1.5976 + 0.070566 * y * y)).exp();
+    if elapsed_ms > mean_ms {
+        return -(e / (1.0 + e)).log10();
+    }
+    return -(1.0 - 1.0 / (1.0 + e)).log10();
+}
+
+impl WatchedNode {
+    // Mean and deviation of the intervals, assuming the configured interval until we have seen some
+    fn distribution(&self, heartbeat_interval: Duration) -> (f64, f64) {
+        let interval_ms = heartbeat_interval.as_secs_f64() * 1000.0;
+        if self.intervals.is_empty() {
+            return (interval_ms, (interval_ms / 4.0).max(MIN_DEVIATION_MS));
+        }
+
+        let count = self.intervals.len() as f64;
+        let mean = self.intervals.iter().sum::<f64>() / count;
+        let variance = self
+            .intervals
+            .iter()
+            .map(|interval| (interval - mean) * (interval - mean))
+            .sum::<f64>()
+            / count;
+        return (mean, variance.sqrt().max(MIN_DEVIATION_MS));
+    }
+
+    fn phi(&self, heartbeat_interval: Duration) -> f64 {
+        let last_heartbeat = match self.last_heartbeat {
+            Some(last_heartbeat) => last_heartbeat,
+            None => return 0.0,
+        };
+        let (mean, deviation) = self.distribution(heartbeat_interval);
+        return phi(last_heartbeat.elapsed().as_secs_f64() * 1000.0, mean, deviation);
+    }
+}
+
+impl FailureDetector {
+    pub fn new(heartbeat_interval: Duration, heartbeat_timeout: Duration, phi_threshold: f64) -> Self {
+        FailureDetector {
+            heartbeat_interval: heartbeat_interval,
+            heartbeat_timeout: heartbeat_timeout,
+            phi_threshold: phi_threshold,
+            successor: Mutex::new(WatchedNode::default()),
+            predecessor: Mutex::new(WatchedNode::default()),
+            heartbeat_latency: [Histogram::default(), Histogram::default()],
+            detection_time: [Histogram::default(), Histogram::default()],
+        }
+    }
+
+    pub fn heartbeat_interval(&self) -> Duration {
+        return self.heartbeat_interval;
+    }
+
+    pub fn heartbeat_timeout(&self) -> Duration {
+        return self.heartbeat_timeout;
+    }
+
+    fn watched(&self, neighbour: Neighbour) -> &Mutex<WatchedNode> {
+        match neighbour {
+            Neighbour::Successor => &self.successor,
+            Neighbour::Predecessor => &self.predecessor,
+        }
+    }
+
+    fn index(neighbour: Neighbour) -> usize {
+        match neighbour {
+            Neighbour::Successor => 0,
+            Neighbour::Predecessor => 1,
+        }
+    }
+
+    // Start over when a different node takes the position, it gets a full interval before suspicion builds
+    pub fn watch(&self, neighbour: Neighbour, peer: &str) {
+        let mut watched = self.watched(neighbour).lock().expect("Mutex poisoned");
+        if watched.peer.as_deref() != Some(peer) {
+            *watched = WatchedNode {
+                peer: Some(peer.to_string()),
+                last_heartbeat: Some(Instant::now()),
+                ..WatchedNode::default()
+            };
+        }
+    }
+
+    pub fn heartbeat(&self, neighbour: Neighbour, peer: &str, latency: Duration) {
+        self.heartbeat_latency[Self::index(neighbour)].observe(latency);
+
+        let mut watched = self.watched(neighbour).lock().expect("Mutex poisoned");
+        if watched.peer.as_deref() != Some(peer) {
+            return;
+        }
+
+        let now = Instant::now();
+        if let Some(last_heartbeat) = watched.last_heartbeat {
+            if watched.intervals.len() == HISTORY_LENGTH {
+                watched.intervals.pop_front();
+            }
+            let interval_ms = now.duration_since(last_heartbeat).as_secs_f64() * 1000.0;
+            watched.intervals.push_back(interval_ms);
+        }
+        watched.last_heartbeat = Some(now);
+        watched.heartbeats += 1;
+
+        if watched.suspected {
+            watched.suspected = false;
+            log_info!("{} {} is answering again", neighbour.as_str(), peer);
+        }
+    }
+
+    pub fn missed(&self, neighbour: Neighbour, peer: &str) {
+        let mut watched = self.watched(neighbour).lock().expect("Mutex poisoned");
+        if watched.peer.as_deref() == Some(peer) {
+            watched.missed += 1;
+        }
+    }
+
+    // Whether the node in this position has gone quiet for longer than its history allows for.
+    // A node we are not watching is never suspected, it has not had a chance to answer yet.
+    pub fn is_suspected(&self, neighbour: Neighbour, peer: &str) -> bool {
+        let mut watched = self.watched(neighbour).lock().expect("Mutex poisoned");
+        if watched.peer.as_deref() != Some(peer) {
+            return false;
+        }
+        if watched.suspected {
+            return true;
+        }
+
+        let phi = watched.phi(self.heartbeat_interval);
+        if phi < self.phi_threshold {
+            return false;
+        }
+
+        let detected_after = watched
+            .last_heartbeat
+            .map(|last_heartbeat| last_heartbeat.elapsed())
+            .unwrap_or_default();
+        watched.suspected = true;
+        watched.suspicions += 1;
+        watched.last_detection_ms = Some(detected_after.as_secs_f64() * 1000.0);
+        self.detection_time[Self::index(neighbour)].observe(detected_after);
+        log_warn!(
+            "Suspecting {} {}, phi {:.1} after {} ms without an answer",
+            neighbour.as_str(),
+            peer,
+            phi,
+            detected_after.as_millis()
+        );
+        return true;
+    }
+
+    fn neighbour_statistics(&self, neighbour: Neighbour) -> NeighbourStatistics {
+        let watched = self.watched(neighbour).lock().expect("Mutex poisoned");
+        NeighbourStatistics {
+            peer: watched.peer.clone(),
+            phi: watched.phi(self.heartbeat_interval),
+            suspected: watched.suspected,
+            heartbeats: watched.heartbeats,
+            missed: watched.missed,
+            suspicions: watched.suspicions,
+            mean_interval_ms: watched.distribution(self.heartbeat_interval).0,
+            last_detection_ms: watched.last_detection_ms,
+        }
+    }
+
+    pub fn statistics(&self) -> FailureDetectorStatistics {
+        FailureDetectorStatistics {
+            heartbeat_interval_ms: self.heartbeat_interval.as_millis() as u64,
+            heartbeat_timeout_ms: self.heartbeat_timeout.as_millis() as u64,
+            phi_threshold: self.phi_threshold,
+            successor: self.neighbour_statistics(Neighbour::Successor),
+            predecessor: self.neighbour_statistics(Neighbour::Predecessor),
+        }
+    }
+
+    // Appended to /metrics, in the same text format as the node metrics
+    pub fn render(&self, out: &mut String) {
+        let neighbours = [Neighbour::Successor, Neighbour::Predecessor];
+        let statistics: Vec<NeighbourStatistics> = neighbours
+            .iter()
+            .map(|neighbour| self.neighbour_statistics(*neighbour))
+            .collect();
+
+        let name = "a1_failure_detector_phi";
+        let _ = writeln!(out, "# HELP {} Suspicion level of each neighbour\n# TYPE {} gauge", name, name);
+        for (neighbour, statistics) in neighbours.iter().zip(statistics.iter()) {
+            let _ = writeln!(out, "{}{{neighbour=\"{}\"}} {}", name, neighbour.as_str(), statistics.phi);
+        }
+
+        let name = "a1_failure_detector_suspicions_total";
+        let _ = writeln!(out, "# HELP {} Times a neighbour was suspected to have failed\n# TYPE {} counter", name, name);
+        for (neighbour, statistics) in neighbours.iter().zip(statistics.iter()) {
+            let _ = writeln!(out, "{}{{neighbour=\"{}\"}} {}", name, neighbour.as_str(), statistics.suspicions);
+        }
+
+        let name = "a1_failure_detector_missed_heartbeats_total";
+        let _ = writeln!(out, "# HELP {} Heartbeats that failed or timed out\n# TYPE {} counter", name, name);
+        for (neighbour, statistics) in neighbours.iter().zip(statistics.iter()) {
+            let _ = writeln!(out, "{}{{neighbour=\"{}\"}} {}", name, neighbour.as_str(), statistics.missed);
+        }
+
+        let name = "a1_heartbeat_duration_seconds";
+        let _ = writeln!(out, "# HELP {} Time until a neighbour answered a heartbeat\n# TYPE {} histogram", name, name);
+        for neighbour in neighbours.iter() {
+            let labels = format!("neighbour=\"{}\"", neighbour.as_str());
+            self.heartbeat_latency[Self::index(*neighbour)].render(name, &labels, out);
+        }
+
+        let name = "a1_failure_detection_seconds";
+        let _ = writeln!(
+            out,
+            "# HELP {} Time from the last answered heartbeat until the neighbour was suspected\n# TYPE {} histogram",
+            name, name
+        );
+        for neighbour in neighbours.iter() {
+            let labels = format!("neighbour=\"{}\"", neighbour.as_str());
+            self.detection_time[Self::index(*neighbour)].render(name, &labels, out);
+        }
+    }
+}
@@ -0,0 +1,155 @@
+use rocket::serde::Serialize;
+use std::time::Instant;
+
+use crate::{clockwise_distance, Node, RING_SIZE};
+
+// One finger for every power of two below the ring size
+pub const FINGER_COUNT: usize = 16;
+
+// Location finger i is responsible for, position + 2^i around the ring
+pub fn finger_start(position: u16, i: usize) -> u16 {
+    return ((u32::from(position) + (1u32 << i)) % u32::from(RING_SIZE)) as u16;
+}
+
+#[derive(Serialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct FingerStatistics {
+    pub fingers_set: usize,
+    pub distinct_nodes: usize,
+    pub oldest_refresh_age_ms: u64,
+    pub mean_refresh_age_ms: u64,
+    pub refreshes: u64,
+    pub changed: u64,
+    pub failed_refreshes: u64,
+}
+
+pub struct FingerTable {
+    // Entry i holds the owner of finger_start(local_position, i), None until it has been looked up
+    entries: Vec<Option<Node>>,
+    // When each entry was last looked up
+    refreshed_at: Vec<Option<Instant>>,
+    // Clockwise offset from local_position of every set entry and its index, sorted by offset
+    index: Vec<(u32, usize)>,
+    local_position: u16,
+    refreshes: u64,
+    changed: u64,
+    failed_refreshes: u64,
+}
+
+impl FingerTable {
+    pub fn new() -> Self {
+        FingerTable {
+            entries: vec![None; FINGER_COUNT],
+            refreshed_at: vec![None; FINGER_COUNT],
+            index: Vec::new(),
+            local_position: 0,
+            refreshes: 0,
+            changed: 0,
+            failed_refreshes: 0,
+        }
+    }
+
+    pub fn clear(&mut self) {
+        self.entries = vec![None; FINGER_COUNT];
+        self.refreshed_at = vec![None; FINGER_COUNT];
+        self.index.clear();
+    }
+
+    pub fn get(&self, i: usize) -> Option<&Node> {
+        return self.entries[i].as_ref();
+    }
+
+    pub fn set(&mut self, local_position: u16, i: usize, node: Node) {
+        // Fingers are relative to our position, so moving invalidates all of them
+        if local_position != self.local_position {
+            self.clear();
+            self.local_position = local_position;
+        }
+
+        // A refresh that finds another owner means the finger was stale
+        let changed = self.entries[i]
+            .as_ref()
+            .is_some_and(|old| old.hostname != node.hostname || old.port != node.port);
+        if changed {
+            self.changed += 1;
+        }
+        self.refreshes += 1;
+
+        self.entries[i] = Some(node);
+        self.refreshed_at[i] = Some(Instant::now());
+        self.rebuild_index();
+    }
+
+    pub fn record_failed_refresh(&mut self) {
+        self.failed_refreshes += 1;
+    }
+
+    fn rebuild_index(&mut self) {
+        let local_position = self.local_position;
+
+        self.index = self
+            .entries
+            .iter()
+            .enumerate()
+            .filter_map(|(i, entry)| {
+                entry
+                    .as_ref()
+                    .map(|node| (clockwise_distance(local_position, node.position), i))
+            })
+            .collect();
+        self.index.sort_unstable();
+    }
+
+    // The finger that gets closest to the location without passing it, found by binary search
+    pub fn closest_preceding(&self, location: u16) -> Option<&Node> {
+        let target = clockwise_distance(self.local_position, location);
+        let preceding = self.index.partition_point(|(offset, _i)| *offset <= target);
+
+        if preceding == 0 {
+            return None;
+        }
+
+        let (_offset, i) = self.index[preceding - 1];
+        return self.entries[i].as_ref();
+    }
+
+    // Distinct nodes in the table, ordered by distance from the local node
+    pub fn nodes(&self) -> Vec<Node> {
+        let mut nodes: Vec<Node> = Vec::new();
+
+        for (_offset, i) in self.index.iter() {
+            let node = self.entries[*i].as_ref().expect("Indexed finger is set");
+            let seen = nodes
+                .iter()
+                .any(|known| known.hostname == node.hostname && known.port == node.port);
+            if !seen {
+                nodes.push(node.clone());
+            }
+        }
+
+        return nodes;
+    }
+
+    pub fn statistics(&self) -> FingerStatistics {
+        let ages: Vec<u64> = self
+            .refreshed_at
+            .iter()
+            .flatten()
+            .map(|refreshed_at| refreshed_at.elapsed().as_millis() as u64)
+            .collect();
+
+        FingerStatistics {
+            fingers_set: ages.len(),
+            distinct_nodes: self.nodes().len(),
+            oldest_refresh_age_ms: ages.iter().copied().max().unwrap_or(0),
+            mean_refresh_age_ms: if ages.is_empty() {
+                0
+            } else {
+                ages.iter().sum::<u64>() / ages.len() as u64
+            },
+            refreshes: self.refreshes,
+            changed: self.changed,
+            failed_refreshes: self.failed_refreshes,
+        }
+    }
+}
@@ -0,0 +1,86 @@
+use rocket::serde::{Deserialize, Serialize};
+
+use crate::finger_table::{finger_start, FINGER_COUNT};
+use crate::{Node, RING_SIZE, SUCCESSOR_LIST_LENGTH};
+
+#[derive(Serialize, Deserialize, Clone)]
+#[serde(crate = "rocket::serde")]
+pub struct RingFormation {
+    // Addresses as host:port, in the order they are placed around the ring
+    pub members: Vec<String>,
+}
+
+// Everything a member needs to take its place in a formed ring
+#[derive(Serialize, Deserialize, Clone)]
+#[serde(crate = "rocket::serde")]
+pub struct RingConfiguration {
+    pub local: Node,
+    pub precessor: Node,
+    pub successor: Node,
+    pub successor_list: Vec<Node>,
+    // Owner of every finger start, None where that is the member itself
+    pub fingers: Vec<Option<Node>>,
+}
+
+pub fn parse_member(member: &str) -> Option<(String, u16)> {
+    let (hostname, port) = member.rsplit_once(':')?;
+    if hostname.is_empty() {
+        return None;
+    }
+    return Some((String::from(hostname), port.parse().ok()?));
+}
+
+// Place the members evenly around the ring and work out the neighbours and fingers of each of them
+pub fn plan_ring(members: &[(String, u16)]) -> Vec<RingConfiguration> {
+    let count = members.len();
+
+    let nodes: Vec<Node> = members
+        .iter()
+        .enumerate()
+        .map(|(i, (hostname, port))| {
+            let position = (i as u64 * u64::from(RING_SIZE) / count as u64) as u16;
+            let next_position = ((i + 1) as u64 * u64::from(RING_SIZE) / count as u64) as u16;
+            Node {
+                hostname: hostname.clone(),
+                port: *port,
+                position: position,
+                range: next_position - position,
+            }
+        })
+        .collect();
+
+    // Positions are sorted, so the owner of a location is the last node starting at or before it
+    let owner_of = |location: u16| -> usize {
+        return nodes.partition_point(|node| node.position <= location) - 1;
+    };
+
+    return (0..count)
+        .map(|i| {
+            let local = nodes[i].clone();
+
+            let successor_list: Vec<Node> = (1..count)
+                .take(SUCCESSOR_LIST_LENGTH)
+                .map(|distance| nodes[(i + distance) % count].clone())
+                .collect();
+
+            let fingers: Vec<Option<Node>> = (0..FINGER_COUNT)
+                .map(|finger| {
+                    let owner = owner_of(finger_start(local.position, finger));
+                    if owner == i {
+                        None
+                    } else {
+                        Some(nodes[owner].clone())
+                    }
+                })
+                .collect();
+
+            RingConfiguration {
+                local: local,
+                precessor: nodes[(i + count - 1) % count].clone(),
+                successor: nodes[(i + 1) % count].clone(),
+                successor_list: successor_list,
+                fingers: fingers,
+            }
+        })
+        .collect();
+}
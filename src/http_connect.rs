@@ -1,5 +1,37 @@
-use minreq::Response;
 use rocket::serde;
+use rocket::tokio;
+use rocket::tokio::io::{AsyncRead, AsyncReadExt, AsyncWriteExt, ReadBuf};
+use std::collections::HashMap;
+use std::env;
+use std::future::Future;
+use std::io::{self, Read, Write};
+use std::net::{TcpStream, ToSocketAddrs};
+use std::pin::Pin;
+use std::sync::OnceLock;
+use std::task::{Context, Poll};
+use std::time::{Duration, Instant};
+
+use crate::connection_pool::{self, peer_key};
+use crate::metrics;
+
+// Bodies up to this size are buffered and sent on pooled connections, larger ones are streamed through
+pub const STREAM_THRESHOLD: usize = 256 * 1024;
+// Size of the pieces a streamed body is copied in
+const STREAM_CHUNK_SIZE: usize = 64 * 1024;
+
+const DEFAULT_PEER_TIMEOUT_MS: u64 = 5000; // Longest an async request waits on a peer that makes no progress, override with A1_PEER_TIMEOUT_MS
+
+pub fn peer_timeout() -> Duration {
+    static PEER_TIMEOUT: OnceLock<Duration> = OnceLock::new();
+    return *PEER_TIMEOUT.get_or_init(|| {
+        Duration::from_millis(
+            env::var("A1_PEER_TIMEOUT_MS")
+                .ok()
+                .and_then(|timeout| timeout.parse().ok())
+                .unwrap_or(DEFAULT_PEER_TIMEOUT_MS),
+        )
+    });
+}
 
 #[derive(Debug)]
 pub struct NodeConnectionError {
@@ -7,65 +39,846 @@ pub struct NodeConnectionError {
     pub http_response: Option<Response>,
 }
 
+impl NodeConnectionError {
+    // The node could not be reached, or answered that it is crashed
+    pub fn is_unreachable(&self) -> bool {
+        return !self.connection_established
+            || self
+                .http_response
+                .as_ref()
+                .is_some_and(|http_response| http_response.status_code == 503);
+    }
+}
+
 pub enum WriteOperations {
     Post,
     Put,
     Delete,
 }
 
-pub fn check_if_node_is_connected() {}
+impl WriteOperations {
+    fn method(&self) -> &'static str {
+        match self {
+            WriteOperations::Post => "POST",
+            WriteOperations::Put => "PUT",
+            WriteOperations::Delete => "DELETE",
+        }
+    }
+}
 
-pub fn get_from_node(
+#[derive(Debug)]
+pub struct Response {
+    pub status_code: i32,
+    pub reason_phrase: String,
+    pub headers: HashMap<String, String>,
+    body: Vec<u8>,
+}
+
+impl Response {
+    pub fn as_bytes(&self) -> &[u8] {
+        return &self.body;
+    }
+
+    pub fn into_bytes(self) -> Vec<u8> {
+        return self.body;
+    }
+
+    pub fn as_str(&self) -> Result<&str, std::str::Utf8Error> {
+        return std::str::from_utf8(&self.body);
+    }
+
+    pub fn json<T>(&self) -> Result<T, serde_json::Error>
+    where
+        T: serde::de::DeserializeOwned,
+    {
+        return serde_json::from_slice(&self.body);
+    }
+}
+
+#[derive(Clone, Copy, PartialEq)]
+enum BodyFraming {
+    Empty,
+    Length(usize),
+    Chunked,
+    UntilClose,
+}
+
+#[derive(Clone, Copy, PartialEq)]
+enum ChunkState {
+    Size,
+    Data(usize),
+    DataEnd,
+    Trailer,
+    Done,
+}
+
+struct ResponseHead {
+    status_code: i32,
+    reason_phrase: String,
+    headers: HashMap<String, String>,
+    framing: BodyFraming,
+    keep_alive: bool,
+}
+
+fn malformed(message: &str) -> io::Error {
+    return io::Error::new(io::ErrorKind::InvalidData, message.to_string());
+}
+
+fn find_subsequence(haystack: &[u8], needle: &[u8]) -> Option<usize> {
+    return haystack
+        .windows(needle.len())
+        .position(|window| window == needle);
+}
+
+fn parse_head(raw_head: &[u8]) -> io::Result<ResponseHead> {
+    let head = std::str::from_utf8(raw_head).map_err(|_err| malformed("Header is not UTF-8"))?;
+    let mut lines = head.split("\r\n");
+
+    // Status line, e.g. "HTTP/1.1 200 OK"
+    let status_line = lines.next().ok_or_else(|| malformed("Missing status line"))?;
+    let mut status_parts = status_line.splitn(3, ' ');
+    let version = status_parts.next().unwrap_or("");
+    let status_code: i32 = status_parts
+        .next()
+        .and_then(|code| code.parse().ok())
+        .ok_or_else(|| malformed("Invalid status code"))?;
+    let reason_phrase = String::from(status_parts.next().unwrap_or(""));
+
+    let mut headers = HashMap::new();
+    for line in lines {
+        if let Some((name, value)) = line.split_once(':') {
+            headers.insert(name.trim().to_lowercase(), String::from(value.trim()));
+        }
+    }
+
+    let chunked = headers
+        .get("transfer-encoding")
+        .is_some_and(|encoding| encoding.to_lowercase().contains("chunked"));
+    let content_length = headers
+        .get("content-length")
+        .and_then(|length| length.parse::<usize>().ok());
+
+    let framing = if (100..200).contains(&status_code) || status_code == 204 || status_code == 304
+    {
+        BodyFraming::Empty
+    } else if chunked {
+        BodyFraming::Chunked
+    } else if let Some(length) = content_length {
+        BodyFraming::Length(length)
+    } else {
+        BodyFraming::UntilClose
+    };
+
+    let connection_close = headers
+        .get("connection")
+        .is_some_and(|connection| connection.eq_ignore_ascii_case("close"));
+    let keep_alive = version == "HTTP/1.1" && !connection_close && framing != BodyFraming::UntilClose;
+
+    return Ok(ResponseHead {
+        status_code: status_code,
+        reason_phrase: reason_phrase,
+        headers: headers,
+        framing: framing,
+        keep_alive: keep_alive,
+    });
+}
+
+// Incremental HTTP/1.1 response parser, fed with whatever the socket returns until the response is complete
+struct ResponseParser {
+    buffer: Vec<u8>,
+    head: Option<ResponseHead>,
+    body: Vec<u8>,
+    chunk_state: ChunkState,
+}
+
+impl ResponseParser {
+    fn new() -> Self {
+        ResponseParser {
+            buffer: Vec::new(),
+            head: None,
+            body: Vec::new(),
+            chunk_state: ChunkState::Size,
+        }
+    }
+
+    // Returns true once the full response has been received
+    fn feed(&mut self, data: &[u8]) -> io::Result<bool> {
+        self.buffer.extend_from_slice(data);
+
+        if self.head.is_none() {
+            let head_end = match find_subsequence(&self.buffer, b"\r\n\r\n") {
+                Some(head_end) => head_end,
+                None => return Ok(false),
+            };
+            self.head = Some(parse_head(&self.buffer[..head_end])?);
+            self.buffer.drain(..head_end + 4);
+        }
+
+        let framing = self.head.as_ref().expect("Head is parsed").framing;
+
+        match framing {
+            BodyFraming::Empty => return Ok(true),
+            BodyFraming::UntilClose => {
+                self.body.append(&mut self.buffer);
+                return Ok(false);
+            }
+            BodyFraming::Length(length) => {
+                self.body.append(&mut self.buffer);
+                if self.body.len() > length {
+                    return Err(malformed("Body longer than Content-Length"));
+                }
+                return Ok(self.body.len() == length);
+            }
+            BodyFraming::Chunked => return self.decode_chunks(),
+        }
+    }
+
+    fn decode_chunks(&mut self) -> io::Result<bool> {
+        loop {
+            match self.chunk_state {
+                ChunkState::Size => {
+                    let line_end = match find_subsequence(&self.buffer, b"\r\n") {
+                        Some(line_end) => line_end,
+                        None => return Ok(false),
+                    };
+                    let line = std::str::from_utf8(&self.buffer[..line_end])
+                        .map_err(|_err| malformed("Chunk size is not UTF-8"))?;
+                    // Chunk extensions after ';' are ignored
+                    let size_hex = line.split(';').next().unwrap_or("").trim();
+                    let size = usize::from_str_radix(size_hex, 16)
+                        .map_err(|_err| malformed("Invalid chunk size"))?;
+                    self.buffer.drain(..line_end + 2);
+
+                    self.chunk_state = if size == 0 {
+                        ChunkState::Trailer
+                    } else {
+                        ChunkState::Data(size)
+                    };
+                }
+                ChunkState::Data(remaining) => {
+                    if self.buffer.is_empty() {
+                        return Ok(false);
+                    }
+                    let take = remaining.min(self.buffer.len());
+                    self.body.extend(self.buffer.drain(..take));
+
+                    self.chunk_state = if take == remaining {
+                        ChunkState::DataEnd
+                    } else {
+                        ChunkState::Data(remaining - take)
+                    };
+                }
+                ChunkState::DataEnd => {
+                    if self.buffer.len() < 2 {
+                        return Ok(false);
+                    }
+                    self.buffer.drain(..2);
+                    self.chunk_state = ChunkState::Size;
+                }
+                ChunkState::Trailer => {
+                    let line_end = match find_subsequence(&self.buffer, b"\r\n") {
+                        Some(line_end) => line_end,
+                        None => return Ok(false),
+                    };
+                    self.buffer.drain(..line_end + 2);
+                    if line_end == 0 {
+                        self.chunk_state = ChunkState::Done;
+                    }
+                }
+                ChunkState::Done => return Ok(true),
+            }
+        }
+    }
+
+    // Called when the peer closes the connection, only valid for responses delimited by close
+    fn finish_at_eof(&mut self) -> io::Result<()> {
+        match self.head.as_ref() {
+            Some(head) if head.framing == BodyFraming::UntilClose => Ok(()),
+            _ => Err(io::Error::new(
+                io::ErrorKind::UnexpectedEof,
+                "Connection closed before response was complete",
+            )),
+        }
+    }
+
+    // Returns the response, and whether the connection may be reused afterwards
+    fn into_response(self) -> (Response, bool) {
+        let head = self.head.expect("Head is parsed");
+        let response = Response {
+            status_code: head.status_code,
+            reason_phrase: head.reason_phrase,
+            headers: head.headers,
+            body: self.body,
+        };
+        return (response, head.keep_alive);
+    }
+}
+
+fn encode_request_head(
+    method: &str,
     hostname: &str,
     port: u16,
     path: &str,
-) -> Result<Response, NodeConnectionError> {
-    let request_uri = format!("http://{}:{}/{}", hostname, port, path);
+    content_type: Option<&str>,
+    headers: &[(&str, &str)],
+    content_length: Option<usize>,
+) -> Vec<u8> {
+    let mut head = format!(
+        "{} /{} HTTP/1.1\r\nHost: {}:{}\r\nConnection: keep-alive\r\n",
+        method, path, hostname, port
+    );
+    // Bodies of unknown length are sent chunked
+    match content_length {
+        Some(content_length) => head.push_str(&format!("Content-Length: {}\r\n", content_length)),
+        None => head.push_str("Transfer-Encoding: chunked\r\n"),
+    };
+    if let Some(content_type) = content_type {
+        head.push_str(&format!("Content-Type: {}\r\n", content_type));
+    }
+    for (name, value) in headers.iter() {
+        head.push_str(&format!("{}: {}\r\n", name, value));
+    }
+    head.push_str("\r\n");
+
+    return head.into_bytes();
+}
+
+fn connect(hostname: &str, port: u16, timeout: Option<Duration>) -> io::Result<TcpStream> {
+    let stream = match timeout {
+        None => TcpStream::connect((hostname, port))?,
+        Some(timeout) => {
+            let mut last_error = io::Error::new(io::ErrorKind::NotFound, "Hostname did not resolve");
+            let mut connected = None;
+            for address in (hostname, port).to_socket_addrs()? {
+                match TcpStream::connect_timeout(&address, timeout) {
+                    Ok(stream) => {
+                        connected = Some(stream);
+                        break;
+                    }
+                    Err(err) => last_error = err,
+                };
+            }
+            connected.ok_or(last_error)?
+        }
+    };
+    // Requests are written in two parts, don't let Nagle hold back the body
+    stream.set_nodelay(true)?;
+    return Ok(stream);
+}
+
+fn is_timeout(err: &io::Error) -> bool {
+    return err.kind() == io::ErrorKind::TimedOut || err.kind() == io::ErrorKind::WouldBlock;
+}
+
+fn timed_out() -> io::Error {
+    return io::Error::new(io::ErrorKind::TimedOut, "Peer made no progress in time");
+}
+
+// A failed exchange, and whether the request had been written in full when it failed. A peer can
+// only have acted on a request it received completely.
+struct ExchangeError {
+    error: io::Error,
+    sent: bool,
+}
+
+impl ExchangeError {
+    fn unsent(error: io::Error) -> Self {
+        ExchangeError {
+            error: error,
+            sent: false,
+        }
+    }
+
+    fn sent(error: io::Error) -> Self {
+        ExchangeError {
+            error: error,
+            sent: true,
+        }
+    }
+
+    // Whether the request may go out again on a fresh connection. Once the peer may have received it,
+    // only a read is safe to repeat, a write could be applied twice. A peer that is too slow to answer
+    // would be just as slow on a fresh connection.
+    fn may_retry(&self, method: &str) -> bool {
+        return !is_timeout(&self.error) && (!self.sent || method == "GET");
+    }
+}
+
+// The timeout bounds every write and read on the socket, a pooled connection is returned without one
+fn exchange(
+    mut stream: &TcpStream,
+    request_head: &[u8],
+    body: &[u8],
+    timeout: Option<Duration>,
+) -> Result<(Response, bool), ExchangeError> {
+    stream.set_read_timeout(timeout).map_err(ExchangeError::unsent)?;
+    stream.set_write_timeout(timeout).map_err(ExchangeError::unsent)?;
+
+    stream
+        .write_all(request_head)
+        .and_then(|_| stream.write_all(body))
+        .and_then(|_| stream.flush())
+        .map_err(ExchangeError::unsent)?;
+    let exchanged = read_response(stream).map_err(ExchangeError::sent)?;
+
+    if timeout.is_some() {
+        stream.set_read_timeout(None).map_err(ExchangeError::sent)?;
+        stream.set_write_timeout(None).map_err(ExchangeError::sent)?;
+    }
+    return Ok(exchanged);
+}
+
+fn read_response(mut stream: &TcpStream) -> io::Result<(Response, bool)> {
+    let mut parser = ResponseParser::new();
+    let mut read_buffer = [0u8; 16 * 1024];
+
+    loop {
+        let read = stream.read(&mut read_buffer)?;
+        if read == 0 {
+            parser.finish_at_eof()?;
+            break;
+        }
+        if parser.feed(&read_buffer[..read])? {
+            break;
+        }
+    }
+
+    return Ok(parser.into_response());
+}
+
+// Send a request over a pooled keep-alive connection, opening a new one if none are idle
+fn send_request(
+    method: &str,
+    hostname: &str,
+    port: u16,
+    path: &str,
+    content_type: Option<&str>,
+    headers: &[(&str, &str)],
+    body: &[u8],
+    timeout: Option<Duration>,
+) -> io::Result<Response> {
+    let pool = connection_pool::pool();
+    let peer = peer_key(hostname, port);
+    let request_head = encode_request_head(
+        method,
+        hostname,
+        port,
+        path,
+        content_type,
+        headers,
+        Some(body.len()),
+    );
+
+    if let Some(stream) = pool.checkout(&peer) {
+        match exchange(&stream, &request_head, body, timeout) {
+            Ok((response, reusable)) => {
+                if reusable {
+                    pool.checkin(&peer, stream);
+                }
+                return Ok(response);
+            }
+            // The peer may have closed the connection after our health check, retry on a fresh one
+            Err(failure) if failure.may_retry(method) => pool.record_stale(),
+            Err(failure) => {
+                pool.evict_peer(hostname, port);
+                return Err(failure.error);
+            }
+        }
+    }
+
+    let stream = match connect(hostname, port, timeout) {
+        Ok(stream) => stream,
+        Err(err) => {
+            pool.evict_peer(hostname, port);
+            return Err(err);
+        }
+    };
+
+    let (response, reusable) = match exchange(&stream, &request_head, body, timeout) {
+        Ok(exchanged) => exchanged,
+        Err(failure) => {
+            pool.evict_peer(hostname, port);
+            return Err(failure.error);
+        }
+    };
+
+    if reusable {
+        pool.checkin(&peer, stream);
+    }
+
+    return Ok(response);
+}
+
+// Fails an operation on a peer's socket that does not finish within the peer timeout. Bodies are
+// written and read in pieces, each with its own timeout, so a large value is not cut off by it.
+async fn within<T, F>(operation: F) -> io::Result<T>
+where
+    F: Future<Output = io::Result<T>>,
+{
+    match tokio::time::timeout(peer_timeout(), operation).await {
+        Ok(result) => return result,
+        Err(_elapsed) => return Err(timed_out()),
+    };
+}
+
+async fn write_all_within(stream: &mut tokio::net::TcpStream, data: &[u8]) -> io::Result<()> {
+    for piece in data.chunks(STREAM_CHUNK_SIZE) {
+        within(stream.write_all(piece)).await?;
+    }
+    return Ok(());
+}
+
+async fn connect_async(hostname: &str, port: u16) -> io::Result<tokio::net::TcpStream> {
+    let stream = within(tokio::net::TcpStream::connect((hostname, port))).await?;
+    stream.set_nodelay(true)?;
+    return Ok(stream);
+}
+
+async fn exchange_async(
+    stream: &mut tokio::net::TcpStream,
+    request_head: &[u8],
+    body: &[u8],
+) -> Result<(Response, bool), ExchangeError> {
+    write_all_within(stream, request_head)
+        .await
+        .map_err(ExchangeError::unsent)?;
+    write_all_within(stream, body)
+        .await
+        .map_err(ExchangeError::unsent)?;
+    within(stream.flush()).await.map_err(ExchangeError::unsent)?;
+
+    return read_response_async(stream, ResponseParser::new())
+        .await
+        .map_err(ExchangeError::sent);
+}
+
+// Reads the rest of a response into the parser, which may already hold its start
+async fn read_response_async(
+    stream: &mut tokio::net::TcpStream,
+    mut parser: ResponseParser,
+) -> io::Result<(Response, bool)> {
+    // Kept on the heap so that thousands of in-flight forwards stay small
+    let mut read_buffer = vec![0u8; 16 * 1024];
+
+    loop {
+        let read = within(stream.read(&mut read_buffer)).await?;
+        if read == 0 {
+            parser.finish_at_eof()?;
+            break;
+        }
+        if parser.feed(&read_buffer[..read])? {
+            break;
+        }
+    }
+
+    return Ok(parser.into_response());
+}
+
+// Pooled connections are stored as blocking std streams, convert them when used from async code
+fn into_async_stream(stream: TcpStream) -> io::Result<tokio::net::TcpStream> {
+    stream.set_nonblocking(true)?;
+    return tokio::net::TcpStream::from_std(stream);
+}
+
+fn into_blocking_stream(stream: tokio::net::TcpStream) -> io::Result<TcpStream> {
+    let stream = stream.into_std()?;
+    stream.set_nonblocking(false)?;
+    return Ok(stream);
+}
+
+fn checkin_async(peer: &str, stream: tokio::net::TcpStream) {
+    if let Ok(stream) = into_blocking_stream(stream) {
+        connection_pool::pool().checkin(peer, stream);
+    }
+}
+
+// Same as send_request, but waits on the async runtime instead of blocking a worker thread
+async fn send_request_async(
+    method: &str,
+    hostname: &str,
+    port: u16,
+    path: &str,
+    content_type: Option<&str>,
+    headers: &[(&str, &str)],
+    body: &[u8],
+) -> io::Result<Response> {
+    let pool = connection_pool::pool();
+    let peer = peer_key(hostname, port);
+    let request_head = encode_request_head(
+        method,
+        hostname,
+        port,
+        path,
+        content_type,
+        headers,
+        Some(body.len()),
+    );
+
+    if let Some(stream) = pool.checkout(&peer) {
+        if let Ok(mut stream) = into_async_stream(stream) {
+            match exchange_async(&mut stream, &request_head, body).await {
+                Ok((response, reusable)) => {
+                    if reusable {
+                        checkin_async(&peer, stream);
+                    }
+                    return Ok(response);
+                }
+                Err(failure) if failure.may_retry(method) => pool.record_stale(),
+                Err(failure) => {
+                    pool.evict_peer(hostname, port);
+                    return Err(failure.error);
+                }
+            }
+        }
+    }
+
+    let mut stream = match connect_async(hostname, port).await {
+        Ok(stream) => stream,
+        Err(err) => {
+            pool.evict_peer(hostname, port);
+            return Err(err);
+        }
+    };
+
+    let (response, reusable) = match exchange_async(&mut stream, &request_head, body).await {
+        Ok(exchanged) => exchanged,
+        Err(failure) => {
+            pool.evict_peer(hostname, port);
+            return Err(failure.error);
+        }
+    };
+
+    if reusable {
+        checkin_async(&peer, stream);
+    }
+
+    return Ok(response);
+}
+
+// Sends a request with a body of unknown length, copied from the reader in chunks as it arrives.
+// The body can only be read once, so it is never retried and always goes out on a fresh connection.
+async fn send_streamed_request_async<R>(
+    method: &str,
+    hostname: &str,
+    port: u16,
+    path: &str,
+    content_type: Option<&str>,
+    headers: &[(&str, &str)],
+    body: &mut R,
+) -> Result<StreamedResponse, NodeConnectionError>
+where
+    R: AsyncRead + Unpin,
+{
+    let pool = connection_pool::pool();
+    let peer = peer_key(hostname, port);
+    let request_head =
+        encode_request_head(method, hostname, port, path, content_type, headers, None);
 
-    let received_response = match minreq::get(request_uri).send() {
+    let mut stream = match connect_async(hostname, port).await {
+        Ok(stream) => stream,
         Err(_err) => {
+            pool.evict_peer(hostname, port);
             return Err(NodeConnectionError {
                 connection_established: false,
                 http_response: None,
             });
         }
-        Ok(response) => response,
     };
 
-    if received_response.status_code != 200 {
-        return Err(NodeConnectionError {
-            connection_established: true,
-            http_response: Some(received_response),
-        });
+    // Once connected the body is being consumed, so a failure from here on must not be retried elsewhere
+    let start = match exchange_streamed_async(&mut stream, &request_head, body).await {
+        Ok(start) => start,
+        Err(_err) => {
+            return Err(NodeConnectionError {
+                connection_established: true,
+                http_response: None,
+            });
+        }
+    };
+
+    return into_streamed_response(&peer, start, stream);
+}
+
+async fn exchange_streamed_async<R>(
+    stream: &mut tokio::net::TcpStream,
+    request_head: &[u8],
+    body: &mut R,
+) -> io::Result<ResponseStart>
+where
+    R: AsyncRead + Unpin,
+{
+    write_all_within(stream, request_head).await?;
+
+    // Only writes to the peer are timed, the body arrives as fast as our own client sends it
+    let mut chunk = vec![0u8; STREAM_CHUNK_SIZE];
+    loop {
+        let read = body.read(&mut chunk).await?;
+        if read == 0 {
+            break;
+        }
+        write_all_within(stream, format!("{:X}\r\n", read).as_bytes()).await?;
+        write_all_within(stream, &chunk[..read]).await?;
+        write_all_within(stream, b"\r\n").await?;
     }
+    write_all_within(stream, b"0\r\n\r\n").await?;
+    within(stream.flush()).await?;
 
-    return Ok(received_response);
+    return read_response_start_async(stream).await;
 }
 
-pub fn write_body_to_node<T>(
-    operation: WriteOperations,
+// Reads a body from a peer's socket, failing once a read has waited on the peer for longer than the
+// peer timeout. Time spent while nobody reads, because our own client is slow, does not count.
+struct IdleTimeout<R> {
+    inner: R,
+    deadline: Pin<Box<tokio::time::Sleep>>,
+    waiting: bool,
+}
+
+impl<R> IdleTimeout<R> {
+    fn new(inner: R) -> Self {
+        IdleTimeout {
+            inner: inner,
+            deadline: Box::pin(tokio::time::sleep(peer_timeout())),
+            waiting: false,
+        }
+    }
+}
+
+impl<R: AsyncRead + Unpin> AsyncRead for IdleTimeout<R> {
+    fn poll_read(
+        mut self: Pin<&mut Self>,
+        cx: &mut Context<'_>,
+        buf: &mut ReadBuf<'_>,
+    ) -> Poll<io::Result<()>> {
+        let this = &mut *self;
+
+        if let Poll::Ready(result) = Pin::new(&mut this.inner).poll_read(cx, buf) {
+            this.waiting = false;
+            return Poll::Ready(result);
+        }
+
+        if !this.waiting {
+            this.waiting = true;
+            this.deadline
+                .as_mut()
+                .reset(tokio::time::Instant::now() + peer_timeout());
+        }
+        match this.deadline.as_mut().poll(cx) {
+            Poll::Ready(()) => return Poll::Ready(Err(timed_out())),
+            Poll::Pending => return Poll::Pending,
+        };
+    }
+}
+
+// A successful response whose body is read as it arrives
+pub struct StreamedResponse {
+    pub content_type: Option<String>,
+    // Lowercased header names, like Response
+    pub headers: HashMap<String, String>,
+    pub content_length: usize,
+    pub body: Pin<Box<dyn AsyncRead + Send>>,
+}
+
+enum ResponseStart {
+    // Large body announced by Content-Length, the stream is positioned at the part not yet read
+    Streamable(ResponseHead, Vec<u8>),
+    Complete(Response, bool),
+}
+
+// Sends the request and reads until the head of the response has arrived. Small, chunked or failed
+// responses are read to the end, only large sized bodies are left on the stream for the caller.
+async fn start_response_async(
+    stream: &mut tokio::net::TcpStream,
+    request_head: &[u8],
+) -> io::Result<ResponseStart> {
+    write_all_within(stream, request_head).await?;
+    within(stream.flush()).await?;
+
+    return read_response_start_async(stream).await;
+}
+
+async fn read_response_start_async(
+    stream: &mut tokio::net::TcpStream,
+) -> io::Result<ResponseStart> {
+    let mut received: Vec<u8> = Vec::new();
+    let mut read_buffer = vec![0u8; 16 * 1024];
+
+    let head_end = loop {
+        let read = within(stream.read(&mut read_buffer)).await?;
+        if read == 0 {
+            return Err(io::Error::new(
+                io::ErrorKind::UnexpectedEof,
+                "Connection closed before response head",
+            ));
+        }
+        received.extend_from_slice(&read_buffer[..read]);
+        if let Some(head_end) = find_subsequence(&received, b"\r\n\r\n") {
+            break head_end;
+        }
+    };
+
+    let head = parse_head(&received[..head_end])?;
+    if let BodyFraming::Length(length) = head.framing {
+        if head.status_code == 200 && length > STREAM_THRESHOLD {
+            let mut body = received.split_off(head_end + 4);
+            body.truncate(length);
+            return Ok(ResponseStart::Streamable(head, body));
+        }
+    }
+
+    let mut parser = ResponseParser::new();
+    if parser.feed(&received)? {
+        let (response, reusable) = parser.into_response();
+        return Ok(ResponseStart::Complete(response, reusable));
+    }
+    let (response, reusable) = read_response_async(stream, parser).await?;
+    return Ok(ResponseStart::Complete(response, reusable));
+}
+
+async fn send_request_streamed_response_async(
     hostname: &str,
     port: u16,
     path: &str,
-    content_type: &str,
-    body: T,
-) -> Result<Response, NodeConnectionError>
-where
-    T: Into<Vec<u8>>,
-{
-    let request_uri = format!("http://{}:{}/{}", hostname, port, path);
+    headers: &[(&str, &str)],
+) -> io::Result<(ResponseStart, tokio::net::TcpStream)> {
+    let pool = connection_pool::pool();
+    let request_head = encode_request_head("GET", hostname, port, path, None, headers, Some(0));
 
-    let func = match operation {
-        WriteOperations::Post => minreq::post,
-        WriteOperations::Put => minreq::put,
-        WriteOperations::Delete => minreq::delete,
+    if let Some(stream) = pool.checkout(&peer_key(hostname, port)) {
+        if let Ok(mut stream) = into_async_stream(stream) {
+            match start_response_async(&mut stream, &request_head).await {
+                Ok(start) => return Ok((start, stream)),
+                // A peer that is too slow to answer would be just as slow on a fresh connection
+                Err(err) if is_timeout(&err) => {
+                    pool.evict_peer(hostname, port);
+                    return Err(err);
+                }
+                Err(_err) => pool.record_stale(),
+            }
+        }
+    }
+
+    let mut stream = match connect_async(hostname, port).await {
+        Ok(stream) => stream,
+        Err(err) => {
+            pool.evict_peer(hostname, port);
+            return Err(err);
+        }
     };
 
-    let received_response = match func(request_uri)
-        .with_body(body)
-        .with_header("Content-Type", content_type)
-        .send()
-    {
+    match start_response_async(&mut stream, &request_head).await {
+        Ok(start) => return Ok((start, stream)),
+        Err(err) => {
+            pool.evict_peer(hostname, port);
+            return Err(err);
+        }
+    };
+}
+
+fn into_node_result(
+    result: io::Result<Response>,
+) -> Result<Response, NodeConnectionError> {
+    let received_response = match result {
         Err(_err) => {
             return Err(NodeConnectionError {
                 connection_established: false,
@@ -85,6 +898,97 @@ where
     return Ok(received_response);
 }
 
+// Records the latency of a request to a peer, and whether the peer answered it at all
+fn observed<T>(
+    hostname: &str,
+    port: u16,
+    started_at: Instant,
+    result: Result<T, NodeConnectionError>,
+) -> Result<T, NodeConnectionError> {
+    let answered = match &result {
+        Ok(_value) => true,
+        Err(node_connection_error) => node_connection_error.http_response.is_some(),
+    };
+    metrics::metrics().record_outbound(&peer_key(hostname, port), started_at, answered);
+    return result;
+}
+
+pub fn check_if_node_is_connected() {}
+
+// Percent-encode a value for use in a path segment or query string
+pub fn encode_component(component: &str) -> String {
+    let mut encoded = String::with_capacity(component.len());
+
+    for byte in component.bytes() {
+        match byte {
+            b'A'..=b'Z' | b'a'..=b'z' | b'0'..=b'9' | b'-' | b'_' | b'.' | b'~' => {
+                encoded.push(byte as char)
+            }
+            _ => encoded.push_str(&format!("%{:02X}", byte)),
+        }
+    }
+
+    return encoded;
+}
+
+pub fn get_from_node(
+    hostname: &str,
+    port: u16,
+    path: &str,
+) -> Result<Response, NodeConnectionError> {
+    let started_at = Instant::now();
+    let result = into_node_result(send_request("GET", hostname, port, path, None, &[], &[], None));
+    return observed(hostname, port, started_at, result);
+}
+
+// Like get_from_node, but a peer that does not answer within the timeout counts as unreachable
+pub fn get_from_node_with_timeout(
+    hostname: &str,
+    port: u16,
+    path: &str,
+    timeout: Duration,
+) -> Result<Response, NodeConnectionError> {
+    let started_at = Instant::now();
+    let result = into_node_result(send_request(
+        "GET",
+        hostname,
+        port,
+        path,
+        None,
+        &[],
+        &[],
+        Some(timeout),
+    ));
+    return observed(hostname, port, started_at, result);
+}
+
+pub fn write_body_to_node<T>(
+    operation: WriteOperations,
+    hostname: &str,
+    port: u16,
+    path: &str,
+    content_type: &str,
+    body: T,
+) -> Result<Response, NodeConnectionError>
+where
+    T: Into<Vec<u8>>,
+{
+    let body: Vec<u8> = body.into();
+
+    let started_at = Instant::now();
+    let result = into_node_result(send_request(
+        operation.method(),
+        hostname,
+        port,
+        path,
+        Some(content_type),
+        &[],
+        &body,
+        None,
+    ));
+    return observed(hostname, port, started_at, result);
+}
+
 pub fn write_json_to_node<T>(
     operation: WriteOperations,
     hostname: &str,
@@ -95,34 +999,177 @@ pub fn write_json_to_node<T>(
 where
     T: serde::ser::Serialize,
 {
-    let request_uri = format!("http://{}:{}/{}", hostname, port, path);
+    let body = serde_json::to_vec(&content).expect("Could not serialize content.");
 
-    let func = match operation {
-        WriteOperations::Post => minreq::post,
-        WriteOperations::Put => minreq::put,
-        WriteOperations::Delete => minreq::delete,
-    };
+    let started_at = Instant::now();
+    let result = into_node_result(send_request(
+        operation.method(),
+        hostname,
+        port,
+        path,
+        Some("application/json"),
+        &[],
+        &body,
+        None,
+    ));
+    return observed(hostname, port, started_at, result);
+}
 
-    let received_response = match func(request_uri)
-        .with_json(&content)
-        .expect("Could not serialize content.")
-        .send()
-    {
+// Like write_json_to_node, but a peer that does not answer within the timeout counts as unreachable
+pub fn write_json_to_node_with_timeout<T>(
+    operation: WriteOperations,
+    hostname: &str,
+    port: u16,
+    path: &str,
+    content: T,
+    timeout: Duration,
+) -> Result<Response, NodeConnectionError>
+where
+    T: serde::ser::Serialize,
+{
+    let body = serde_json::to_vec(&content).expect("Could not serialize content.");
+
+    let started_at = Instant::now();
+    let result = into_node_result(send_request(
+        operation.method(),
+        hostname,
+        port,
+        path,
+        Some("application/json"),
+        &[],
+        &body,
+        Some(timeout),
+    ));
+    return observed(hostname, port, started_at, result);
+}
+
+pub async fn get_from_node_async(
+    hostname: &str,
+    port: u16,
+    path: &str,
+    headers: &[(&str, &str)],
+) -> Result<Response, NodeConnectionError> {
+    let started_at = Instant::now();
+    let result = into_node_result(
+        send_request_async("GET", hostname, port, path, None, headers, &[]).await,
+    );
+    return observed(hostname, port, started_at, result);
+}
+
+pub async fn write_body_to_node_async(
+    operation: WriteOperations,
+    hostname: &str,
+    port: u16,
+    path: &str,
+    content_type: &str,
+    headers: &[(&str, &str)],
+    body: &[u8],
+) -> Result<Response, NodeConnectionError> {
+    let started_at = Instant::now();
+    let result = into_node_result(
+        send_request_async(
+            operation.method(),
+            hostname,
+            port,
+            path,
+            Some(content_type),
+            headers,
+            body,
+        )
+        .await,
+    );
+    return observed(hostname, port, started_at, result);
+}
+
+// Same as get_from_node_async, but a large body is not buffered. It is handed back as a reader
+// that pulls from the socket, so it can be relayed to our own client as it arrives.
+pub async fn get_streamed_from_node_async(
+    hostname: &str,
+    port: u16,
+    path: &str,
+    headers: &[(&str, &str)],
+) -> Result<StreamedResponse, NodeConnectionError> {
+    // Timed until the head of the response, the body may take as long as our own client reads it
+    let started_at = Instant::now();
+    let started = send_request_streamed_response_async(hostname, port, path, headers).await;
+    metrics::metrics().record_outbound(&peer_key(hostname, port), started_at, started.is_ok());
+
+    let (start, stream) = match started {
+        Ok(started) => started,
         Err(_err) => {
             return Err(NodeConnectionError {
                 connection_established: false,
                 http_response: None,
             });
         }
-        Ok(response) => response,
     };
 
-    if received_response.status_code != 200 {
-        return Err(NodeConnectionError {
-            connection_established: true,
-            http_response: Some(received_response),
-        });
-    }
+    return into_streamed_response(&peer_key(hostname, port), start, stream);
+}
 
-    return Ok(received_response);
+// Hands a small response over whole, and a large one as a reader over the rest of the connection
+fn into_streamed_response(
+    peer: &str,
+    start: ResponseStart,
+    stream: tokio::net::TcpStream,
+) -> Result<StreamedResponse, NodeConnectionError> {
+    match start {
+        ResponseStart::Complete(response, reusable) => {
+            if reusable {
+                checkin_async(peer, stream);
+            }
+            let response = into_node_result(Ok(response))?;
+            return Ok(StreamedResponse {
+                content_type: response.headers.get("content-type").cloned(),
+                headers: response.headers,
+                content_length: response.body.len(),
+                body: Box::pin(io::Cursor::new(response.body)),
+            });
+        }
+        // The connection is dropped once the body is read, a half read stream can't go back to the pool
+        ResponseStart::Streamable(head, received) => {
+            let length = match head.framing {
+                BodyFraming::Length(length) => length,
+                _ => unreachable!("Only sized bodies are streamed"),
+            };
+            let remaining = (length - received.len()) as u64;
+            return Ok(StreamedResponse {
+                content_type: head.headers.get("content-type").cloned(),
+                headers: head.headers,
+                content_length: length,
+                body: Box::pin(AsyncReadExt::chain(
+                    io::Cursor::new(received),
+                    IdleTimeout::new(stream.take(remaining)),
+                )),
+            });
+        }
+    };
+}
+
+// Same as write_body_to_node_async, for a body that is read from a stream instead of memory. A large
+// response body is streamed back as well.
+pub async fn stream_body_to_node_async<R>(
+    operation: WriteOperations,
+    hostname: &str,
+    port: u16,
+    path: &str,
+    content_type: &str,
+    headers: &[(&str, &str)],
+    body: &mut R,
+) -> Result<StreamedResponse, NodeConnectionError>
+where
+    R: AsyncRead + Unpin,
+{
+    let started_at = Instant::now();
+    let result = send_streamed_request_async(
+        operation.method(),
+        hostname,
+        port,
+        path,
+        Some(content_type),
+        headers,
+        body,
+    )
+    .await;
+    return observed(hostname, port, started_at, result);
 }
@@ -0,0 +1,74 @@
+use std::env;
+use std::sync::OnceLock;
+
+// Most verbose level printed, set with A1_LOG_LEVEL (off, error, warn, info or debug)
+#[derive(Clone, Copy, Debug, PartialEq, PartialOrd)]
+pub enum LogLevel {
+    Off,
+    Error,
+    Warn,
+    Info,
+    Debug,
+}
+
+impl LogLevel {
+    pub fn as_str(&self) -> &'static str {
+        match self {
+            LogLevel::Off => "OFF",
+            LogLevel::Error => "ERROR",
+            LogLevel::Warn => "WARN",
+            LogLevel::Info => "INFO",
+            LogLevel::Debug => "DEBUG",
+        }
+    }
+
+    fn parse(value: &str) -> Option<Self> {
+        match value.to_lowercase().as_str() {
+            "off" => Some(LogLevel::Off),
+            "error" => Some(LogLevel::Error),
+            "warn" => Some(LogLevel::Warn),
+            "info" => Some(LogLevel::Info),
+            "debug" => Some(LogLevel::Debug),
+            _ => None,
+        }
+    }
+}
+
+fn log_level() -> LogLevel {
+    static LEVEL: OnceLock<LogLevel> = OnceLock::new();
+    return *LEVEL.get_or_init(|| {
+        env::var("A1_LOG_LEVEL")
+            .ok()
+            .and_then(|level| LogLevel::parse(&level))
+            .unwrap_or(LogLevel::Info)
+    });
+}
+
+// Checked before the message is formatted, so disabled levels cost a comparison and nothing else
+pub fn enabled(level: LogLevel) -> bool {
+    return level != LogLevel::Off && level <= log_level();
+}
+
+macro_rules! log_at {
+    ($level:expr, $($arg:tt)*) => {
+        if $crate::logging::enabled($level) {
+            println!("[{}] {}", $level.as_str(), format_args!($($arg)*));
+        }
+    };
+}
+
+macro_rules! log_error {
+    ($($arg:tt)*) => { log_at!($crate::logging::LogLevel::Error, $($arg)*) };
+}
+
+macro_rules! log_warn {
+    ($($arg:tt)*) => { log_at!($crate::logging::LogLevel::Warn, $($arg)*) };
+}
+
+macro_rules! log_info {
+    ($($arg:tt)*) => { log_at!($crate::logging::LogLevel::Info, $($arg)*) };
+}
+
+macro_rules! log_debug {
+    ($($arg:tt)*) => { log_at!($crate::logging::LogLevel::Debug, $($arg)*) };
+}
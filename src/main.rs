@@ -1,22 +1,34 @@
 #[macro_use]
 extern crate rocket;
 
-use minreq::Response;
-use rocket::http::{RawStr, Status};
+// Declared first so that its log macros can be used in every other module
+#[macro_use]
+mod logging;
+
+use bytes::Bytes;
+use rocket::data::{Data, Limits, ToByteUnit};
+use rocket::either::Either;
+use rocket::http::{ContentType, RawStr, Status};
 use rocket::response::status::{self, BadRequest, Conflict, Created, Custom, NoContent};
+use rocket::response::{self, Responder};
 use rocket::serde::Deserialize;
 use rocket::serde::{json::Json, Serialize};
-use rocket::{Shutdown, State};
+use rocket::tokio::io::AsyncReadExt;
+use rocket::{Request, Response, Shutdown, State};
 use sha1::{Digest, Sha1};
 use std::env;
 use std::fmt::format;
-use std::sync::{Arc, RwLock};
+use std::io::Cursor;
+use std::sync::{Arc, Mutex, RwLock};
 use std::thread;
-use std::time::Duration;
+use std::time::{Duration, Instant};
 
 // Declare and import the storage module
 mod storage;
-use storage::Storage;
+use storage::{ShardStatistics, Storage};
+
+mod write_log;
+use write_log::{FsyncMode, WriteLogStatistics};
 
 // Declare and import the nodeConfig module
 mod node_config;
@@ -24,8 +36,68 @@ use node_config::NodeConfig;
 
 mod http_connect;
 
+mod metrics;
+use metrics::{RequestMetrics, TimedLock};
+
+mod connection_pool;
+use connection_pool::PoolStatistics;
+
+mod replication;
+use replication::{ConsistencyLevel, CONSISTENCY_HEADER};
+
+mod read_cache;
+use read_cache::{CacheRequesters, ReadCacheStatistics, CACHE_REQUESTERS_HEADER};
+
+mod batch;
+use batch::{BatchRequest, BatchResponse};
+
+mod routing_mode;
+use routing_mode::{OwnerRedirect, Routed, RoutingMode, ROUTING_MODE_HEADER};
+
+mod route_trace;
+use route_trace::{RouteTrace, Traced};
+
+mod formation;
+use formation::{RingConfiguration, RingFormation};
+
+mod transfer;
+use transfer::{TransferChunk, TransferEntry, TransferReport};
+
+mod finger_table;
+use finger_table::{finger_start, FingerStatistics, FingerTable, FINGER_COUNT};
+
+mod failure_detector;
+use failure_detector::{FailureDetectorStatistics, Neighbour};
+
+mod membership;
+use membership::{MemberEntry, RingSnapshot};
+
 const RING_SIZE: u16 = u16::MAX; // Maximum size of the ring, and thereby maximum number of nodes supported
 
+const SUCCESSOR_LIST_LENGTH: usize = 4; // Successors remembered for failover, routing survives this many minus one consecutive failures
+
+const DEFAULT_REPLICATION_FACTOR: usize = 3; // Copies of every key including the owner's, override with A1_REPLICATION_FACTOR
+
+const RANGE_SUMMARY_HOPS: usize = 32; // Successors ahead covered by the range summary a joining node is split from
+
+const SPLIT_RESERVATION_TIMEOUT: Duration = Duration::from_secs(30); // A reservation whose joiner never committed is released after this long
+const JOIN_ATTEMPTS: u64 = 20; // Tries to reserve a range before a join gives up
+const JOIN_RETRY_DELAY_MS: u64 = 50; // Base back off between tries, grows with every attempt
+const CATCH_UP_ATTEMPTS: u64 = 5; // Tries of the last transfer of a join before the join is rolled back
+
+const MAX_LOOKUP_HOPS: usize = 1024; // Give up on a lookup that has not found the owner after this many hops
+
+const DEFAULT_MAX_VALUE_BYTES: u64 = 64 * 1024 * 1024; // Largest value put_storage accepts, override with A1_MAX_VALUE_BYTES
+
+const DEFAULT_FSYNC_MODE: FsyncMode = FsyncMode::Batched; // When A1_DATA_DIR is set, override with A1_FSYNC (always, batched or off)
+const DEFAULT_FSYNC_INTERVAL_MS: u64 = 100; // Time between write log flushes and batched syncs, override with A1_FSYNC_INTERVAL_MS
+const DEFAULT_COMPACT_BYTES: u64 = 64 * 1024 * 1024; // Log size that triggers a snapshot, override with A1_COMPACT_BYTES
+
+const DEFAULT_STABILIZE_INTERVAL_MS: u64 = 1000; // Time between successor list refreshes, override with A1_STABILIZE_INTERVAL_MS
+
+const DEFAULT_FIX_FINGERS_INTERVAL_MS: u64 = 500; // Time between finger repair rounds, override with A1_FIX_FINGERS_INTERVAL_MS
+const DEFAULT_FIX_FINGERS_PER_ROUND: usize = 2; // Fingers refreshed per round, override with A1_FIX_FINGERS_PER_ROUND
+
 #[derive(Serialize, Deserialize, Clone)]
 #[serde(crate = "rocket::serde")]
 struct NodeInfo {
@@ -66,14 +138,27 @@ struct SuppliedNode {
 
 #[derive(Serialize, Deserialize, Clone)]
 #[serde(crate = "rocket::serde")]
-struct LongestRangeRequest {
-    started_by: Node,
+struct LongestRangeResponse {
+    holder: Node,
 }
 
-#[derive(Serialize, Deserialize, Clone)]
+// Longest range among the nodes up to RANGE_SUMMARY_HOPS successors ahead, passed backwards around
+// the ring by stabilization. The window lets stale holders fall out instead of circulating forever.
+#[derive(Serialize, Deserialize, Clone, Debug)]
 #[serde(crate = "rocket::serde")]
-struct LongestRangeResponse {
+struct RangeSummary {
     holder: Node,
+    hops: usize,
+}
+
+// The part of a node's range handed to a joining node, and the neighbours it will have
+#[derive(Serialize, Deserialize, Clone)]
+#[serde(crate = "rocket::serde")]
+struct SplitReservation {
+    position: u16,
+    range: u16,
+    precessor: Node,
+    successor: Node,
 }
 
 #[derive(Serialize, Deserialize, Clone)]
@@ -82,6 +167,88 @@ struct FingerTableInformation {
     size: u16,
 }
 
+#[derive(Serialize, Deserialize, Clone)]
+#[serde(crate = "rocket::serde")]
+struct LookupResponse {
+    node: Node,
+    owner: bool,
+}
+
+// A stored value, handed to Rocket as reference counted bytes so that serving it does not copy it
+struct StorageValue(Bytes);
+
+impl<'r> Responder<'r, 'static> for StorageValue {
+    fn respond_to(self, _request: &'r Request<'_>) -> response::Result<'static> {
+        // Values are bytes, only those that are valid UTF-8 are served as text
+        let content_type = match std::str::from_utf8(&self.0) {
+            Ok(_text) => ContentType::Plain,
+            Err(_err) => ContentType::Binary,
+        };
+
+        Response::build()
+            .header(content_type)
+            .sized_body(self.0.len(), Cursor::new(self.0))
+            .ok()
+    }
+}
+
+// A value relayed from another node, passed on to our client as it arrives from the socket
+struct ForwardedValue(http_connect::StreamedResponse);
+
+impl<'r> Responder<'r, 'static> for ForwardedValue {
+    fn respond_to(self, _request: &'r Request<'_>) -> response::Result<'static> {
+        let content_type = self
+            .0
+            .content_type
+            .as_deref()
+            .and_then(ContentType::parse_flexible)
+            .unwrap_or(ContentType::Binary);
+
+        // Announce the length up front rather than chunking, so the node before us can stream the value on too
+        Response::build()
+            .header(content_type)
+            .raw_header("Content-Length", self.0.content_length.to_string())
+            .streamed_body(self.0.body)
+            .ok()
+    }
+}
+
+fn value_too_large(max_value_bytes: u64) -> Custom<String> {
+    return status::Custom(
+        Status::PayloadTooLarge,
+        format!("Value is larger than {} bytes", max_value_bytes),
+    );
+}
+
+// The write log could not take the change, so it was not applied
+fn storage_failed(err: std::io::Error) -> Custom<String> {
+    let error_message = format!("Could not store the change: {}", err);
+    log_error!("{}", &error_message);
+    return status::Custom(Status::InternalServerError, error_message);
+}
+
+// Runs storage work from an async handler. Durable storage writes to disk and, with A1_FSYNC=always,
+// waits for the sync, so it runs on the blocking pool and does not hold up the async workers.
+async fn on_storage<T, F>(storage: Arc<Storage>, work: F) -> T
+where
+    F: FnOnce(&Storage) -> T + Send + 'static,
+    T: Send + 'static,
+{
+    if !storage.is_durable() {
+        return work(&storage);
+    }
+    return rocket::tokio::task::spawn_blocking(move || work(&storage))
+        .await
+        .expect("Storage task panicked");
+}
+
+// The ring is changing under the request, or the routing state is inconsistent
+fn hop_limit_reached() -> Custom<String> {
+    let error_message = format!("Hop limit of {} reached.", route_trace::max_hops());
+    log_warn!("{}", &error_message);
+    return status::Custom(Status::LoopDetected, error_message);
+}
+
 fn key_to_location(key: &str) -> u16 {
     // We use the hasher to hash the given key
     let mut hasher = Sha1::new();
@@ -104,21 +271,14 @@ fn is_location_in_range(location: u16, position: u16, range: u16) -> bool {
     }
 }
 
-fn shortest_distance_on_circumference(p1: u16, p2: u16) -> i32 {
-    let forwards_distance = i32::from(p2) - i32::from(p1);
-    let backwards_distance = (i32::from(RING_SIZE) - i32::from(p2)) + i32::from(p1);
-
-    if forwards_distance < backwards_distance {
-        return forwards_distance.into();
-    } else {
-        return -i32::from(backwards_distance);
-    }
+fn clockwise_distance(from: u16, to: u16) -> u32 {
+    return (i32::from(to) - i32::from(from)).rem_euclid(i32::from(RING_SIZE)) as u32;
 }
 
 // end-point to test if the server is running
 #[get("/helloworld")]
 fn helloworld(node_config: &State<Arc<RwLock<NodeConfig>>>) -> Result<String, Custom<String>> {
-    let config = node_config.read().expect("RWLock is poisoned");
+    let config = node_config.read_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -127,11 +287,7 @@ fn helloworld(node_config: &State<Arc<RwLock<NodeConfig>>>) -> Result<String, Cu
         ));
     }
 
-    Ok(format!(
-        "{}:{}",
-        node_config.read().unwrap().local.hostname,
-        node_config.read().unwrap().local.port
-    ))
+    Ok(format!("{}:{}", config.local.hostname, config.local.port))
 }
 
 #[get("/shutdown")]
@@ -142,7 +298,7 @@ fn shutdown(shutdown: Shutdown) -> String {
 
 #[post("/sim-crash")]
 fn post_sim_crash(node_config: &State<Arc<RwLock<NodeConfig>>>) -> Result<(), Custom<String>> {
-    let mut config = node_config.write().expect("RWLock is poisoned");
+    let mut config = node_config.write_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -157,162 +313,574 @@ fn post_sim_crash(node_config: &State<Arc<RwLock<NodeConfig>>>) -> Result<(), Cu
 
 #[post("/sim-recover")]
 fn post_sim_recover(node_config: &State<Arc<RwLock<NodeConfig>>>) -> () {
-    let mut config = node_config.write().expect("RWLock is poisoned");
+    let mut config = node_config.write_timed().expect("RWLock is poisoned");
     config.recover();
 }
 
 // endpoint to retrive a value for a given
 #[get("/storage/<key>")]
-fn get_storage(
+async fn get_storage(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
     key: &str,
-) -> Result<String, Custom<String>> {
-    let config = node_config.read().expect("RWLock is poisoned");
+    routing_mode: RoutingMode,
+    requesters: CacheRequesters,
+    trace: RouteTrace,
+) -> Result<Routed<Traced<Either<StorageValue, ForwardedValue>>>, Custom<String>> {
+    let hashed_location: u16 = key_to_location(key);
+    let cache = read_cache::read_cache();
+    let method = "GET";
 
-    if config.is_crashed() {
-        return Err(status::Custom(
-            Status::ServiceUnavailable,
-            String::from("Node is crashed"),
-        ));
+    // Decide where the request goes while holding the lock, and release it before any network I/O
+    let (forward_nodes, replica_nodes, local_address, local_position) = {
+        let config = node_config.read_timed().expect("RWLock is poisoned");
+
+        if config.is_crashed() {
+            return Err(status::Custom(
+                Status::ServiceUnavailable,
+                String::from("Node is crashed"),
+            ));
+        }
+
+        let served = trace.visit(config.local.position, false);
+
+        if is_location_in_range(hashed_location, config.local.position, config.local.range) {
+            metrics::metrics().record_storage_request(method, "local");
+            match config.storage.retrieve_bytes(key) {
+                Some(value) => {
+                    cache.record_requesters(key, &requesters);
+                    return Ok(Routed::Served(Traced(
+                        Either::Left(StorageValue(value)),
+                        served,
+                    )));
+                }
+                None => {
+                    return Err(status::Custom(
+                        Status::NotFound,
+                        String::from("Key not found"),
+                    ))
+                }
+            };
+        }
+
+        // Any live replica can serve a read, but only for keys in the range we currently replicate
+        let replica = if config.holds_replica(hashed_location) {
+            config.storage.retrieve_bytes(key)
+        } else {
+            None
+        };
+        if let Some(value) = replica {
+            metrics::metrics().record_storage_request(method, "replica");
+            cache.record_requesters(key, &requesters);
+            return Ok(Routed::Served(Traced(
+                Either::Left(StorageValue(value)),
+                served,
+            )));
+        }
+
+        (
+            config.forward_candidates(hashed_location),
+            config.successors_past(hashed_location),
+            connection_pool::peer_key(&config.local.hostname, config.local.port),
+            config.local.position,
+        )
+    };
+
+    // A popular key may have passed through here recently
+    if let Some(value) = cache.get(key) {
+        metrics::metrics().record_storage_request(method, "cached");
+        return Ok(Routed::Served(Traced(
+            Either::Left(StorageValue(value)),
+            trace.visit(local_position, false),
+        )));
+    }
+
+    let path = format!("storage/{}", http_connect::encode_component(key));
+
+    if routing_mode == RoutingMode::Redirect {
+        metrics::metrics().record_storage_request(method, "redirected");
+        let target = redirect_target(forward_nodes[0].clone(), hashed_location).await;
+        return Ok(Routed::Redirect(OwnerRedirect {
+            node: target,
+            path: path,
+        }));
+    }
+
+    // Early returns for cases where key is under over jurisdiction, so if we get here we need to forward the request
+    if !trace.may_forward() {
+        return Err(hop_limit_reached());
+    }
+    log_debug!("Forwarding request!");
+    metrics::metrics().record_storage_request(method, "forwarded");
+
+    // We relay the answer ourselves, so the next node must not redirect us. If we cache the answer,
+    // the node that serves it must know to invalidate our copy.
+    let cached_by = requesters.with(cache.is_enabled().then_some(local_address));
+    let forwarded = trace.visit(local_position, true);
+    let trace_headers = forwarded.headers();
+    let mut headers = vec![(ROUTING_MODE_HEADER, RoutingMode::Proxy.as_str())];
+    if !cached_by.is_empty() {
+        headers.push((CACHE_REQUESTERS_HEADER, cached_by.as_str()));
+    }
+    headers.extend(trace_headers.iter().map(|(name, value)| (*name, value.as_str())));
+
+    // Try the next hop first, and fall over to the next live candidate if it is down
+    for forward_node in forward_nodes.iter() {
+        match http_connect::get_streamed_from_node_async(
+            &forward_node.hostname,
+            forward_node.port,
+            &path,
+            &headers,
+        )
+        .await
+        {
+            // Small values are in memory already, keep a copy of them for the next read
+            Ok(mut response)
+                if cache.is_enabled()
+                    && response.content_length <= http_connect::STREAM_THRESHOLD =>
+            {
+                let answered =
+                    RouteTrace::from_response(&response.headers).unwrap_or(forwarded.clone());
+                let mut value = Vec::with_capacity(response.content_length);
+                if let Err(_err) = response.body.read_to_end(&mut value).await {
+                    continue;
+                }
+                let value = Bytes::from(value);
+                cache.insert(key, value.clone());
+                return Ok(Routed::Served(Traced(
+                    Either::Left(StorageValue(value)),
+                    answered,
+                )));
+            }
+            Ok(response) => {
+                let answered =
+                    RouteTrace::from_response(&response.headers).unwrap_or(forwarded.clone());
+                return Ok(Routed::Served(Traced(
+                    Either::Right(ForwardedValue(response)),
+                    answered,
+                )));
+            }
+            Err(node_connection_error) => {
+                if node_connection_error.is_unreachable() {
+                    continue;
+                }
+
+                match node_connection_error.http_response {
+                    Some(http_response) if http_response.status_code == 404 => {
+                        return Err(status::Custom(
+                            Status::NotFound,
+                            String::from("Key not found"),
+                        ))
+                    }
+                    Some(http_response) if http_response.status_code == 508 => {
+                        return Err(hop_limit_reached())
+                    }
+                    _ => (),
+                };
+
+                let error_message = String::from("Forwarded request failed.");
+                log_warn!("{}", &error_message);
+                return Err(status::Custom(Status::FailedDependency, error_message));
+            }
+        };
     }
 
+    // The owner is down, the nodes after it hold its replicas
+    let replica_path = format!("replica/{}", http_connect::encode_component(key));
+    for replica_node in replica_nodes.iter() {
+        match http_connect::get_streamed_from_node_async(
+            &replica_node.hostname,
+            replica_node.port,
+            &replica_path,
+            &[],
+        )
+        .await
+        {
+            Ok(response) => {
+                return Ok(Routed::Served(Traced(
+                    Either::Right(ForwardedValue(response)),
+                    forwarded.visit(replica_node.position, false),
+                )))
+            }
+            Err(_err) => continue,
+        };
+    }
+
+    let error_message = String::from("Could not connect to successor to forward request.");
+    log_warn!("{}", &error_message);
+    return Err(status::Custom(Status::FailedDependency, error_message));
+}
+
+// endpoint to store a key-value pair, the value may be text or binary
+#[put("/storage/<key>", data = "<value>")]
+async fn put_storage(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+    key: &str,
+    value: Data<'_>,
+    content_type: Option<&ContentType>,
+    consistency: ConsistencyLevel,
+    routing_mode: RoutingMode,
+    trace: RouteTrace,
+) -> Result<Routed<Traced<Either<StorageValue, ForwardedValue>>>, Custom<String>> {
     let hashed_location: u16 = key_to_location(key);
+    let cache = read_cache::read_cache();
+    let method = "PUT";
 
-    if is_location_in_range(hashed_location, config.local.position, config.local.range) {
-        match config.storage.retrieve(key) {
-            Some(value) => return Ok(value),
-            None => {
+    // Our own cached copy is stale whoever owns the key, later reads here must see the write
+    cache.invalidate(key);
+
+    // Decide where the request goes while holding the lock, and release it before any network I/O
+    let (owned, forward_nodes, max_value_bytes, local_position) = {
+        let config = node_config.read_timed().expect("RWLock is poisoned");
+
+        if config.is_crashed() {
+            return Err(status::Custom(
+                Status::ServiceUnavailable,
+                String::from("Node is crashed"),
+            ));
+        }
+
+        if is_location_in_range(hashed_location, config.local.position, config.local.range) {
+            (true, vec![], config.max_value_bytes, config.local.position)
+        } else {
+            (
+                false,
+                config.forward_candidates(hashed_location),
+                config.max_value_bytes,
+                config.local.position,
+            )
+        }
+    };
+
+    if owned {
+        metrics::metrics().record_storage_request(method, "local");
+
+        // Storage holds whole values, so the owner is the only node that reads the value in full
+        let value = match value.open(max_value_bytes.bytes()).into_bytes().await {
+            Ok(value) if value.is_complete() => Bytes::from(value.into_inner()),
+            Ok(_value) => return Err(value_too_large(max_value_bytes)),
+            Err(_err) => {
                 return Err(status::Custom(
-                    Status::NotFound,
-                    String::from("Key not found"),
+                    Status::BadRequest,
+                    String::from("Could not read value"),
                 ))
             }
         };
+
+        let (storage, replicas) = {
+            let config = node_config.read_timed().expect("RWLock is poisoned");
+            (config.storage.clone(), config.replica_nodes())
+        };
+        let stored_key = String::from(key);
+        let stored_value = value.clone();
+        let stored = on_storage(storage, move |storage| storage.store_bytes(&stored_key, stored_value));
+        if let Err(err) = stored.await {
+            return Err(storage_failed(err));
+        }
+        cache.invalidate_requesters(key);
+
+        // Our own copy counts towards the consistency level
+        let required_acks = consistency.required_copies(replicas.len() + 1) - 1;
+
+        // The stored value is echoed back, Bytes are reference counted so this does not copy it
+        if replication::replicate_write(replicas, key, value.clone(), required_acks).await {
+            return Ok(Routed::Served(Traced(
+                Either::Left(StorageValue(value)),
+                trace.visit(local_position, false),
+            )));
+        }
+
+        let error_message = format!(
+            "Write did not reach consistency level {}.",
+            consistency.as_str()
+        );
+        log_warn!("{}", &error_message);
+        return Err(status::Custom(Status::FailedDependency, error_message));
     }
 
-    // Early returns for cases where key is under over jurisdiction, so if we get here we need to forward the request
-    println!("Forwarding request!");
-    let mut forward_node_distance =
-        shortest_distance_on_circumference(config.local.position, hashed_location).abs();
+    let path = format!("storage/{}", http_connect::encode_component(key));
+
+    if routing_mode == RoutingMode::Redirect {
+        metrics::metrics().record_storage_request(method, "redirected");
+        let target = redirect_target(forward_nodes[0].clone(), hashed_location).await;
+        return Ok(Routed::Redirect(OwnerRedirect {
+            node: target,
+            path: path,
+        }));
+    }
 
-    let mut forward_node =
-        if shortest_distance_on_circumference(config.local.position, hashed_location) < 0 {
-            config.precessor.clone()
+    // Early returns for cases where key is under over jurisdiction, so if we get here we need to forward the request
+    if !trace.may_forward() {
+        return Err(hop_limit_reached());
+    }
+    log_debug!("Forwarding request!");
+    metrics::metrics().record_storage_request(method, "forwarded");
+
+    // One byte past the limit is passed on, so that the owner can tell the value is too large
+    let mut value_stream = value.open((max_value_bytes + 1).bytes());
+
+    // Small values are buffered, so they go out on a pooled connection and can be retried on the next
+    // candidate. Larger ones are streamed to the next hop as they arrive and never held here in full.
+    let mut start = Vec::new();
+    if let Err(_err) = (&mut value_stream)
+        .take(http_connect::STREAM_THRESHOLD as u64 + 1)
+        .read_to_end(&mut start)
+        .await
+    {
+        return Err(status::Custom(
+            Status::BadRequest,
+            String::from("Could not read value"),
+        ));
+    }
+    let streamed = start.len() > http_connect::STREAM_THRESHOLD;
+
+    let content_type = content_type
+        .map(|content_type| content_type.to_string())
+        .unwrap_or_else(|| ContentType::Binary.to_string());
+    let forwarded_trace = trace.visit(local_position, true);
+    let trace_headers = forwarded_trace.headers();
+    let mut headers = vec![
+        (CONSISTENCY_HEADER, consistency.as_str()),
+        (ROUTING_MODE_HEADER, RoutingMode::Proxy.as_str()),
+    ];
+    headers.extend(trace_headers.iter().map(|(name, value)| (*name, value.as_str())));
+
+    // Try the next hop first, and fall over to the next live candidate if it is down
+    for forward_node in forward_nodes.iter() {
+        let forwarded = if streamed {
+            let mut body = Cursor::new(&start[..]).chain(&mut value_stream);
+            http_connect::stream_body_to_node_async(
+                http_connect::WriteOperations::Put,
+                &forward_node.hostname,
+                forward_node.port,
+                &path,
+                &content_type,
+                &headers,
+                &mut body,
+            )
+            .await
+            .map(|response| {
+                let answered = RouteTrace::from_response(&response.headers);
+                (answered, Either::Right(ForwardedValue(response)))
+            })
         } else {
-            config.successor.clone()
+            http_connect::write_body_to_node_async(
+                http_connect::WriteOperations::Put,
+                &forward_node.hostname,
+                forward_node.port,
+                &path,
+                &content_type,
+                &headers,
+                &start,
+            )
+            .await
+            .map(|response| {
+                let answered = RouteTrace::from_response(&response.headers);
+                let value = Bytes::from(response.into_bytes());
+                (answered, Either::Left(StorageValue(value)))
+            })
         };
 
-    // See if the key is closer to any node in the finger table
-    if config.finger_table.len() > 0 {
-        for node in config.finger_table.iter() {
-            if shortest_distance_on_circumference(node.position, hashed_location).abs()
-                < forward_node_distance
-            {
-                forward_node = node.clone();
-                forward_node_distance =
-                    shortest_distance_on_circumference(node.position, hashed_location).abs();
+        // The owner echoes the value, a large one is passed back to our client as it arrives
+        match forwarded {
+            Ok((answered, value)) => {
+                let answered = answered.unwrap_or(forwarded_trace.clone());
+                return Ok(Routed::Served(Traced(value, answered)));
             }
-        }
+            Err(node_connection_error) => {
+                // Once connected, a streamed body has been read from our client and can't be sent again
+                let body_consumed = streamed && node_connection_error.connection_established;
+                if node_connection_error.is_unreachable() && !body_consumed {
+                    continue;
+                }
+
+                match node_connection_error.http_response {
+                    Some(http_response) if http_response.status_code == 413 => {
+                        return Err(value_too_large(max_value_bytes))
+                    }
+                    Some(http_response) if http_response.status_code == 508 => {
+                        return Err(hop_limit_reached())
+                    }
+                    _ => (),
+                };
+                break;
+            }
+        };
     }
 
-    let forward_request_response = match http_connect::get_from_node(
-        &forward_node.hostname,
-        forward_node.port,
-        &format!("storage/{}", key),
-    ) {
-        Ok(response) => response,
-        Err(node_connection_error) => {
-            if node_connection_error.connection_established
-                && node_connection_error
-                    .http_response
-                    .is_some_and(|http_response| http_response.status_code == 404)
-            {
-                return Err(status::Custom(
-                    Status::NotFound,
-                    String::from("Key not found"),
-                ));
+    let error_message = String::from("Could not connect to successor to forward request.");
+    log_warn!("{}", &error_message);
+    return Err(status::Custom(Status::FailedDependency, error_message));
+}
+
+// Gets and stores many keys in one request. Keys we own are handled here, the others are grouped
+// by the next hop towards their owner and every group is sent on as one sub-batch, in parallel.
+#[post("/storage/_batch", format = "json", data = "<batch>")]
+async fn post_storage_batch(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+    batch: Json<BatchRequest>,
+    consistency: ConsistencyLevel,
+    trace: RouteTrace,
+) -> Result<Json<BatchResponse>, Custom<String>> {
+    let mut response = BatchResponse::default();
+    let mut owned_puts: Vec<(TransferEntry, Bytes)> = Vec::new();
+    let mut sub_batches: Vec<(Vec<Node>, BatchRequest)> = Vec::new();
+
+    // Split the batch while holding the lock, and release it before any network I/O
+    let (storage, replicas, forwarded_trace) = {
+        let config = node_config.read_timed().expect("RWLock is poisoned");
+
+        if config.is_crashed() {
+            return Err(status::Custom(
+                Status::ServiceUnavailable,
+                String::from("Node is crashed"),
+            ));
+        }
+
+        for key in batch.0.get {
+            let hashed_location = key_to_location(&key);
+            let owned =
+                is_location_in_range(hashed_location, config.local.position, config.local.range);
+
+            // Any replica we hold can serve the read, just like a single get
+            let stored = if owned || config.holds_replica(hashed_location) {
+                config.storage.retrieve_bytes(&key)
             } else {
-                let error_message =
-                    String::from("Could not connect to successor to forward request.");
-                println!("{}", &error_message);
-                return Err(status::Custom(Status::FailedDependency, error_message));
+                None
+            };
+            match stored {
+                Some(value) => response.found.push(TransferEntry::new(key, &value)),
+                None if owned => response.missing.push(key),
+                None => {
+                    batch::sub_batch(&mut sub_batches, config.forward_candidates(hashed_location))
+                        .get
+                        .push(key)
+                }
+            };
+        }
+
+        for entry in batch.0.put {
+            let hashed_location = key_to_location(&entry.key);
+
+            if is_location_in_range(hashed_location, config.local.position, config.local.range) {
+                match entry.value_bytes() {
+                    Some(value) => owned_puts.push((entry, value)),
+                    None => response.failed.push(entry.key),
+                };
+            } else {
+                batch::sub_batch(&mut sub_batches, config.forward_candidates(hashed_location))
+                    .put
+                    .push(entry);
             }
         }
+
+        // Refuse the whole batch before any of it is applied, like a single request
+        if !sub_batches.is_empty() && !trace.may_forward() {
+            return Err(hop_limit_reached());
+        }
+
+        (
+            config.storage.clone(),
+            config.replica_nodes(),
+            trace.visit(config.local.position, true),
+        )
     };
 
-    return Ok(String::from(
-        forward_request_response.as_str().expect("No body found"),
-    ));
-}
+    // A key the write log could not take fails on its own and is not replicated
+    let (owned_puts, failed_puts) = on_storage(storage, move |storage| {
+        let mut stored_puts: Vec<TransferEntry> = Vec::new();
+        let mut failed_puts: Vec<String> = Vec::new();
+        for (entry, value) in owned_puts.into_iter() {
+            match storage.store_bytes(&entry.key, value) {
+                Ok(()) => stored_puts.push(entry),
+                Err(err) => {
+                    log_error!("Could not store {}: {}", entry.key, err);
+                    failed_puts.push(entry.key);
+                }
+            };
+        }
+        (stored_puts, failed_puts)
+    })
+    .await;
+    response.failed.extend(failed_puts);
 
-// endpoint to store a key-value pair
-#[put("/storage/<key>", format = "text", data = "<value>")]
-fn put_storage(
-    node_config: &State<Arc<RwLock<NodeConfig>>>,
-    key: &str,
-    value: &str,
-) -> Result<String, Custom<String>> {
-    let config = node_config.read().expect("RWLock is poisoned");
+    let forwarded =
+        batch::send_sub_batches(sub_batches, consistency.as_str(), forwarded_trace.headers());
 
-    if config.is_crashed() {
-        return Err(status::Custom(
-            Status::ServiceUnavailable,
-            String::from("Node is crashed"),
-        ));
-    }
+    // Our own copy counts towards the consistency level
+    let required_acks = consistency.required_copies(replicas.len() + 1) - 1;
+    let replicated = replication::replicate_entries(replicas, &owned_puts, required_acks);
 
-    let hashed_location: u16 = key_to_location(key);
+    let (forwarded, replicated) = rocket::tokio::join!(forwarded, replicated);
 
-    if is_location_in_range(hashed_location, config.local.position, config.local.range) {
-        config.storage.store(key, value);
-        return Ok(String::from(value));
+    let cache = read_cache::read_cache();
+    for entry in owned_puts.iter() {
+        cache.invalidate_requesters(&entry.key);
     }
 
-    // Early returns for cases where key is under over jurisdiction, so if we get here we need to forward the request
-    println!("Forwarding request!");
+    let owned_keys = owned_puts.into_iter().map(|entry| entry.key);
+    if replicated {
+        response.stored.extend(owned_keys);
+    } else {
+        response.failed.extend(owned_keys);
+    }
+    response.merge(forwarded);
 
-    let mut forward_node_distance =
-        shortest_distance_on_circumference(config.local.position, hashed_location).abs();
+    return Ok(Json(response));
+}
 
-    let mut forward_node =
-        if shortest_distance_on_circumference(config.local.position, hashed_location) < 0 {
-            config.precessor.clone()
-        } else {
-            config.successor.clone()
-        };
+// Stores a copy of a key written on its owner, without checking that it is in our range
+#[put("/replica/<key>", data = "<value>")]
+async fn put_replica(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+    key: &str,
+    value: Data<'_>,
+) -> Result<(), Custom<String>> {
+    let max_value_bytes = {
+        let config = node_config.read_timed().expect("RWLock is poisoned");
 
-    // See if the key is closer to any node in the finger table
-    if config.finger_table.len() > 0 {
-        for node in config.finger_table.iter() {
-            if shortest_distance_on_circumference(node.position, hashed_location).abs()
-                < forward_node_distance
-            {
-                forward_node = node.clone();
-                forward_node_distance =
-                    shortest_distance_on_circumference(node.position, hashed_location).abs();
-            }
+        if config.is_crashed() {
+            return Err(status::Custom(
+                Status::ServiceUnavailable,
+                String::from("Node is crashed"),
+            ));
         }
-    }
 
-    let forward_request_response = http_connect::write_body_to_node(
-        http_connect::WriteOperations::Post,
-        &forward_node.hostname,
-        forward_node.port,
-        &format!("storage/{}", key),
-        "text/plain",
-        value,
-    );
+        config.max_value_bytes
+    };
 
-    forward_request_response.expect("Could not forward request");
+    let value = match value.open(max_value_bytes.bytes()).into_bytes().await {
+        Ok(value) if value.is_complete() => Bytes::from(value.into_inner()),
+        Ok(_value) => return Err(value_too_large(max_value_bytes)),
+        Err(_err) => {
+            return Err(status::Custom(
+                Status::BadRequest,
+                String::from("Could not read value"),
+            ))
+        }
+    };
+
+    let storage = node_config
+        .read_timed()
+        .expect("RWLock is poisoned")
+        .storage
+        .clone();
+    let stored_key = String::from(key);
+    let stored = on_storage(storage, move |storage| storage.store_bytes(&stored_key, value));
+    if let Err(err) = stored.await {
+        return Err(storage_failed(err));
+    }
+    read_cache::read_cache().invalidate_requesters(key);
 
-    return Ok(String::from(value));
+    Ok(())
 }
 
-#[get("/ring/precessor")]
-fn get_precessor(
+// Serves a key from local storage only, used when its owner is down
+#[get("/replica/<key>")]
+fn get_replica(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
-) -> Result<Json<Node>, Custom<String>> {
-    let config = node_config.read().expect("RWLock is poisoned");
+    key: &str,
+) -> Result<StorageValue, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -321,14 +889,39 @@ fn get_precessor(
         ));
     }
 
-    return Ok(Json(config.precessor.clone()));
+    // A copy of a key we are no longer a replica of may be stale, let the caller try the next node
+    let hashed_location = key_to_location(key);
+    if !is_location_in_range(hashed_location, config.local.position, config.local.range)
+        && !config.holds_replica(hashed_location)
+    {
+        return Err(status::Custom(
+            Status::NotFound,
+            String::from("Key not found"),
+        ));
+    }
+
+    match config.storage.retrieve_bytes(key) {
+        Some(value) => return Ok(StorageValue(value)),
+        None => {
+            return Err(status::Custom(
+                Status::NotFound,
+                String::from("Key not found"),
+            ))
+        }
+    };
 }
 
-#[get("/ring/successor")]
-fn get_successor(
+// Serves one chunk of the keys in [position, position + range), for a node taking over the range
+#[get("/transfer/range?<position>&<range>&<snapshot>&<after>&<limit>")]
+fn get_transfer_range(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
-) -> Result<Json<Node>, Custom<String>> {
-    let config = node_config.read().expect("RWLock is poisoned");
+    position: u16,
+    range: u16,
+    snapshot: Option<u64>,
+    after: Option<&str>,
+    limit: Option<usize>,
+) -> Result<Json<TransferChunk>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -337,13 +930,153 @@ fn get_successor(
         ));
     }
 
-    return Ok(Json(config.successor.clone()));
+    return Ok(Json(transfer::read_chunk(
+        &config.storage,
+        position,
+        range,
+        snapshot,
+        after,
+        limit.unwrap_or(transfer::CHUNK_KEYS),
+    )));
 }
 
-#[get("/ring/local")]
-fn get_local(node_config: &State<Arc<RwLock<NodeConfig>>>) -> Result<Json<Node>, Custom<String>> {
-    let config = node_config.read().expect("RWLock is poisoned");
-
+// Stores a chunk of keys pushed by a node handing over its range
+#[put("/transfer/entries", format = "json", data = "<entries>")]
+fn put_transfer_entries(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+    entries: Json<Vec<TransferEntry>>,
+) -> Result<(), Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    if let Err(error_message) = transfer::store_chunk(&config.storage, &entries.0) {
+        log_error!("{}", &error_message);
+        return Err(status::Custom(Status::InternalServerError, error_message));
+    }
+
+    // Replicated batch writes arrive here, cached copies of them are stale now
+    let cache = read_cache::read_cache();
+    for entry in entries.0.iter() {
+        cache.invalidate_requesters(&entry.key);
+    }
+
+    Ok(())
+}
+
+// Drops keys that have been taken over by another node
+#[delete("/transfer/range?<position>&<range>")]
+fn delete_transfer_range(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+    position: u16,
+    range: u16,
+) -> Result<String, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    // Never drop keys we are still responsible for
+    if is_location_in_range(position, config.local.position, config.local.range) {
+        return Err(status::Custom(
+            Status::Conflict,
+            String::from("Range is still owned by this node"),
+        ));
+    }
+
+    match config.storage.remove_range(position, range) {
+        Ok(removed) => return Ok(format!("Removed {} keys", removed)),
+        Err(err) => return Err(storage_failed(err)),
+    };
+}
+
+#[get("/ring/precessor")]
+fn get_precessor(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<Node>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    return Ok(Json(config.precessor.clone()));
+}
+
+#[get("/ring/successor")]
+fn get_successor(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<Node>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    return Ok(Json(config.successor.clone()));
+}
+
+#[get("/ring/successor_list")]
+fn get_successor_list(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<Vec<Node>>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    // Before the first stabilization round we only know our successor
+    if config.successor_list.is_empty() {
+        return Ok(Json(vec![config.successor.clone()]));
+    }
+
+    return Ok(Json(config.successor_list.clone()));
+}
+
+#[get("/ring/precessor_list")]
+fn get_precessor_list(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<Vec<Node>>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    // Before the first stabilization round we only know our precessor
+    if config.precessor_list.is_empty() {
+        return Ok(Json(vec![config.precessor.clone()]));
+    }
+
+    return Ok(Json(config.precessor_list.clone()));
+}
+
+#[get("/ring/local")]
+fn get_local(node_config: &State<Arc<RwLock<NodeConfig>>>) -> Result<Json<Node>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
     if config.is_crashed() {
         return Err(status::Custom(
             Status::ServiceUnavailable,
@@ -359,7 +1092,7 @@ fn put_precessor(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
     new_precessor: Json<Node>,
 ) -> Result<(), Custom<String>> {
-    let mut config = node_config.write().expect("RWLock is poisoned");
+    let mut config = node_config.write_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -368,6 +1101,7 @@ fn put_precessor(
         ));
     }
 
+    config.promote_precessor(&new_precessor.0);
     config.precessor = new_precessor.0;
 
     Ok(())
@@ -378,7 +1112,7 @@ fn put_successor(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
     new_successor: Json<Node>,
 ) -> Result<(), Custom<String>> {
-    let mut config = match node_config.write() {
+    let mut config = match node_config.write_timed() {
         Ok(config) => config,
         Err(_err) => {
             return Err(status::Custom(
@@ -395,16 +1129,29 @@ fn put_successor(
         ));
     }
 
-    println!("{:?}", new_successor);
+    log_debug!("New successor: {:?}", new_successor);
 
     if new_successor.hostname == config.local.hostname && new_successor.port == config.local.port {
         config.finger_table.clear();
+        config.successor_list.clear();
+        config.precessor_list.clear();
+        config.successor_range_summary = None;
         config.local.position = 0;
         config.local.range = RING_SIZE;
         config.successor = config.local.clone();
         config.precessor = config.local.clone();
     } else {
+        // The joining node we reserved part of our range for has committed
+        let reserved_for_successor = config
+            .split_reservation
+            .as_ref()
+            .is_some_and(|(reserved_for, _reserved_at)| is_same_node(reserved_for, &new_successor.0));
+        if reserved_for_successor {
+            config.split_reservation = None;
+        }
+
         config.successor = new_successor.0.clone();
+        config.promote_successor(&new_successor.0);
         if new_successor.0.position < config.local.position {
             config.local.range = (RING_SIZE - config.local.position) + new_successor.0.position;
         } else {
@@ -420,7 +1167,7 @@ fn put_local(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
     new_local: Json<Node>,
 ) -> Result<(), Custom<String>> {
-    let mut config = node_config.write().expect("RWLock is poisoned");
+    let mut config = node_config.write_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -429,16 +1176,67 @@ fn put_local(
         ));
     }
 
+    if new_local.position != config.local.position {
+        config.finger_table.clear();
+    }
     config.local = new_local.0;
 
     Ok(())
 }
 
+// Merges the sender's view of the ring into ours and answers with ours, see membership.rs
+#[post("/ring/gossip", format = "json", data = "<entries>")]
+fn post_ring_gossip(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+    entries: Json<Vec<MemberEntry>>,
+) -> Result<Json<Vec<MemberEntry>>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    // On our own we have left the ring or never joined one, and must not be pulled into its view
+    if is_same_node(&config.successor, &config.local) {
+        return Err(status::Custom(
+            Status::Conflict,
+            String::from("Node is not part of a ring"),
+        ));
+    }
+
+    let membership = membership::membership();
+    membership.merge(&config.local, entries.0);
+    return Ok(Json(membership.entries()));
+}
+
+// Every member of the ring known to this node, from the gossiped view. May lag behind joins,
+// leaves and failures by a few gossip rounds.
+#[get("/ring/snapshot")]
+fn get_ring_snapshot(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<RingSnapshot>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    let membership = membership::membership();
+    membership.refresh_local(&config.local, true);
+    return Ok(Json(membership.snapshot()));
+}
+
 #[get("/ring/finger_table")]
 fn get_finger_table(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
 ) -> Result<Json<Vec<Node>>, Custom<String>> {
-    let config = node_config.read().expect("RWLock is poisoned");
+    let config = node_config.read_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -447,16 +1245,16 @@ fn get_finger_table(
         ));
     }
 
-    return Ok(Json(config.finger_table.clone()));
+    return Ok(Json(config.finger_table.nodes()));
 }
 
-#[put("/ring/calculate_finger_table", data = "<finger_table_info>")]
-fn calculate_finger_table(
+// Answers one step of an iterative lookup: either we own the location, or the next node to ask
+#[get("/ring/lookup/<location>")]
+fn get_lookup(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
-    finger_table_info: Json<FingerTableInformation>,
-) -> Result<String, Custom<String>> {
-    let mut config = node_config.write().expect("RWLock is poisoned");
-    println!("Calculate finger table");
+    location: u16,
+) -> Result<Json<LookupResponse>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -465,60 +1263,203 @@ fn calculate_finger_table(
         ));
     }
 
-    config.finger_table.clear();
+    if is_location_in_range(location, config.local.position, config.local.range) {
+        return Ok(Json(LookupResponse {
+            node: config.local.clone(),
+            owner: true,
+        }));
+    }
+
+    return Ok(Json(LookupResponse {
+        node: config.next_hop(location).clone(),
+        owner: false,
+    }));
+}
 
-    // Add local node to finger table, and all other nodes in the network
-    let mut complete_node_list = vec![config.local.clone()];
-   
-    let mut current_node = config.successor.clone();
+// Find the node owning a location, asking nodes one at a time starting from first_hop
+fn lookup_owner(first_hop: &Node, location: u16) -> Result<Node, String> {
+    let budget = http_connect::peer_timeout() * MAX_LOOKUP_HOPS as u32;
+    return lookup_owner_within(first_hop, location, budget);
+}
 
-    while current_node.hostname != config.local.hostname || current_node.port != config.local.port {
-        complete_node_list.push(current_node.clone());
+// Same as lookup_owner, giving up once the lookup has taken longer than the budget
+fn lookup_owner_within(first_hop: &Node, location: u16, budget: Duration) -> Result<Node, String> {
+    let deadline = Instant::now() + budget;
+    let mut current_node = first_hop.clone();
+
+    for _hop in 0..MAX_LOOKUP_HOPS {
+        let remaining = deadline.saturating_duration_since(Instant::now());
+        if remaining.is_zero() {
+            return Err(format!(
+                "No owner found for {} within {} ms.",
+                location,
+                budget.as_millis()
+            ));
+        }
 
-        let get_successor_response = match http_connect::get_from_node(
+        let lookup_response = match http_connect::get_from_node_with_timeout(
             &current_node.hostname,
             current_node.port,
-            "ring/successor",
+            &format!("ring/lookup/{}", location),
+            remaining.min(http_connect::peer_timeout()),
         ) {
-            Err(_err) => {
-                let error_message = String::from("Could not connect to node to get successor.");
-                println!("{}", &error_message);
-                return Err(status::Custom(Status::FailedDependency, error_message));
-            }
+            Err(_err) => return Err(String::from("Could not connect to node during lookup.")),
             Ok(response) => response,
         };
 
-        current_node = match get_successor_response.json::<Node>() {
-            Err(_err) => {
-                let error_message =
-                    String::from("Unable to parse received network information from JSON.");
-                println!("{}", &error_message);
-                return Err(status::Custom(Status::FailedDependency, error_message));
-            }
+        let lookup = match lookup_response.json::<LookupResponse>() {
+            Err(_err) => return Err(String::from("Unable to parse lookup response from JSON.")),
             Ok(parsed) => parsed,
         };
+
+        if lookup.owner {
+            return Ok(lookup.node);
+        }
+        current_node = lookup.node;
+    }
+
+    return Err(format!("No owner found for {} within {} hops.", location, MAX_LOOKUP_HOPS));
+}
+
+// Where to redirect a client asking for a location we do not own. The lookup only moves small
+// messages between nodes, the owner if it succeeds and otherwise the closest node we know of.
+// The client is not kept waiting for a lookup that takes longer than one peer timeout, and the
+// lookup itself stops then, so slow lookups do not pile up on the blocking pool.
+async fn redirect_target(first_hop: Node, location: u16) -> Node {
+    let closest = first_hop.clone();
+    let budget = http_connect::peer_timeout();
+    let lookup = rocket::tokio::task::spawn_blocking(move || {
+        lookup_owner_within(&first_hop, location, budget)
+    });
+
+    match rocket::tokio::time::timeout(http_connect::peer_timeout(), lookup).await {
+        Ok(Ok(Ok(owner))) => return owner,
+        _ => return closest,
+    };
+}
+
+// Refresh a single finger by looking up its owner again, run periodically by the fix fingers thread
+fn fix_finger(node_config: &Arc<RwLock<NodeConfig>>, i: usize) {
+    let (local, first_hop, successor) = {
+        let config = node_config.read_timed().expect("RWLock is poisoned");
+
+        // A node alone in the ring, or one simulating a crash, has nothing to repair
+        if config.is_crashed()
+            || (config.successor.hostname == config.local.hostname
+                && config.successor.port == config.local.port)
+        {
+            return;
+        }
+
+        let start = finger_start(config.local.position, i);
+        (
+            config.local.clone(),
+            config.next_hop(start).clone(),
+            config.successor.clone(),
+        )
+    };
+
+    let start = finger_start(local.position, i);
+
+    let owner = if is_location_in_range(start, local.position, local.range) {
+        local.clone()
+    } else {
+        // The first hop may be the stale finger itself, so fall back to asking our successor
+        match lookup_owner(&first_hop, start).or_else(|_err| lookup_owner(&successor, start)) {
+            Ok(owner) => owner,
+            Err(error_message) => {
+                log_warn!("Could not refresh finger {}: {}", i, error_message);
+                let mut config = node_config.write_timed().expect("RWLock is poisoned");
+                config.finger_table.record_failed_refresh();
+                return;
+            }
+        }
+    };
+
+    let mut config = node_config.write_timed().expect("RWLock is poisoned");
+
+    // Our position changed while looking up, the result belongs to the old position
+    if config.local.position != local.position {
+        return;
     }
 
-    if complete_node_list.len() < usize::from(finger_table_info.size) {
-        let error_message = String::from("Not enough nodes in network to calculate finger table.");
-        println!("{}", &error_message);
+    config.finger_table.set(local.position, i, owner);
+}
+
+// Fills the finger table with the owners of position + 2^i, for the size largest values of i
+#[put("/ring/calculate_finger_table", data = "<finger_table_info>")]
+fn calculate_finger_table(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+    finger_table_info: Json<FingerTableInformation>,
+) -> Result<String, Custom<String>> {
+    log_debug!("Calculate finger table");
+
+    let size = usize::from(finger_table_info.size).min(FINGER_COUNT);
+    if size == 0 {
+        let error_message = String::from("Finger table size must be larger than zero.");
+        log_warn!("{}", &error_message);
         return Err(status::Custom(Status::BadRequest, error_message));
-    } else if complete_node_list.len() == usize::from(finger_table_info.size) {
-        println!("Creating fully connected finger table, with all nodes in network.");
     }
 
-    println!("Node list length: {}", complete_node_list.len());
+    // Work from a copy of our position and the first hop of every lookup, so that the lock is
+    // not held while other nodes are asked
+    let (local, first_hops) = {
+        let config = node_config.read_timed().expect("RWLock is poisoned");
+
+        if config.is_crashed() {
+            return Err(status::Custom(
+                Status::ServiceUnavailable,
+                String::from("Node is crashed"),
+            ));
+        }
+
+        let first_hops: Vec<Node> = (FINGER_COUNT - size..FINGER_COUNT)
+            .map(|i| config.next_hop(finger_start(config.local.position, i)).clone())
+            .collect();
+
+        (config.local.clone(), first_hops)
+    };
+
+    let mut fingers: Vec<(usize, Node)> = Vec::new();
+
+    for (i, first_hop) in (FINGER_COUNT - size..FINGER_COUNT).zip(first_hops.iter()) {
+        let start = finger_start(local.position, i);
+
+        // Consecutive fingers often share an owner, only look up starts outside the previous owner's range
+        let owner = match fingers.last() {
+            Some((_i, previous)) if is_location_in_range(start, previous.position, previous.range) => {
+                previous.clone()
+            }
+            _ if is_location_in_range(start, local.position, local.range) => local.clone(),
+            // The gossiped view usually knows the owner already, a lookup is only needed when it does not
+            _ => match membership::membership()
+                .owner_of(start)
+                .map_or_else(|| lookup_owner(first_hop, start), Ok)
+            {
+                Ok(owner) => owner,
+                Err(error_message) => {
+                    log_warn!("{}", &error_message);
+                    return Err(status::Custom(Status::FailedDependency, error_message));
+                }
+            },
+        };
+
+        fingers.push((i, owner));
+    }
+
+    let mut config = node_config.write_timed().expect("RWLock is poisoned");
 
-    let size = usize::from(finger_table_info.size);
-    if size == 0 || size > complete_node_list.len() {
-        panic!("Finger table size cannot be zero or greater than the number of nodes.");
+    if config.local.position != local.position {
+        return Err(status::Custom(
+            Status::Conflict,
+            String::from("Node moved while calculating finger table"),
+        ));
     }
 
-    let step = complete_node_list.len() / size;
-    for i in 0..size {
-        let index = (i * step) % complete_node_list.len();
-        println!("Adding node: {}", index);
-        config.finger_table.push(complete_node_list[index].clone());
+    config.finger_table.clear();
+    for (i, owner) in fingers {
+        let local_position = config.local.position;
+        config.finger_table.set(local_position, i, owner);
     }
 
     return Ok(String::from("Finger table calculated"));
@@ -529,7 +1470,7 @@ fn calculate_finger_table(
 fn get_network(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
 ) -> Result<Json<Vec<String>>, Custom<String>> {
-    let config = node_config.read().expect("RWLock is poisoned");
+    let config = node_config.read_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -557,7 +1498,7 @@ fn get_network(
 fn get_node_info(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
 ) -> Result<Json<NodeInfo>, Custom<String>> {
-    let config = node_config.read().expect("RWLock is poisoned");
+    let config = node_config.read_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -573,7 +1514,7 @@ fn get_node_info(
         config.precessor.hostname, config.precessor.port
     ));
 
-    for node in config.finger_table.clone() {
+    for node in config.finger_table.nodes() {
         other_nodes.push(format!("{}:{}", node.hostname, node.port));
     }
 
@@ -584,12 +1525,12 @@ fn get_node_info(
     }));
 }
 
-
-#[get("/network/longest_range")]
-fn get_network_longest_range(
+// Request, storage and lock metrics in the Prometheus text format
+#[get("/metrics")]
+fn get_metrics(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
-) -> Result<Json<LongestRangeResponse>, Custom<String>> {
-    let config = node_config.read().expect("RWLock is poisoned");
+) -> Result<String, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -598,49 +1539,22 @@ fn get_network_longest_range(
         ));
     }
 
-    let longest_range_request = LongestRangeRequest {
-        started_by: config.local.clone(),
-    };
-
-    let successor = config.successor.clone();
-
-    let upstream_response = match http_connect::write_json_to_node(
-        http_connect::WriteOperations::Post,
-        &successor.hostname,
-        successor.port,
-        "network/longest_range",
-        &longest_range_request,
-    ) {
-        Ok(response) => response,
-        Err(_err) => {
-            return Err(status::Custom(
-                Status::FailedDependency,
-                String::from("Longest range request failed"),
-            ))
-        }
-    };
-
-    let longest_range_upstream = match upstream_response.json::<LongestRangeResponse>() {
-        Err(_err) => {
-            let error_message =
-                String::from("Unable to parse received longest range information from JSON.");
-            println!("{}", &error_message);
-            return Err(status::Custom(Status::FailedDependency, error_message));
-        }
-        Ok(longest_range_upstream) => longest_range_upstream,
-    };
+    let shards = config.storage.shard_statistics();
+    let keys = shards.iter().map(|shard| shard.keys).sum();
+    let bytes = shards.iter().map(|shard| shard.bytes).sum();
 
-    return Ok(Json(longest_range_upstream));
+    let mut out = metrics::metrics().render(keys, bytes);
+    failure_detector::failure_detector().render(&mut out);
+    return Ok(out);
 }
 
-#[post("/network/longest_range", data = "<longest_range_request>")]
-fn post_network_longest_range(
+// Drops our cached copy of a key, sent by the node that served it once the key has been written
+#[delete("/cache/<key>")]
+fn delete_cached_value(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
-    longest_range_request: Json<LongestRangeRequest>,
-) -> Result<Json<LongestRangeResponse>, Custom<String>> {
-    let config = node_config.read().expect("RWLock is poisoned");
-
-    println!("Handling longest range");
+    key: &str,
+) -> Result<(), Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -649,63 +1563,32 @@ fn post_network_longest_range(
         ));
     }
 
-    if longest_range_request.0.started_by.hostname == config.local.hostname
-        && longest_range_request.0.started_by.port == config.local.port
-    {
-        let longest_range_response = LongestRangeResponse {
-            holder: config.local.clone(),
-        };
-        println!("Starting longest range return");
-        return Ok(Json(longest_range_response));
-    } else {
-        println!("Forwarding longest range return");
-        let successor = config.successor.clone();
+    read_cache::read_cache().invalidate(key);
 
-        let upstream_response = match http_connect::write_json_to_node(
-            http_connect::WriteOperations::Post,
-            &successor.hostname,
-            successor.port,
-            "network/longest_range",
-            longest_range_request.0,
-        ) {
-            Ok(response) => response,
-            Err(_err) => {
-                return Err(status::Custom(
-                    Status::FailedDependency,
-                    String::from("Longest range request failed"),
-                ))
-            }
-        };
+    Ok(())
+}
 
-        let longest_range_upstream = match upstream_response.json::<LongestRangeResponse>() {
-            Err(_err) => {
-                let error_message =
-                    String::from("Unable to parse received longest range information from JSON.");
-                println!("{}", &error_message);
-                return Err(status::Custom(Status::FailedDependency, error_message));
-            }
-            Ok(longest_range_upstream) => longest_range_upstream,
-        };
+#[get("/stats/read_cache")]
+fn get_read_cache_stats(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<ReadCacheStatistics>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
 
-        if longest_range_upstream.holder.range >= config.local.range {
-            return Ok(Json(longest_range_upstream));
-        } else {
-            let longest_range_response = LongestRangeResponse {
-                holder: config.local.clone(),
-            };
-            return Ok(Json(longest_range_response));
-        }
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
     }
+
+    return Ok(Json(read_cache::read_cache().statistics()));
 }
 
-#[get("/network/request_join_network_information")]
-fn get_network_request_join(
+#[get("/stats/connection_pool")]
+fn get_connection_pool_stats(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
-) -> Result<Json<JoinNetworkInformation>, Custom<String>> {
-    let config = node_config.read().expect("RWLock is poisoned");
-    println!("Local: {:?}", config.local);
-    println!("Precessor: {:?}", config.precessor);
-    println!("Successor: {:?}", config.successor);
+) -> Result<Json<PoolStatistics>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -714,56 +1597,323 @@ fn get_network_request_join(
         ));
     }
 
-    let longest_range: LongestRangeResponse = if config.local.hostname == config.successor.hostname
-        && config.local.port == config.successor.port
-    {
-        LongestRangeResponse {
-            holder: config.local.clone(),
-        }
-    } else {
-        println!(
-            "{}:{} requesting longest range from {}:{}",
-            config.local.hostname,
-            config.local.port,
-            config.successor.hostname,
-            config.successor.port
-        );
-        match get_network_longest_range(node_config) {
-            Ok(range) => range.0,
-            Err(err) => {
-                let error_message =
-                    format!("Could not get longest range in network. Error: {}", err.1);
-                println!("{}", &error_message);
-                return Err(status::Custom(Status::FailedDependency, error_message));
-            }
+    return Ok(Json(connection_pool::pool().statistics()));
+}
+
+#[get("/stats/storage")]
+fn get_storage_stats(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<Vec<ShardStatistics>>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    return Ok(Json(config.storage.shard_statistics()));
+}
+
+#[get("/stats/write_log")]
+fn get_write_log_stats(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<WriteLogStatistics>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    match config.storage.write_log_statistics() {
+        Some(statistics) => return Ok(Json(statistics)),
+        None => {
+            return Err(status::Custom(
+                Status::NotFound,
+                String::from("Storage is not durable, set A1_DATA_DIR to enable the write log"),
+            ))
         }
     };
+}
+
+#[get("/stats/fingers")]
+fn get_finger_stats(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<FingerStatistics>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    return Ok(Json(config.finger_table.statistics()));
+}
+
+#[get("/stats/failure_detector")]
+fn get_failure_detector_stats(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<FailureDetectorStatistics>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    return Ok(Json(failure_detector::failure_detector().statistics()));
+}
+
+#[get("/stats/transfers")]
+fn get_transfer_stats(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<Vec<TransferReport>>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    return Ok(Json(transfer::recent_reports()));
+}
+
+#[get("/network/range_summary")]
+fn get_network_range_summary(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<RangeSummary>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    return Ok(Json(config.range_summary()));
+}
+
+// Takes the place in a ring assigned by /network/form
+#[put("/ring/configuration", format = "json", data = "<configuration>")]
+fn put_ring_configuration(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+    configuration: Json<RingConfiguration>,
+) -> Result<(), Custom<String>> {
+    let mut config = node_config.write_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    let configuration = configuration.0;
+    config.local.position = configuration.local.position;
+    config.local.range = configuration.local.range;
+    config.successor = configuration.successor;
+    config.precessor = configuration.precessor;
+    config.successor_list = configuration.successor_list;
+    config.precessor_list.clear();
+    config.successor_range_summary = None;
+    config.split_reservation = None;
+
+    let position = config.local.position;
+    config.finger_table.clear();
+    for (i, finger) in configuration.fingers.into_iter().enumerate() {
+        if let Some(node) = finger {
+            config.finger_table.set(position, i, node);
+        }
+    }
+
+    Ok(())
+}
+
+// Forms a ring from a static member list in one round. Members get evenly spaced positions, and each
+// one is sent its neighbours and fingers in parallel. Meant for fresh deployments, stored keys are not moved.
+#[post("/network/form", format = "json", data = "<formation>")]
+async fn post_network_form(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+    formation: Json<RingFormation>,
+) -> Result<String, Custom<String>> {
+    {
+        let config = node_config.read_timed().expect("RWLock is poisoned");
+
+        if config.is_crashed() {
+            return Err(status::Custom(
+                Status::ServiceUnavailable,
+                String::from("Node is crashed"),
+            ));
+        }
+    }
+
+    let mut members: Vec<(String, u16)> = Vec::new();
+    for member in formation.0.members.iter() {
+        let parsed = match formation::parse_member(member) {
+            Some(parsed) => parsed,
+            None => {
+                return Err(status::Custom(
+                    Status::BadRequest,
+                    format!("Member {} is not of the form host:port", member),
+                ))
+            }
+        };
+        if members.contains(&parsed) {
+            return Err(status::Custom(
+                Status::BadRequest,
+                format!("Member {} is listed twice", member),
+            ));
+        }
+        members.push(parsed);
+    }
+
+    if members.is_empty() || members.len() > usize::from(RING_SIZE) {
+        return Err(status::Custom(
+            Status::BadRequest,
+            format!("A ring needs between 1 and {} members", RING_SIZE),
+        ));
+    }
+
+    let started_at = Instant::now();
+    let mut tasks = Vec::new();
+
+    for configuration in formation::plan_ring(&members) {
+        tasks.push(rocket::tokio::spawn(async move {
+            let local = configuration.local.clone();
+            let configured = match rocket::serde::json::to_string(&configuration) {
+                Ok(body) => http_connect::write_body_to_node_async(
+                    http_connect::WriteOperations::Put,
+                    &local.hostname,
+                    local.port,
+                    "ring/configuration",
+                    "application/json",
+                    &[],
+                    body.as_bytes(),
+                )
+                .await
+                .is_ok(),
+                Err(_err) => false,
+            };
+            (local, configured)
+        }));
+    }
+
+    let mut failed_members: Vec<String> = Vec::new();
+    for task in tasks {
+        match task.await {
+            Ok((_local, true)) => (),
+            Ok((local, false)) => failed_members.push(format!("{}:{}", local.hostname, local.port)),
+            Err(_err) => failed_members.push(String::from("unknown")),
+        };
+    }
+
+    if !failed_members.is_empty() {
+        let error_message = format!(
+            "Could not configure members: {}",
+            failed_members.join(", ")
+        );
+        log_warn!("{}", &error_message);
+        return Err(status::Custom(Status::FailedDependency, error_message));
+    }
+
+    return Ok(format!(
+        "Formed ring of {} nodes in {} ms",
+        members.len(),
+        started_at.elapsed().as_millis()
+    ));
+}
+
+// Answered from the range summary, so the cost of a join does not grow with the size of the ring
+#[get("/network/request_join_network_information")]
+fn get_network_request_join(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+) -> Result<Json<JoinNetworkInformation>, Custom<String>> {
+    let config = node_config.read_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
 
     let join_network_information = JoinNetworkInformation {
-        longest_range: longest_range,
+        longest_range: LongestRangeResponse {
+            holder: config.range_summary().holder,
+        },
     };
 
     return Ok(Json(join_network_information));
 }
 
-#[post("/join?<nprime>")]
-fn post_network_join(
+// Reserves the upper half of our range for a joining node. Only one join can split a node at a
+// time, so concurrent joins never get overlapping ranges, the others are told to retry.
+#[post("/network/reserve_split", data = "<joiner>")]
+fn post_reserve_split(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
-    nprime: &str,
-) -> Result<String, Custom<String>> {
-    let mut nprime_parts = nprime.split(":");
-    let join_hostname: String = String::from(nprime_parts.next().expect("Hostname not provided!"));
-    let join_port: u16 = nprime_parts
-        .next()
-        .expect("Port not provided!")
-        .parse()
-        .expect("Port must be a number!");
-    println!(
-        "Joining node with hostname: {}, port: {}",
-        join_hostname, join_port
-    );
+    joiner: Json<Node>,
+) -> Result<Json<SplitReservation>, Custom<String>> {
+    let mut config = node_config.write_timed().expect("RWLock is poisoned");
+
+    if config.is_crashed() {
+        return Err(status::Custom(
+            Status::ServiceUnavailable,
+            String::from("Node is crashed"),
+        ));
+    }
+
+    let reserved_by_other = config
+        .split_reservation
+        .as_ref()
+        .is_some_and(|(reserved_for, reserved_at)| {
+            !is_same_node(reserved_for, &joiner.0)
+                && reserved_at.elapsed() < SPLIT_RESERVATION_TIMEOUT
+        });
+    if reserved_by_other {
+        return Err(status::Custom(
+            Status::Conflict,
+            String::from("Range is already being split by another joining node"),
+        ));
+    }
+
+    if config.local.range < 2 {
+        return Err(status::Custom(
+            Status::FailedDependency,
+            String::from("Unable to join as network is already full."),
+        ));
+    }
+
+    let kept_range = config.local.range / 2;
+    let reservation = SplitReservation {
+        position: ((u32::from(config.local.position) + u32::from(kept_range))
+            % u32::from(RING_SIZE)) as u16,
+        range: config.local.range - kept_range,
+        precessor: config.local.clone(),
+        successor: config.successor.clone(),
+    };
+    config.split_reservation = Some((joiner.0, Instant::now()));
+
+    return Ok(Json(reservation));
+}
 
-    let mut config = node_config.write().expect("RWLock is poisoned");
+// Releases a reservation of a join that failed before committing
+#[post("/network/release_split", data = "<joiner>")]
+fn post_release_split(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+    joiner: Json<Node>,
+) -> Result<(), Custom<String>> {
+    let mut config = node_config.write_timed().expect("RWLock is poisoned");
 
     if config.is_crashed() {
         return Err(status::Custom(
@@ -772,134 +1922,401 @@ fn post_network_join(
         ));
     }
 
+    let reserved_for_joiner = config
+        .split_reservation
+        .as_ref()
+        .is_some_and(|(reserved_for, _reserved_at)| is_same_node(reserved_for, &joiner.0));
+    if reserved_for_joiner {
+        config.split_reservation = None;
+    }
+
+    Ok(())
+}
+
+// Ask a node to reserve part of its range for us. Ok(None) means another join holds its reservation.
+fn request_split(holder: &Node, joiner: &Node) -> Result<Option<SplitReservation>, String> {
+    match http_connect::write_json_to_node(
+        http_connect::WriteOperations::Post,
+        &holder.hostname,
+        holder.port,
+        "network/reserve_split",
+        joiner,
+    ) {
+        Ok(response) => match response.json::<SplitReservation>() {
+            Ok(reservation) => return Ok(Some(reservation)),
+            Err(_err) => return Err(String::from("Unable to parse split reservation from JSON.")),
+        },
+        Err(node_connection_error) => {
+            if node_connection_error
+                .http_response
+                .is_some_and(|http_response| http_response.status_code == 409)
+            {
+                return Ok(None);
+            }
+            return Err(format!(
+                "Could not reserve a range on {}:{}",
+                holder.hostname, holder.port
+            ));
+        }
+    };
+}
+
+fn release_split(holder: &Node, joiner: &Node) {
+    let _ = http_connect::write_json_to_node(
+        http_connect::WriteOperations::Post,
+        &holder.hostname,
+        holder.port,
+        "network/release_split",
+        joiner,
+    );
+}
+
+// Reserve a range on the node holding the longest range the node we join knows of. A holder that
+// left after the summary was built is alone in its own ring now, then we split the node we join instead.
+fn reserve_range(
+    joiner: &Node,
+    join_hostname: &str,
+    join_port: u16,
+) -> Result<Option<SplitReservation>, String> {
     let join_response = match http_connect::get_from_node(
-        &join_hostname,
+        join_hostname,
         join_port,
         "network/request_join_network_information",
     ) {
         Ok(response) => response,
-        Err(_err) => {
-            return Err(status::Custom(
-                Status::FailedDependency,
-                String::from("Unable to join node."),
-            ));
-        }
+        Err(_err) => return Err(String::from("Unable to join node.")),
     };
 
     let received_network_information = match join_response.json::<JoinNetworkInformation>() {
         Err(_err) => {
-            let error_message =
-                String::from("Unable to parse received network information from JSON.");
-            println!("{}", &error_message);
-            return Err(status::Custom(Status::FailedDependency, error_message));
+            return Err(String::from(
+                "Unable to parse received network information from JSON.",
+            ))
         }
         Ok(received_network_information) => received_network_information,
     };
 
-    println!("{:?}", received_network_information.longest_range.holder);
-    if received_network_information.longest_range.holder.range < 2 {
-        let error_message = String::from("Unable to join as network is already full.");
-        println!("{}", &error_message);
-        return Err(status::Custom(Status::FailedDependency, error_message));
+    let summary_holder = received_network_information.longest_range.holder;
+    let is_join_node = summary_holder.hostname == join_hostname && summary_holder.port == join_port;
+
+    if !is_join_node {
+        match request_split(&summary_holder, joiner) {
+            Ok(Some(reservation)) => {
+                if !is_same_node(&reservation.precessor, &reservation.successor) {
+                    return Ok(Some(reservation));
+                }
+                release_split(&summary_holder, joiner);
+            }
+            Ok(None) => return Ok(None),
+            Err(error_message) => log_warn!("{}", &error_message),
+        };
     }
 
-    let get_successor_response = match http_connect::get_from_node(
-        &received_network_information.longest_range.holder.hostname,
-        received_network_information.longest_range.holder.port,
-        "ring/successor",
-    ) {
-        Ok(response) => response,
-        Err(_err) => {
-            return Err(status::Custom(
-                Status::FailedDependency,
-                String::from("Could not get successor from holder of longest range."),
-            ));
-        }
+    let join_node = Node {
+        hostname: String::from(join_hostname),
+        port: join_port,
+        position: 0,
+        range: 0,
     };
+    return request_split(&join_node, joiner);
+}
 
-    let recieved_successor = match get_successor_response.json::<Node>() {
+// Joins the ring in three steps: reserve part of another node's range, copy its keys, and commit by
+// rewiring the neighbours. The reservation makes it safe for many nodes to join at the same time.
+#[post("/join?<nprime>")]
+async fn post_network_join(
+    node_config: &State<Arc<RwLock<NodeConfig>>>,
+    nprime: &str,
+) -> Result<String, Custom<String>> {
+    // A join backs off between attempts and moves whole ranges, keep it off the async workers
+    let node_config = node_config.inner().clone();
+    let nprime = String::from(nprime);
+
+    match rocket::tokio::task::spawn_blocking(move || join_network(&node_config, &nprime)).await {
+        Ok(result) => return result,
         Err(_err) => {
-            let error_message =
-                String::from("Unable to parse received network information from JSON.");
-            println!("{}", &error_message);
-            return Err(status::Custom(Status::FailedDependency, error_message));
+            return Err(status::Custom(
+                Status::InternalServerError,
+                String::from("Join failed"),
+            ))
         }
-        Ok(parsed) => parsed,
     };
+}
 
+fn join_network(
+    node_config: &Arc<RwLock<NodeConfig>>,
+    nprime: &str,
+) -> Result<String, Custom<String>> {
+    let mut nprime_parts = nprime.split(":");
+    let join_hostname: String = String::from(nprime_parts.next().expect("Hostname not provided!"));
+    let join_port: u16 = nprime_parts
+        .next()
+        .expect("Port not provided!")
+        .parse()
+        .expect("Port must be a number!");
+    log_info!(
+        "Joining node with hostname: {}, port: {}",
+        join_hostname, join_port
+    );
 
-    config.local.position = received_network_information.longest_range.holder.position
-        + received_network_information.longest_range.holder.range / 2;
+    let (joiner, storage) = {
+        let config = node_config.read_timed().expect("RWLock is poisoned");
 
-    if recieved_successor.position < config.local.position {
-        config.local.range = (RING_SIZE - config.local.position) + (recieved_successor.position);
-    } else {
-        config.local.range = recieved_successor.position - config.local.position;
+        if config.is_crashed() {
+            return Err(status::Custom(
+                Status::ServiceUnavailable,
+                String::from("Node is crashed"),
+            ));
+        }
+
+        (config.local.clone(), config.storage.clone())
+    };
+
+    // Another join may be splitting the same node, back off and ask again
+    let mut reservation: Option<SplitReservation> = None;
+    for attempt in 0..JOIN_ATTEMPTS {
+        match reserve_range(&joiner, &join_hostname, join_port) {
+            Ok(Some(reserved)) => {
+                reservation = Some(reserved);
+                break;
+            }
+            Ok(None) => {
+                // Spread out joiners that collided, using the port as a cheap source of jitter
+                let jitter = u64::from(joiner.port % 16) * 5;
+                thread::sleep(Duration::from_millis(
+                    JOIN_RETRY_DELAY_MS * (attempt + 1) + jitter,
+                ));
+            }
+            Err(error_message) => {
+                log_warn!("{}", &error_message);
+                return Err(status::Custom(Status::FailedDependency, error_message));
+            }
+        };
     }
-    println!(
+
+    let reservation = match reservation {
+        Some(reservation) => reservation,
+        None => {
+            let error_message = String::from("Could not reserve a range, the ring is busy.");
+            log_warn!("{}", &error_message);
+            return Err(status::Custom(Status::Conflict, error_message));
+        }
+    };
+    let holder = reservation.precessor.clone();
+
+    // Take on our new place before anyone can reach us through it
+    let local = {
+        let mut config = node_config.write_timed().expect("RWLock is poisoned");
+        config.local.position = reservation.position;
+        config.local.range = reservation.range;
+        config.successor = reservation.successor.clone();
+        config.precessor = holder.clone();
+        config.finger_table.clear();
+        config.successor_list.clear();
+        config.precessor_list.clear();
+        config.successor_range_summary = None;
+        config.local.clone()
+    };
+    log_debug!(
         "Successor position: {}, local position: {}",
-        recieved_successor.position, config.local.position
+        reservation.successor.position, local.position
     );
 
-    config.successor = recieved_successor.clone();
-    config.precessor = received_network_information.longest_range.holder.clone();
+    // Copy the keys we take over while the holder still serves them
+    let initial_transfer =
+        match transfer::pull_range(&storage, &holder, local.position, local.range) {
+            Ok(report) => report,
+            Err(error_message) => {
+                abort_join(node_config, &holder);
+                log_warn!("{}", &error_message);
+                return Err(status::Custom(Status::FailedDependency, error_message));
+            }
+        };
 
-    let precessor = config.precessor.clone();
     match http_connect::write_json_to_node(
         http_connect::WriteOperations::Put,
-        &precessor.hostname,
-        precessor.port,
+        &holder.hostname,
+        holder.port,
         "ring/successor",
-        &config.local,
+        &local,
     ) {
         Ok(response) => response,
         Err(_err) => {
+            // The holder may have applied it before the error, so undo it as well. Our copies may be
+            // older than its own, they are not pushed back.
+            rollback_join(node_config, &reservation, &local, false);
             return Err(status::Custom(
                 Status::FailedDependency,
                 String::from("Could not set successor of precessor"),
-            ))
+            ));
         }
     };
 
-    let successor = config.successor.clone();
     match http_connect::write_json_to_node(
         http_connect::WriteOperations::Put,
-        &successor.hostname,
-        successor.port,
+        &reservation.successor.hostname,
+        reservation.successor.port,
         "ring/precessor",
-        &config.local,
+        &local,
     ) {
         Ok(response) => response,
         Err(_err) => {
+            rollback_join(node_config, &reservation, &local, true);
             return Err(status::Custom(
                 Status::FailedDependency,
                 String::from("Could not set precessor of successor"),
-            ))
+            ));
         }
     };
 
+    // Catch up on writes the holder accepted during the first pass, then let it drop the range.
+    // Until this has worked the holder still has keys we lack, so it is retried before we give up.
+    let mut attempt = 0;
+    let final_transfer = loop {
+        match transfer::pull_range(&storage, &holder, local.position, local.range) {
+            Ok(report) => break report,
+            Err(error_message) if attempt + 1 < CATCH_UP_ATTEMPTS => {
+                log_warn!("{}, trying again", &error_message);
+                attempt += 1;
+                thread::sleep(Duration::from_millis(JOIN_RETRY_DELAY_MS * attempt));
+            }
+            Err(error_message) => {
+                log_warn!("{}", &error_message);
+                rollback_join(node_config, &reservation, &local, true);
+                return Err(status::Custom(Status::FailedDependency, error_message));
+            }
+        };
+    };
+
+    let _ = http_connect::write_body_to_node(
+        http_connect::WriteOperations::Delete,
+        &holder.hostname,
+        holder.port,
+        &format!(
+            "transfer/range?position={}&range={}",
+            local.position, local.range
+        ),
+        "text/plain",
+        "",
+    );
+
     return Ok(format!(
-        "Joined network!",
+        "Joined network! Transferred {} keys ({} bytes) in {} ms",
+        initial_transfer.keys + final_transfer.keys,
+        initial_transfer.bytes + final_transfer.bytes,
+        initial_transfer.duration_ms + final_transfer.duration_ms
     ));
 }
 
+// Undo a join that failed after the holder may have handed us its range. Once the holder is known
+// to forward our range to us, the writes that reached us since are pushed back to it before it takes
+// the range back. Best effort, the holder may be the reason we failed.
+fn rollback_join(
+    node_config: &Arc<RwLock<NodeConfig>>,
+    reservation: &SplitReservation,
+    local: &Node,
+    holder_rewired: bool,
+) {
+    let holder = &reservation.precessor;
+    let successor = &reservation.successor;
+
+    if holder_rewired {
+        let storage = node_config
+            .read_timed()
+            .expect("RWLock is poisoned")
+            .storage
+            .clone();
+        if let Err(error_message) =
+            transfer::push_range(&storage, holder, local.position, local.range)
+        {
+            log_error!("Could not return our range to the holder: {}", error_message);
+        }
+
+        if let Err(_err) = http_connect::write_json_to_node(
+            http_connect::WriteOperations::Put,
+            &successor.hostname,
+            successor.port,
+            "ring/precessor",
+            holder,
+        ) {
+            log_error!(
+                "Could not give {}:{} back its precessor",
+                successor.hostname, successor.port
+            );
+        }
+    }
+
+    if let Err(_err) = http_connect::write_json_to_node(
+        http_connect::WriteOperations::Put,
+        &holder.hostname,
+        holder.port,
+        "ring/successor",
+        successor,
+    ) {
+        log_error!(
+            "Could not give {}:{} back its successor",
+            holder.hostname, holder.port
+        );
+    }
+
+    abort_join(node_config, holder);
+}
+
+// Undo a join that failed before the holder gave up its range
+fn abort_join(node_config: &Arc<RwLock<NodeConfig>>, holder: &Node) {
+    let local = node_config.read_timed().expect("RWLock is poisoned").local.clone();
+    release_split(holder, &local);
+
+    let mut config = node_config.write_timed().expect("RWLock is poisoned");
+    if let Err(err) = config.storage.clear() {
+        log_error!("Could not drop the keys of the aborted join: {}", err);
+    }
+    config.precessor_list.clear();
+    config.local.position = 0;
+    config.local.range = RING_SIZE;
+    config.successor = config.local.clone();
+    config.precessor = config.local.clone();
+}
+
 #[post("/leave")]
-fn post_network_leave(
+async fn post_network_leave(
     node_config: &State<Arc<RwLock<NodeConfig>>>,
 ) -> Result<String, Custom<String>> {
-    let mut config = node_config.write().expect("RWLock is poisoned");
+    // A leave moves our whole range and rewires both neighbours, keep it off the async workers
+    let node_config = node_config.inner().clone();
 
-    if config.is_crashed() {
-        return Err(status::Custom(
-            Status::ServiceUnavailable,
-            String::from("Node is crashed"),
-        ));
-    }
+    match rocket::tokio::task::spawn_blocking(move || leave_network(&node_config)).await {
+        Ok(result) => return result,
+        Err(_err) => {
+            return Err(status::Custom(
+                Status::InternalServerError,
+                String::from("Leave failed"),
+            ))
+        }
+    };
+}
 
-    let successor = config.successor.clone();
-    let precessor = config.precessor.clone();
+fn leave_network(node_config: &Arc<RwLock<NodeConfig>>) -> Result<String, Custom<String>> {
+    // Only read the state here, the lock is not held while we talk to our neighbours
+    let (local, successor, precessor, storage) = {
+        let config = node_config.read_timed().expect("RWLock is poisoned");
+
+        if config.is_crashed() {
+            return Err(status::Custom(
+                Status::ServiceUnavailable,
+                String::from("Node is crashed"),
+            ));
+        }
 
-    if config.local.hostname != successor.hostname || config.local.port != successor.port {
+        (
+            config.local.clone(),
+            config.successor.clone(),
+            config.precessor.clone(),
+            config.storage.clone(),
+        )
+    };
+
+    if !is_same_node(&local, &successor) {
         // Update current state of our precessor by issuing get for its local
         let precessor: Node =
             match http_connect::get_from_node(&precessor.hostname, precessor.port, "ring/local") {
@@ -940,6 +2357,15 @@ fn post_network_leave(
                 },
             };
 
+        // Hand our keys to the precessor, which takes over our range once its successor is rewired
+        match transfer::push_range(&storage, &precessor, local.position, local.range) {
+            Ok(_report) => (),
+            Err(error_message) => {
+                log_warn!("{}", &error_message);
+                return Err(status::Custom(Status::FailedDependency, error_message));
+            }
+        };
+
         // Put our current precessor as precessor for our current successor
         match http_connect::write_json_to_node(
             http_connect::WriteOperations::Put,
@@ -963,7 +2389,7 @@ fn post_network_leave(
             &precessor.hostname,
             precessor.port,
             "ring/successor",
-            successor,
+            successor.clone(),
         ) {
             Ok(_s) => _s,
             Err(_err) => {
@@ -973,9 +2399,45 @@ fn post_network_leave(
                 ))
             }
         };
+
+        // Hand over the writes we accepted during the first pass, the precessor owns our range now
+        if let Err(error_message) =
+            transfer::push_range(&storage, &precessor, local.position, local.range)
+        {
+            log_warn!("Writes during leave may be lost: {}", &error_message);
+        }
     }
 
+    // Tell the neighbours we are gone so the ring stops gossiping with us, and keep a view of just ourselves
+    let membership = membership::membership();
+    membership.refresh_local(&local, false);
+    if !is_same_node(&successor, &local) {
+        let entries = membership.entries();
+        for neighbour in [&successor, &precessor] {
+            let _ = http_connect::write_json_to_node_with_timeout(
+                http_connect::WriteOperations::Post,
+                &neighbour.hostname,
+                neighbour.port,
+                "ring/gossip",
+                &entries,
+                membership.gossip_interval(),
+            );
+        }
+    }
+    membership.reset(&local);
+
+    // We no longer talk to our old neighbours, so don't keep connections to them open
+    connection_pool::pool().evict_peer(&successor.hostname, successor.port);
+    connection_pool::pool().evict_peer(&precessor.hostname, precessor.port);
+
+    let mut config = node_config.write_timed().expect("RWLock is poisoned");
+    if let Err(err) = config.storage.clear() {
+        log_error!("Could not drop the keys we handed over: {}", err);
+    }
     config.finger_table.clear();
+    config.successor_list.clear();
+    config.precessor_list.clear();
+    config.successor_range_summary = None;
     config.local.position = 0;
     config.local.range = RING_SIZE;
     config.successor = config.local.clone();
@@ -984,6 +2446,319 @@ fn post_network_leave(
     Ok(format!("Left network"))
 }
 
+fn is_same_node(a: &Node, b: &Node) -> bool {
+    return a.hostname == b.hostname && a.port == b.port;
+}
+
+fn replace_successor(local_node: &Node, new_successor: &Node) {
+    log_debug!("Writing new successor");
+    let _ = http_connect::write_json_to_node(
+        http_connect::WriteOperations::Put,
+        &local_node.hostname,
+        local_node.port,
+        "ring/successor",
+        new_successor,
+    );
+
+    // The new successor still points back at the dead node, we are its precessor now
+    let _ = http_connect::write_json_to_node(
+        http_connect::WriteOperations::Put,
+        &new_successor.hostname,
+        new_successor.port,
+        "ring/precessor",
+        local_node,
+    );
+}
+
+// Exchange membership views with a few other nodes, see membership.rs
+fn gossip(node_config: &Arc<RwLock<NodeConfig>>) {
+    let (local, seeds) = {
+        let config = node_config.read_timed().expect("RWLock is poisoned");
+
+        if config.is_crashed() {
+            return;
+        }
+
+        let mut seeds = vec![config.successor.clone(), config.precessor.clone()];
+        seeds.extend(config.successor_list.iter().cloned());
+        seeds.extend(config.finger_table.nodes());
+        (config.local.clone(), seeds)
+    };
+
+    let membership = membership::membership();
+    membership.refresh_local(&local, true);
+    let entries = membership.entries();
+
+    for (hostname, port) in membership.gossip_targets(&local, seeds) {
+        match http_connect::write_json_to_node_with_timeout(
+            http_connect::WriteOperations::Post,
+            &hostname,
+            port,
+            "ring/gossip",
+            &entries,
+            membership.gossip_interval(),
+        ) {
+            Ok(response) => match response.json::<Vec<MemberEntry>>() {
+                Ok(their_entries) => membership.merge(&local, their_entries),
+                Err(_err) => log_debug!("Could not parse gossip from {}:{}", hostname, port),
+            },
+            Err(node_connection_error) => {
+                // The node has left the ring, it will not come back under this entry
+                if node_connection_error
+                    .http_response
+                    .is_some_and(|http_response| http_response.status_code == 409)
+                {
+                    membership.forget(&hostname, port);
+                }
+            }
+        };
+    }
+}
+
+// Send a heartbeat to one neighbour. Stabilizes right away once the successor is suspected,
+// rather than waiting for the next round.
+fn heartbeat(node_config: &Arc<RwLock<NodeConfig>>, neighbour: Neighbour) {
+    let node = {
+        let config = node_config.read_timed().expect("RWLock is poisoned");
+
+        let node = match neighbour {
+            Neighbour::Successor => &config.successor,
+            Neighbour::Predecessor => &config.precessor,
+        };
+        if config.is_crashed() || is_same_node(node, &config.local) {
+            return;
+        }
+        node.clone()
+    };
+
+    let detector = failure_detector::failure_detector();
+    let peer = connection_pool::peer_key(&node.hostname, node.port);
+    detector.watch(neighbour, &peer);
+
+    let started_at = Instant::now();
+    match http_connect::get_from_node_with_timeout(
+        &node.hostname,
+        node.port,
+        "helloworld",
+        detector.heartbeat_timeout(),
+    ) {
+        Ok(_response) => detector.heartbeat(neighbour, &peer, started_at.elapsed()),
+        Err(_err) => detector.missed(neighbour, &peer),
+    };
+
+    // A failed predecessor is replaced when the node before it takes us as its successor
+    if detector.is_suspected(neighbour, &peer) && neighbour == Neighbour::Successor {
+        stabilize(node_config);
+    }
+}
+
+// Where the last stabilization round saw our replicas, and the range we kept copies for
+struct ReplicaPlacement {
+    replica_nodes: Vec<Node>,
+    replica_range: Option<(u16, u16)>,
+}
+
+// Check our successor and refresh the successor list from it. If the failure detector suspects the
+// successor, fail over to the first live entry of the successor list right away.
+fn stabilize(node_config: &Arc<RwLock<NodeConfig>>) {
+    // Runs both on a timer and from the heartbeat, one failover at a time
+    static STABILIZING: Mutex<ReplicaPlacement> = Mutex::new(ReplicaPlacement {
+        replica_nodes: Vec::new(),
+        replica_range: None,
+    });
+    let mut placement = STABILIZING.lock().expect("Mutex poisoned");
+    let detector = failure_detector::failure_detector();
+
+    let (local_node, precessor, storage, candidates) = {
+        let config = node_config.read_timed().expect("RWLock is poisoned");
+
+        if config.is_crashed() || is_same_node(&config.successor, &config.local) {
+            return;
+        }
+
+        let mut candidates = vec![config.successor.clone()];
+        for node in config.successor_list.iter() {
+            if !candidates.iter().any(|candidate| is_same_node(candidate, node)) {
+                candidates.push(node.clone());
+            }
+        }
+
+        (
+            config.local.clone(),
+            config.precessor.clone(),
+            config.storage.clone(),
+            candidates,
+        )
+    };
+
+    // Our precessor followed by its own list, it tells us whose replicas we hold
+    let precessor_list = if is_same_node(&precessor, &local_node) {
+        None
+    } else {
+        http_connect::get_from_node_with_timeout(
+            &precessor.hostname,
+            precessor.port,
+            "ring/precessor_list",
+            detector.heartbeat_timeout(),
+        )
+        .ok()
+        .and_then(|response| response.json::<Vec<Node>>().ok())
+        .map(|list| {
+            let mut precessor_list = vec![precessor.clone()];
+            for node in list.into_iter() {
+                // Stop once the list has gone around the ring back to us
+                if precessor_list.len() == SUCCESSOR_LIST_LENGTH
+                    || is_same_node(&precessor_list[precessor_list.len() - 1], &local_node)
+                {
+                    break;
+                }
+                precessor_list.push(node);
+            }
+            precessor_list
+        })
+    };
+
+    for (i, candidate) in candidates.iter().enumerate() {
+        let successor_list = match http_connect::get_from_node_with_timeout(
+            &candidate.hostname,
+            candidate.port,
+            "ring/successor_list",
+            detector.heartbeat_timeout(),
+        ) {
+            Ok(response) => match response.json::<Vec<Node>>() {
+                Ok(successor_list) => successor_list,
+                Err(_err) => continue,
+            },
+            Err(_err) => {
+                // One slow or lost reply does not make the successor dead, wait for the detector to suspect it
+                let peer = connection_pool::peer_key(&candidate.hostname, candidate.port);
+                if i == 0 && !detector.is_suspected(Neighbour::Successor, &peer) {
+                    log_debug!("Successor {} did not answer, keeping it until it is suspected", peer);
+                    return;
+                }
+                log_warn!(
+                    "Successor {}:{} is dead, trying next in successor list!",
+                    candidate.hostname, candidate.port
+                );
+                connection_pool::pool().evict_peer(&candidate.hostname, candidate.port);
+                continue;
+            }
+        };
+
+        if i > 0 {
+            replace_successor(&local_node, candidate);
+
+            // We took over the range of the dead successors, the new successor holds their replicas
+            let dead_position = candidates[0].position;
+            let dead_range = clockwise_distance(dead_position, candidate.position) as u16;
+            if let Err(error_message) =
+                transfer::pull_range(&storage, candidate, dead_position, dead_range)
+            {
+                log_warn!("Could not take over replicas: {}", error_message);
+            }
+        }
+
+        // Our list is the live successor followed by its own list, without ourselves
+        let mut new_successor_list = vec![candidate.clone()];
+        new_successor_list.extend(
+            successor_list
+                .into_iter()
+                .filter(|node| !is_same_node(node, &local_node))
+                .take(SUCCESSOR_LIST_LENGTH - 1),
+        );
+
+        // Extend the successor's range summary by one hop, dropping it once it is outside the window
+        let successor_range_summary = http_connect::get_from_node_with_timeout(
+            &candidate.hostname,
+            candidate.port,
+            "network/range_summary",
+            detector.heartbeat_timeout(),
+        )
+        .ok()
+        .and_then(|response| response.json::<RangeSummary>().ok())
+        .map(|summary| RangeSummary {
+            holder: summary.holder,
+            hops: summary.hops + 1,
+        })
+        .filter(|summary| summary.hops <= RANGE_SUMMARY_HOPS);
+
+        let (local, replica_nodes, replica_range) = {
+            let mut config = node_config.write_timed().expect("RWLock is poisoned");
+            config.successor_list = new_successor_list;
+            config.successor_range_summary = successor_range_summary;
+            if let Some(precessor_list) = precessor_list {
+                config.precessor_list = precessor_list;
+            }
+            (
+                config.local.clone(),
+                config.replica_nodes(),
+                config.replica_range(),
+            )
+        };
+        place_replicas(&storage, &local, replica_nodes, replica_range, &mut placement);
+        return;
+    }
+
+    log_error!("No live successor found in successor list!");
+}
+
+// Keep the copies of the ring in line with its membership. A node that has just become one of our
+// replicas gets a copy of our range, and the copies of a predecessor that no longer replicates to us
+// are dropped. Both follow the replica set the last round saw, so changes made by joins, leaves and
+// failover are caught alike.
+fn place_replicas(
+    storage: &Arc<Storage>,
+    local: &Node,
+    replica_nodes: Vec<Node>,
+    replica_range: Option<(u16, u16)>,
+    placement: &mut ReplicaPlacement,
+) {
+    for replica_node in replica_nodes.iter() {
+        if placement
+            .replica_nodes
+            .iter()
+            .any(|node| is_same_node(node, replica_node))
+        {
+            continue;
+        }
+
+        // Pushed in the background, so a large range does not hold up failure detection
+        let storage = storage.clone();
+        let replica_node = replica_node.clone();
+        let (position, range) = (local.position, local.range);
+        thread::spawn(move || {
+            if let Err(error_message) =
+                transfer::push_range(&storage, &replica_node, position, range)
+            {
+                log_warn!("Could not copy our range to a new replica: {}", error_message);
+            }
+        });
+    }
+    placement.replica_nodes = replica_nodes;
+
+    let replica_range = match replica_range {
+        Some(replica_range) => replica_range,
+        None => return,
+    };
+
+    // The range ends where our own range starts. If it now starts later, the keys between the old and
+    // the new start belong to a predecessor that replicates to another node.
+    if let Some((position, range)) = placement.replica_range {
+        let same_end = clockwise_distance(position, local.position) == u32::from(range);
+        if same_end
+            && replica_range.0 != position
+            && is_location_in_range(replica_range.0, position, range)
+        {
+            match storage.remove_range(position, clockwise_distance(position, replica_range.0) as u16)
+            {
+                Ok(removed) => log_info!("Dropped {} keys we are no longer a replica of", removed),
+                Err(err) => log_error!("Could not drop keys we are no longer a replica of: {}", err),
+            };
+        }
+    }
+    placement.replica_range = Some(replica_range);
+}
+
 #[launch]
 fn rocket() -> _ {
     let local_node = Node {
@@ -995,116 +2770,169 @@ fn rocket() -> _ {
         position: 0,
         range: RING_SIZE,
     };
+    // Keep the storage in memory unless we are given a directory to persist it in
+    let storage = match env::var("A1_DATA_DIR") {
+        Err(_err) => Storage::new(),
+        Ok(dir) => {
+            let fsync_mode = env::var("A1_FSYNC")
+                .ok()
+                .and_then(|mode| FsyncMode::parse(&mode))
+                .unwrap_or(DEFAULT_FSYNC_MODE);
+            let compact_bytes = env::var("A1_COMPACT_BYTES")
+                .ok()
+                .and_then(|bytes| bytes.parse().ok())
+                .unwrap_or(DEFAULT_COMPACT_BYTES);
+            Storage::open(std::path::Path::new(&dir), fsync_mode, compact_bytes)
+                .expect("Unable to open data directory!")
+        }
+    };
+    let storage = Arc::new(storage);
+
+    let max_value_bytes: u64 = env::var("A1_MAX_VALUE_BYTES")
+        .ok()
+        .and_then(|bytes| bytes.parse().ok())
+        .unwrap_or(DEFAULT_MAX_VALUE_BYTES);
+
     let node_config = Arc::new(RwLock::new(NodeConfig {
         local: local_node.clone(),
         successor: local_node.clone(),
         precessor: local_node.clone(),
-        finger_table: vec![],
-        storage: Storage::new(),
+        successor_list: vec![],
+        precessor_list: vec![],
+        successor_range_summary: None,
+        split_reservation: None,
+        finger_table: FingerTable::new(),
+        storage: storage.clone(),
+        replication_factor: env::var("A1_REPLICATION_FACTOR")
+            .ok()
+            .and_then(|factor| factor.parse().ok())
+            .unwrap_or(DEFAULT_REPLICATION_FACTOR)
+            .clamp(1, SUCCESSOR_LIST_LENGTH + 1),
+        max_value_bytes: max_value_bytes,
         crashed: false,
     }));
 
-    node_config
-        .write()
-        .unwrap()
-        .storage
-        .store("key", "stored_value");
-
-    println!(
-        "Retrieved: {}",
-        node_config
-            .read()
-            .unwrap()
-            .storage
-            .retrieve("key")
-            .expect("No value retrieved!")
-    );
-
-    let mut last_received_successor: Option<Node> = None;
     let thread_node_config = node_config.clone();
 
-    fn replace_successor(local_node: Node, new_successor: Node) {
-        println!("Writing new successor");
-        let _ = http_connect::write_json_to_node(
-            http_connect::WriteOperations::Put,
-            &local_node.hostname,
-            local_node.port,
-            "ring/successor",
-            new_successor,
-        );
-    }
+    let stabilize_interval = Duration::from_millis(
+        env::var("A1_STABILIZE_INTERVAL_MS")
+            .ok()
+            .and_then(|interval| interval.parse().ok())
+            .unwrap_or(DEFAULT_STABILIZE_INTERVAL_MS),
+    );
 
     thread::spawn(move || loop {
-        thread::sleep(Duration::from_secs(5));
+        thread::sleep(stabilize_interval);
+        stabilize(&thread_node_config);
+    });
 
-        let config = thread_node_config.read().unwrap();
-        let local_node = config.local.clone();
-        let successor_node = config.successor.clone();
-        drop(config);
+    let gossip_node_config = node_config.clone();
+    thread::spawn(move || loop {
+        thread::sleep(membership::membership().gossip_interval());
+        gossip(&gossip_node_config);
+    });
 
-        let successor_result = http_connect::get_from_node(
-            &successor_node.hostname,
-            successor_node.port,
-            "ring/successor",
-        );
+    // Each neighbour gets its own heartbeat, so a slow one does not delay the other
+    for neighbour in [Neighbour::Successor, Neighbour::Predecessor] {
+        let heartbeat_node_config = node_config.clone();
+        thread::spawn(move || loop {
+            thread::sleep(failure_detector::failure_detector().heartbeat_interval());
+            heartbeat(&heartbeat_node_config, neighbour);
+        });
+    }
 
-        let successor_response = match successor_result {
-            Ok(response) => Some(response),
-            Err(_err) => {
-                println!("Successor is dead, replacing!");
-                match last_received_successor.clone() {
-                    Some(successor) => replace_successor(local_node, successor),
-                    None => (),
-                };
-                continue;
-            }
-        };
+    let fsync_interval = Duration::from_millis(
+        env::var("A1_FSYNC_INTERVAL_MS")
+            .ok()
+            .and_then(|interval| interval.parse().ok())
+            .unwrap_or(DEFAULT_FSYNC_INTERVAL_MS),
+    );
 
-        last_received_successor = match successor_response
-            .expect("Failed to get successor")
-            .json::<Node>()
-        {
-            Ok(successor) => Some(successor),
-            Err(_err) => None,
-        };
+    // Flush, sync and compact the write log in the background
+    thread::spawn(move || loop {
+        thread::sleep(fsync_interval);
+        storage.maintain();
+    });
 
-        println!(
-            "Our successor is {}:{}, it's successor {}:{}",
-            successor_node.hostname,
-            successor_node.port,
-            last_received_successor
-                .as_ref()
-                .expect("unparseable")
-                .hostname
-                .clone(),
-            last_received_successor.clone().expect("unparseable").port
-        );
+    let fix_fingers_interval = Duration::from_millis(
+        env::var("A1_FIX_FINGERS_INTERVAL_MS")
+            .ok()
+            .and_then(|interval| interval.parse().ok())
+            .unwrap_or(DEFAULT_FIX_FINGERS_INTERVAL_MS),
+    );
+    let fix_fingers_per_round: usize = env::var("A1_FIX_FINGERS_PER_ROUND")
+        .ok()
+        .and_then(|count| count.parse().ok())
+        .unwrap_or(DEFAULT_FIX_FINGERS_PER_ROUND);
+    let fix_fingers_node_config = node_config.clone();
+
+    // Incrementally repair the finger table, a few fingers per round, so it recovers after churn
+    thread::spawn(move || {
+        let mut next_finger: usize = 0;
+        loop {
+            thread::sleep(fix_fingers_interval);
+
+            for _round in 0..fix_fingers_per_round {
+                fix_finger(&fix_fingers_node_config, next_finger);
+                next_finger = (next_finger + 1) % FINGER_COUNT;
+            }
+        }
     });
 
-    rocket::build().manage(node_config).mount(
-        "/",
-        routes![
-            helloworld,
-            shutdown,
-            post_sim_crash,
-            post_sim_recover,
-            get_storage,
-            put_storage,
-            get_network,
-            get_node_info,
-            get_precessor,
-            get_successor,
-            get_local,
-            put_precessor,
-            put_successor,
-            put_local,
-            get_finger_table,
-            calculate_finger_table,
-            get_network_request_join,
-            get_network_longest_range,
-            post_network_longest_range,
-            post_network_join,
-            post_network_leave
-        ],
-    )
+    // A transfer chunk can carry a single value of up to the limit, hex encoded if it is binary
+    let limits = Limits::default().limit("json", (2 * max_value_bytes + 1024 * 1024).bytes());
+    let figment = rocket::Config::figment().merge(("limits", limits));
+
+    rocket::custom(figment)
+        .manage(node_config)
+        .attach(RequestMetrics)
+        .mount(
+            "/",
+            routes![
+                helloworld,
+                shutdown,
+                post_sim_crash,
+                post_sim_recover,
+                get_storage,
+                put_storage,
+                post_storage_batch,
+                get_replica,
+                put_replica,
+                delete_cached_value,
+                get_network,
+                get_node_info,
+                get_metrics,
+                get_connection_pool_stats,
+                get_read_cache_stats,
+                get_storage_stats,
+                get_write_log_stats,
+                get_finger_stats,
+                get_failure_detector_stats,
+                get_transfer_stats,
+                get_transfer_range,
+                put_transfer_entries,
+                delete_transfer_range,
+                get_precessor,
+                get_successor,
+                get_successor_list,
+                get_precessor_list,
+                get_local,
+                get_ring_snapshot,
+                post_ring_gossip,
+                put_precessor,
+                put_successor,
+                put_local,
+                get_finger_table,
+                calculate_finger_table,
+                get_lookup,
+                get_network_request_join,
+                get_network_range_summary,
+                post_network_form,
+                put_ring_configuration,
+                post_reserve_split,
+                post_release_split,
+                post_network_join,
+                post_network_leave
+            ],
+        )
 }
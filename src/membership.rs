@@ -0,0 +1,281 @@
+use rocket::serde::{Deserialize, Serialize};
+use std::collections::HashMap;
+use std::env;
+use std::sync::atomic::{AtomicUsize, Ordering};
+use std::sync::{Mutex, OnceLock};
+use std::time::{Duration, Instant, SystemTime, UNIX_EPOCH};
+
+use crate::connection_pool::peer_key;
+use crate::{is_location_in_range, Node, RING_SIZE};
+
+const DEFAULT_GOSSIP_INTERVAL_MS: u64 = 1000; // Time between gossip rounds, override with A1_GOSSIP_INTERVAL_MS
+const DEFAULT_MEMBER_TIMEOUT_MS: u64 = 5000; // A member whose version has not advanced for this long is not alive, override with A1_MEMBER_TIMEOUT_MS
+
+// Members every gossip round exchanges views with, besides the successor
+const GOSSIP_FANOUT: usize = 2;
+
+// Members that stop advancing are dropped after this many timeouts, so that nodes that left the ring
+// or were shut down eventually disappear from every view
+const FORGET_AFTER_TIMEOUTS: u32 = 6;
+
+// One member as it describes itself. Only the member raises its version, so the entry with the
+// higher version is always the newer one.
+#[derive(Serialize, Deserialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct MemberEntry {
+    pub hostname: String,
+    pub port: u16,
+    pub position: u16,
+    pub range: u16,
+    // Milliseconds since the epoch when the member last described itself, so it keeps growing across restarts
+    pub version: u64,
+    // False once the member has announced that it left the ring
+    pub active: bool,
+}
+
+struct KnownMember {
+    entry: MemberEntry,
+    // When we last saw a newer version, a member that keeps gossiping keeps advancing
+    advanced_at: Instant,
+}
+
+#[derive(Serialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct MemberView {
+    pub hostname: String,
+    pub port: u16,
+    pub position: u16,
+    pub range: u16,
+    pub version: u64,
+    pub alive: bool,
+    // Time since the member's version last advanced, as seen by the node answering
+    pub age_ms: u64,
+}
+
+#[derive(Serialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct RingSnapshot {
+    // Sorted by position
+    pub members: Vec<MemberView>,
+    pub alive: usize,
+    // The ranges of the alive members cover the whole ring
+    pub complete: bool,
+}
+
+// Eventually consistent view of the ring, kept up to date by exchanging it with a few other nodes
+// every round. Whole-ring questions are answered from it with one request instead of N.
+pub struct Membership {
+    gossip_interval: Duration,
+    member_timeout: Duration,
+    members: Mutex<HashMap<String, KnownMember>>,
+    rounds: AtomicUsize,
+    last_version: Mutex<u64>,
+}
+
+pub fn membership() -> &'static Membership {
+    static MEMBERSHIP: OnceLock<Membership> = OnceLock::new();
+    return MEMBERSHIP.get_or_init(|| {
+        let gossip_interval_ms = env::var("A1_GOSSIP_INTERVAL_MS")
+            .ok()
+            .and_then(|interval| interval.parse().ok())
+            .unwrap_or(DEFAULT_GOSSIP_INTERVAL_MS);
+        let member_timeout_ms = env::var("A1_MEMBER_TIMEOUT_MS")
+            .ok()
+            .and_then(|timeout| timeout.parse().ok())
+            .unwrap_or(DEFAULT_MEMBER_TIMEOUT_MS);
+        Membership::new(
+            Duration::from_millis(gossip_interval_ms),
+            Duration::from_millis(member_timeout_ms),
+        )
+    });
+}
+
+impl Membership {
+    pub fn new(gossip_interval: Duration, member_timeout: Duration) -> Self {
+        Membership {
+            gossip_interval: gossip_interval,
+            member_timeout: member_timeout,
+            members: Mutex::new(HashMap::new()),
+            rounds: AtomicUsize::new(0),
+            last_version: Mutex::new(0),
+        }
+    }
+
+    pub fn gossip_interval(&self) -> Duration {
+        return self.gossip_interval;
+    }
+
+    // Strictly increasing, even if the clock steps back or two calls fall in the same millisecond
+    fn next_version(&self) -> u64 {
+        let now = SystemTime::now()
+            .duration_since(UNIX_EPOCH)
+            .map(|elapsed| elapsed.as_millis() as u64)
+            .unwrap_or(0);
+        let mut last_version = self.last_version.lock().expect("Mutex poisoned");
+        *last_version = now.max(*last_version + 1);
+        return *last_version;
+    }
+
+    // Describe ourselves with a new version, done every round so that others see us advance
+    pub fn refresh_local(&self, local: &Node, active: bool) {
+        let entry = MemberEntry {
+            hostname: local.hostname.clone(),
+            port: local.port,
+            position: local.position,
+            range: local.range,
+            version: self.next_version(),
+            active: active,
+        };
+        self.members.lock().expect("Mutex poisoned").insert(
+            peer_key(&local.hostname, local.port),
+            KnownMember {
+                entry: entry,
+                advanced_at: Instant::now(),
+            },
+        );
+    }
+
+    // Keep whichever version of every entry is newer. Our own entry is only ever written by us.
+    pub fn merge(&self, local: &Node, entries: Vec<MemberEntry>) {
+        let local_key = peer_key(&local.hostname, local.port);
+        let mut members = self.members.lock().expect("Mutex poisoned");
+
+        for entry in entries {
+            let key = peer_key(&entry.hostname, entry.port);
+            if key == local_key {
+                continue;
+            }
+            let newer = members
+                .get(&key)
+                .map_or(true, |known| known.entry.version < entry.version);
+            if newer {
+                members.insert(
+                    key,
+                    KnownMember {
+                        entry: entry,
+                        advanced_at: Instant::now(),
+                    },
+                );
+            }
+        }
+    }
+
+    // Drop a member that told us it is not part of our ring
+    pub fn forget(&self, hostname: &str, port: u16) {
+        self.members
+            .lock()
+            .expect("Mutex poisoned")
+            .remove(&peer_key(hostname, port));
+    }
+
+    // Forget everyone else, after leaving the ring
+    pub fn reset(&self, local: &Node) {
+        let local_key = peer_key(&local.hostname, local.port);
+        self.members
+            .lock()
+            .expect("Mutex poisoned")
+            .retain(|key, _known| *key == local_key);
+    }
+
+    fn is_alive(&self, known: &KnownMember) -> bool {
+        return known.entry.active && known.advanced_at.elapsed() < self.member_timeout;
+    }
+
+    // The view to send, without the members that have been quiet for long enough to be forgotten
+    pub fn entries(&self) -> Vec<MemberEntry> {
+        let forget_after = self.member_timeout * FORGET_AFTER_TIMEOUTS;
+        let mut members = self.members.lock().expect("Mutex poisoned");
+        members.retain(|_key, known| known.advanced_at.elapsed() < forget_after);
+        return members.values().map(|known| known.entry.clone()).collect();
+    }
+
+    // The members to gossip with this round: our successor, so that the views of all members are
+    // connected along the ring, and a few alive members taken in turn so that every member is reached.
+    // Every node starts at its own position in the list, so they do not all pick the same targets.
+    // The other neighbours we know are used until the view has enough members of its own.
+    pub fn gossip_targets(&self, local: &Node, seeds: Vec<Node>) -> Vec<(String, u16)> {
+        let local_key = peer_key(&local.hostname, local.port);
+        let mut candidates: Vec<(String, u16)> = {
+            let members = self.members.lock().expect("Mutex poisoned");
+            members
+                .iter()
+                .filter(|(key, known)| **key != local_key && self.is_alive(known))
+                .map(|(_key, known)| (known.entry.hostname.clone(), known.entry.port))
+                .collect()
+        };
+        candidates.sort();
+
+        let mut seeds = seeds
+            .into_iter()
+            .map(|seed| (seed.hostname, seed.port))
+            .filter(|seed| peer_key(&seed.0, seed.1) != local_key);
+
+        let mut targets: Vec<(String, u16)> = seeds.next().into_iter().collect();
+        if !candidates.is_empty() {
+            let round = self.rounds.fetch_add(1, Ordering::Relaxed);
+            let start = round * GOSSIP_FANOUT + usize::from(local.position);
+            for i in 0..GOSSIP_FANOUT.min(candidates.len()) {
+                let target = &candidates[(start + i) % candidates.len()];
+                if !targets.contains(target) {
+                    targets.push(target.clone());
+                }
+            }
+        }
+
+        for seed in seeds {
+            if targets.len() > GOSSIP_FANOUT {
+                break;
+            }
+            if !targets.contains(&seed) {
+                targets.push(seed);
+            }
+        }
+
+        return targets;
+    }
+
+    // An alive member whose range holds the location, if the view knows one
+    pub fn owner_of(&self, location: u16) -> Option<Node> {
+        let members = self.members.lock().expect("Mutex poisoned");
+        return members
+            .values()
+            .filter(|known| self.is_alive(known))
+            .find(|known| is_location_in_range(location, known.entry.position, known.entry.range))
+            .map(|known| Node {
+                hostname: known.entry.hostname.clone(),
+                port: known.entry.port,
+                position: known.entry.position,
+                range: known.entry.range,
+            });
+    }
+
+    pub fn snapshot(&self) -> RingSnapshot {
+        let members = self.members.lock().expect("Mutex poisoned");
+        let mut views: Vec<MemberView> = members
+            .values()
+            .map(|known| MemberView {
+                hostname: known.entry.hostname.clone(),
+                port: known.entry.port,
+                position: known.entry.position,
+                range: known.entry.range,
+                version: known.entry.version,
+                alive: self.is_alive(known),
+                age_ms: known.advanced_at.elapsed().as_millis() as u64,
+            })
+            .collect();
+        views.sort_by_key(|view| view.position);
+
+        let alive = views.iter().filter(|view| view.alive).count();
+        let covered: u64 = views
+            .iter()
+            .filter(|view| view.alive)
+            .map(|view| u64::from(view.range))
+            .sum();
+
+        return RingSnapshot {
+            members: views,
+            alive: alive,
+            complete: covered == u64::from(RING_SIZE),
+        };
+    }
+}
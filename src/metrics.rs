@@ -0,0 +1,252 @@
+use rocket::fairing::{Fairing, Info, Kind};
+use rocket::{Data, Request, Response};
+use std::collections::HashMap;
+use std::fmt::Write;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::{Arc, LockResult, Mutex, OnceLock, RwLock, RwLockReadGuard, RwLockWriteGuard};
+use std::time::{Duration, Instant};
+
+// Upper bounds of the latency buckets in seconds, from well below a local lookup to a slow multi-hop request
+const LATENCY_BUCKETS: [f64; 14] = [
+    0.0001, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 10.0,
+];
+
+// Latency histogram in the Prometheus layout, every bucket counts the observations at or below its bound
+pub struct Histogram {
+    buckets: [AtomicU64; LATENCY_BUCKETS.len()],
+    count: AtomicU64,
+    sum_micros: AtomicU64,
+}
+
+impl Default for Histogram {
+    fn default() -> Self {
+        Histogram {
+            buckets: std::array::from_fn(|_| AtomicU64::new(0)),
+            count: AtomicU64::new(0),
+            sum_micros: AtomicU64::new(0),
+        }
+    }
+}
+
+impl Histogram {
+    pub fn observe(&self, elapsed: Duration) {
+        let seconds = elapsed.as_secs_f64();
+        // Only the first matching bucket is counted, render adds them up
+        if let Some(bucket) = LATENCY_BUCKETS.iter().position(|bound| seconds <= *bound) {
+            self.buckets[bucket].fetch_add(1, Ordering::Relaxed);
+        }
+        self.count.fetch_add(1, Ordering::Relaxed);
+        self.sum_micros
+            .fetch_add(elapsed.as_micros() as u64, Ordering::Relaxed);
+    }
+
+    pub fn render(&self, name: &str, labels: &str, out: &mut String) {
+        let separator = if labels.is_empty() { "" } else { "," };
+        let mut cumulative = 0;
+        for (bound, bucket) in LATENCY_BUCKETS.iter().zip(self.buckets.iter()) {
+            cumulative += bucket.load(Ordering::Relaxed);
+            let _ = writeln!(
+                out,
+                "{}_bucket{{{}{}le=\"{}\"}} {}",
+                name, labels, separator, bound, cumulative
+            );
+        }
+        let count = self.count.load(Ordering::Relaxed);
+        let sum = self.sum_micros.load(Ordering::Relaxed) as f64 / 1_000_000.0;
+        let _ = writeln!(out, "{}_bucket{{{}{}le=\"+Inf\"}} {}", name, labels, separator, count);
+        let _ = writeln!(out, "{}_sum{{{}}} {}", name, labels, sum);
+        let _ = writeln!(out, "{}_count{{{}}} {}", name, labels, count);
+    }
+}
+
+// Histograms and counters keyed by their rendered labels, e.g. method="GET",route="/storage/<key>"
+#[derive(Default)]
+struct LabeledHistograms(Mutex<HashMap<String, Arc<Histogram>>>);
+
+impl LabeledHistograms {
+    fn get(&self, labels: String) -> Arc<Histogram> {
+        let mut histograms = self.0.lock().expect("Mutex poisoned");
+        return histograms
+            .entry(labels)
+            .or_insert_with(|| Arc::new(Histogram::default()))
+            .clone();
+    }
+
+    fn render(&self, name: &str, help: &str, out: &mut String) {
+        let histograms = self.0.lock().expect("Mutex poisoned");
+        let _ = writeln!(out, "# HELP {} {}\n# TYPE {} histogram", name, help, name);
+        for (labels, histogram) in sorted(&histograms) {
+            histogram.render(name, labels, out);
+        }
+    }
+}
+
+#[derive(Default)]
+struct LabeledCounters(Mutex<HashMap<String, u64>>);
+
+impl LabeledCounters {
+    fn increment(&self, labels: String) {
+        *self.0.lock().expect("Mutex poisoned").entry(labels).or_insert(0) += 1;
+    }
+
+    fn render(&self, name: &str, help: &str, out: &mut String) {
+        let counters = self.0.lock().expect("Mutex poisoned");
+        let _ = writeln!(out, "# HELP {} {}\n# TYPE {} counter", name, help, name);
+        for (labels, value) in sorted(&counters) {
+            let _ = writeln!(out, "{}{{{}}} {}", name, labels, value);
+        }
+    }
+}
+
+fn sorted<T>(map: &HashMap<String, T>) -> Vec<(&String, &T)> {
+    let mut entries: Vec<(&String, &T)> = map.iter().collect();
+    entries.sort_unstable_by(|a, b| a.0.cmp(b.0));
+    return entries;
+}
+
+fn render_gauge(name: &str, help: &str, value: f64, out: &mut String) {
+    let _ = writeln!(out, "# HELP {} {}\n# TYPE {} gauge\n{} {}", name, help, name, name, value);
+}
+
+// Node wide metrics, rendered in the Prometheus text format by /metrics
+#[derive(Default)]
+pub struct Metrics {
+    request_latency: LabeledHistograms,
+    responses: LabeledCounters,
+    storage_requests: LabeledCounters,
+    outbound_latency: LabeledHistograms,
+    outbound_errors: LabeledCounters,
+    // Taken on every request, so these are plain fields rather than looked up by label
+    lock_wait_read: Histogram,
+    lock_wait_write: Histogram,
+}
+
+pub fn metrics() -> &'static Metrics {
+    static METRICS: OnceLock<Metrics> = OnceLock::new();
+    return METRICS.get_or_init(Metrics::default);
+}
+
+impl Metrics {
+    // How a storage request was answered: local, replica, cached, forwarded or redirected
+    pub fn record_storage_request(&self, method: &str, handled: &str) {
+        self.storage_requests
+            .increment(format!("method=\"{}\",handled=\"{}\"", method, handled));
+    }
+
+    // A request we sent to another node, timed until its answer or failure
+    pub fn record_outbound(&self, peer: &str, started_at: Instant, succeeded: bool) {
+        let labels = format!("peer=\"{}\"", peer);
+        if !succeeded {
+            self.outbound_errors.increment(labels.clone());
+        }
+        self.outbound_latency
+            .get(labels)
+            .observe(started_at.elapsed());
+    }
+
+    pub fn render(&self, storage_keys: usize, storage_bytes: u64) -> String {
+        let mut out = String::new();
+
+        self.request_latency.render(
+            "a1_http_request_duration_seconds",
+            "Time to answer a request, by route",
+            &mut out,
+        );
+        self.responses.render(
+            "a1_http_responses_total",
+            "Answered requests, by route and status",
+            &mut out,
+        );
+        self.storage_requests.render(
+            "a1_storage_requests_total",
+            "Storage requests, by how they were handled",
+            &mut out,
+        );
+        self.outbound_latency.render(
+            "a1_outbound_request_duration_seconds",
+            "Time until another node answered a request we sent it, by peer",
+            &mut out,
+        );
+        self.outbound_errors.render(
+            "a1_outbound_request_errors_total",
+            "Requests to another node that got no answer, by peer",
+            &mut out,
+        );
+        let lock_wait = "a1_node_config_lock_wait_seconds";
+        let _ = writeln!(
+            out,
+            "# HELP {} Time spent waiting for the node configuration lock, by mode\n# TYPE {} histogram",
+            lock_wait, lock_wait
+        );
+        self.lock_wait_read.render(lock_wait, "mode=\"read\"", &mut out);
+        self.lock_wait_write.render(lock_wait, "mode=\"write\"", &mut out);
+        render_gauge("a1_storage_keys", "Keys in local storage", storage_keys as f64, &mut out);
+        render_gauge(
+            "a1_storage_bytes",
+            "Size of the keys and values in local storage",
+            storage_bytes as f64,
+            &mut out,
+        );
+
+        return out;
+    }
+}
+
+// Read and write a lock while recording how long we waited for it
+pub trait TimedLock<T> {
+    fn read_timed(&self) -> LockResult<RwLockReadGuard<'_, T>>;
+    fn write_timed(&self) -> LockResult<RwLockWriteGuard<'_, T>>;
+}
+
+impl<T> TimedLock<T> for RwLock<T> {
+    fn read_timed(&self) -> LockResult<RwLockReadGuard<'_, T>> {
+        let started_at = Instant::now();
+        let guard = self.read();
+        metrics().lock_wait_read.observe(started_at.elapsed());
+        return guard;
+    }
+
+    fn write_timed(&self) -> LockResult<RwLockWriteGuard<'_, T>> {
+        let started_at = Instant::now();
+        let guard = self.write();
+        metrics().lock_wait_write.observe(started_at.elapsed());
+        return guard;
+    }
+}
+
+// Times every request from its arrival until the response is ready. Streamed bodies are still
+// being sent at that point, so large forwarded values are timed to their first byte.
+pub struct RequestMetrics;
+
+struct RequestStart(Instant);
+
+#[rocket::async_trait]
+impl Fairing for RequestMetrics {
+    fn info(&self) -> Info {
+        Info {
+            name: "Request metrics",
+            kind: Kind::Request | Kind::Response,
+        }
+    }
+
+    async fn on_request(&self, request: &mut Request<'_>, _data: &mut Data<'_>) {
+        request.local_cache(|| RequestStart(Instant::now()));
+    }
+
+    async fn on_response<'r>(&self, request: &'r Request<'_>, response: &mut Response<'r>) {
+        let started_at = request.local_cache(|| RequestStart(Instant::now())).0;
+        let route = match request.route() {
+            Some(route) => route.uri.to_string(),
+            None => String::from("unmatched"),
+        };
+        let labels = format!("method=\"{}\",route=\"{}\"", request.method(), route);
+
+        metrics()
+            .request_latency
+            .get(labels.clone())
+            .observe(started_at.elapsed());
+        metrics()
+            .responses
+            .increment(format!("{},status=\"{}\"", labels, response.status().code));
+    }
+}
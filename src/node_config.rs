@@ -1,4 +1,12 @@
-use crate::{Network, Node, Storage};
+use crate::finger_table::FingerTable;
+use std::cmp::Reverse;
+use std::sync::Arc;
+use std::time::Instant;
+
+use crate::{
+    clockwise_distance, is_location_in_range, is_same_node, Network, Node, RangeSummary, Storage,
+    SUCCESSOR_LIST_LENGTH,
+};
 
 pub struct NodeConfig {
     // pub network: Option<Network>,
@@ -6,8 +14,19 @@ pub struct NodeConfig {
     pub local: Node,
     pub successor: Node,
     pub precessor: Node,
-    pub finger_table: Vec<Node>,
-    pub storage: Storage,
+    pub successor_list: Vec<Node>,
+    // Nearest predecessor first. Ends with ourselves if the ring is shorter than the list.
+    pub precessor_list: Vec<Node>,
+    // Range summary of our successor one hop further away, None until stabilization has fetched it
+    pub successor_range_summary: Option<RangeSummary>,
+    // Joining node we reserved the upper half of our range for, and when
+    pub split_reservation: Option<(Node, Instant)>,
+    pub finger_table: FingerTable,
+    pub storage: Arc<Storage>,
+    // Total number of copies of every key, the owner's included
+    pub replication_factor: usize,
+    // Largest value accepted for a single key, in bytes
+    pub max_value_bytes: u64,
     pub crashed: bool,
 }
 
@@ -26,4 +45,155 @@ impl NodeConfig {
     pub fn is_crashed(&self) -> bool {
         self.crashed
     }
+
+    // Pick the known node that gets closest to a location outside our own range without passing it.
+    // Falls back to the successor, so a request always makes progress around the ring.
+    pub fn next_hop(&self, location: u16) -> &Node {
+        let target = clockwise_distance(self.local.position, location);
+
+        let mut forward_node = &self.successor;
+        let mut forward_offset = 0;
+
+        let candidates = [
+            Some(&self.successor),
+            Some(&self.precessor),
+            self.finger_table.closest_preceding(location),
+        ];
+
+        for node in candidates.into_iter().flatten() {
+            let offset = clockwise_distance(self.local.position, node.position);
+            if offset <= target && offset > forward_offset {
+                forward_node = node;
+                forward_offset = offset;
+            }
+        }
+
+        return forward_node;
+    }
+
+    // The next hop followed by fallbacks from the successor list, closest to the location first.
+    // Fallbacks never pass the location, so a request cannot skip over the owner.
+    pub fn forward_candidates(&self, location: u16) -> Vec<Node> {
+        let target = clockwise_distance(self.local.position, location);
+        let next_hop = self.next_hop(location);
+
+        let mut fallbacks: Vec<&Node> = self
+            .successor_list
+            .iter()
+            .filter(|node| {
+                let offset = clockwise_distance(self.local.position, node.position);
+                offset > 0 && offset <= target && !is_same_node(node, next_hop)
+            })
+            .collect();
+        fallbacks.sort_by_key(|node| Reverse(clockwise_distance(self.local.position, node.position)));
+
+        let mut candidates = vec![next_hop.clone()];
+        candidates.extend(fallbacks.into_iter().cloned());
+        return candidates;
+    }
+
+    // The longest range we know of, our own range is always current while the summary may be older
+    pub fn range_summary(&self) -> RangeSummary {
+        match &self.successor_range_summary {
+            Some(summary)
+                if summary.holder.range > self.local.range
+                    && !is_same_node(&summary.holder, &self.local) =>
+            {
+                summary.clone()
+            }
+            _ => RangeSummary {
+                holder: self.local.clone(),
+                hops: 0,
+            },
+        }
+    }
+
+    // Successors that receive a copy of every write we own
+    pub fn replica_nodes(&self) -> Vec<Node> {
+        let successors = if self.successor_list.is_empty() {
+            std::slice::from_ref(&self.successor)
+        } else {
+            &self.successor_list[..]
+        };
+
+        return successors
+            .iter()
+            .filter(|node| !is_same_node(node, &self.local))
+            .take(self.replication_factor.saturating_sub(1))
+            .cloned()
+            .collect();
+    }
+
+    // Locations whose owners send us a copy of their writes, from our furthest replicated predecessor
+    // up to our own range. None until stabilization has learned enough predecessors.
+    pub fn replica_range(&self) -> Option<(u16, u16)> {
+        let copies = self.replication_factor.saturating_sub(1);
+        if copies == 0 {
+            return None;
+        }
+
+        let start = match self
+            .precessor_list
+            .iter()
+            .take(copies)
+            .position(|node| is_same_node(node, &self.local))
+        {
+            // There are fewer nodes than copies, every other node replicates to us
+            Some(_index) => self.successor.position,
+            None => self.precessor_list.get(copies - 1)?.position,
+        };
+        return Some((start, clockwise_distance(start, self.local.position) as u16));
+    }
+
+    // Whether we are one of the replicas of a location we do not own
+    pub fn holds_replica(&self, location: u16) -> bool {
+        return self
+            .replica_range()
+            .is_some_and(|(position, range)| is_location_in_range(location, position, range));
+    }
+
+    // Successors past the location, they hold replicas if the owner of the location is down
+    pub fn successors_past(&self, location: u16) -> Vec<Node> {
+        let target = clockwise_distance(self.local.position, location);
+
+        return self
+            .successor_list
+            .iter()
+            .filter(|node| clockwise_distance(self.local.position, node.position) > target)
+            .cloned()
+            .collect();
+    }
+
+    // Keep the successor list in line with a new successor, dropping entries before it
+    pub fn promote_successor(&mut self, successor: &Node) {
+        match self
+            .successor_list
+            .iter()
+            .position(|node| is_same_node(node, successor))
+        {
+            Some(index) => {
+                self.successor_list.drain(..index);
+            }
+            None => self.successor_list.insert(0, successor.clone()),
+        }
+        self.successor_list.truncate(SUCCESSOR_LIST_LENGTH);
+    }
+
+    // Same as promote_successor for the other direction, used when our precessor changes
+    pub fn promote_precessor(&mut self, precessor: &Node) {
+        if self.precessor_list.is_empty() {
+            return;
+        }
+        match self
+            .precessor_list
+            .iter()
+            .position(|node| is_same_node(node, precessor))
+        {
+            Some(index) => {
+                self.precessor_list.drain(..index);
+            }
+            None => self.precessor_list.insert(0, precessor.clone()),
+        }
+        self.precessor_list.truncate(SUCCESSOR_LIST_LENGTH);
+    }
 }
@@ -0,0 +1,318 @@
+use bytes::Bytes;
+use rocket::request::{self, FromRequest, Outcome, Request};
+use rocket::serde::Serialize;
+use rocket::tokio;
+use std::collections::{BTreeMap, HashMap};
+use std::env;
+use std::sync::{Mutex, OnceLock};
+use std::time::{Duration, Instant};
+
+use crate::formation::parse_member;
+use crate::http_connect;
+
+// Nodes that may hold a cached copy of the value, host:port separated by commas. Every caching node
+// on the way to the owner adds itself, so the owner knows whom to invalidate when the key is written.
+pub const CACHE_REQUESTERS_HEADER: &str = "X-Cache-Requesters";
+
+const DEFAULT_CAPACITY_BYTES: usize = 0; // Cache size in bytes, 0 disables the cache, override with A1_READ_CACHE_BYTES
+const DEFAULT_TTL_MS: u64 = 2000; // Longest a cached value is served, override with A1_READ_CACHE_TTL_MS
+
+// Values larger than this are streamed through and never cached
+const MAX_ENTRY_BYTES: usize = http_connect::STREAM_THRESHOLD;
+
+// Keys whose readers a node keeps track of, a missed invalidation is still bounded by the TTL
+const MAX_TRACKED_KEYS: usize = 100_000;
+
+struct CachedValue {
+    value: Bytes,
+    cached_at: Instant,
+    // Position in the LRU order, larger is more recently used
+    tick: u64,
+}
+
+#[derive(Default)]
+struct CacheState {
+    entries: HashMap<String, CachedValue>,
+    lru: BTreeMap<u64, String>,
+    next_tick: u64,
+    bytes: usize,
+    hits: u64,
+    misses: u64,
+    insertions: u64,
+    evictions: u64,
+    expirations: u64,
+    invalidations: u64,
+}
+
+#[derive(Serialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct ReadCacheStatistics {
+    pub enabled: bool,
+    pub entries: usize,
+    pub bytes: usize,
+    pub capacity_bytes: usize,
+    pub ttl_ms: u64,
+    pub hits: u64,
+    pub misses: u64,
+    pub hit_rate: f64,
+    pub insertions: u64,
+    pub evictions: u64,
+    pub expirations: u64,
+    pub invalidations: u64,
+    pub tracked_keys: usize,
+}
+
+// Bounded LRU cache of values this node forwarded a GET for, each one served for at most the TTL
+pub struct ReadCache {
+    capacity_bytes: usize,
+    ttl: Duration,
+    state: Mutex<CacheState>,
+    // Nodes that read a key from our storage recently, told to drop their copy when the key is written
+    requesters: Mutex<HashMap<String, Vec<(String, Instant)>>>,
+}
+
+// Process wide cache, configured from the environment on first use
+pub fn read_cache() -> &'static ReadCache {
+    static CACHE: OnceLock<ReadCache> = OnceLock::new();
+    return CACHE.get_or_init(|| {
+        let capacity_bytes = env::var("A1_READ_CACHE_BYTES")
+            .ok()
+            .and_then(|bytes| bytes.parse().ok())
+            .unwrap_or(DEFAULT_CAPACITY_BYTES);
+        let ttl_ms = env::var("A1_READ_CACHE_TTL_MS")
+            .ok()
+            .and_then(|ttl| ttl.parse().ok())
+            .unwrap_or(DEFAULT_TTL_MS);
+        ReadCache::new(capacity_bytes, Duration::from_millis(ttl_ms))
+    });
+}
+
+// Memory charged for an entry, the key is held by both the map and the LRU order
+fn entry_bytes(key: &str, value: &Bytes) -> usize {
+    return 2 * key.len() + value.len();
+}
+
+impl CacheState {
+    fn remove(&mut self, key: &str) -> bool {
+        match self.entries.remove(key) {
+            Some(cached) => {
+                self.lru.remove(&cached.tick);
+                self.bytes -= entry_bytes(key, &cached.value);
+                return true;
+            }
+            None => return false,
+        };
+    }
+}
+
+impl ReadCache {
+    pub fn new(capacity_bytes: usize, ttl: Duration) -> Self {
+        ReadCache {
+            capacity_bytes: capacity_bytes,
+            ttl: ttl,
+            state: Mutex::new(CacheState::default()),
+            requesters: Mutex::new(HashMap::new()),
+        }
+    }
+
+    pub fn is_enabled(&self) -> bool {
+        return self.capacity_bytes > 0 && !self.ttl.is_zero();
+    }
+
+    pub fn get(&self, key: &str) -> Option<Bytes> {
+        if !self.is_enabled() {
+            return None;
+        }
+
+        let mut state = self.state.lock().expect("Mutex poisoned");
+        let state = &mut *state;
+
+        let (old_tick, fresh) = match state.entries.get(key) {
+            Some(cached) => (cached.tick, cached.cached_at.elapsed() < self.ttl),
+            None => {
+                state.misses += 1;
+                return None;
+            }
+        };
+
+        if !fresh {
+            state.remove(key);
+            state.expirations += 1;
+            state.misses += 1;
+            return None;
+        }
+
+        // Move the key to the most recently used end
+        let tick = state.next_tick;
+        state.next_tick += 1;
+        let key = state.lru.remove(&old_tick).expect("LRU order matches the entries");
+        let cached = state.entries.get_mut(&key).expect("Entry is cached");
+        cached.tick = tick;
+        let value = cached.value.clone();
+        state.lru.insert(tick, key);
+
+        state.hits += 1;
+        return Some(value);
+    }
+
+    pub fn insert(&self, key: &str, value: Bytes) {
+        let size = entry_bytes(key, &value);
+        if !self.is_enabled() || value.len() > MAX_ENTRY_BYTES || size > self.capacity_bytes {
+            return;
+        }
+
+        let mut state = self.state.lock().expect("Mutex poisoned");
+        state.remove(key);
+
+        // Make room by dropping the least recently used entries
+        while state.bytes + size > self.capacity_bytes {
+            let oldest = match state.lru.first_key_value() {
+                Some((_tick, oldest)) => oldest.clone(),
+                None => break,
+            };
+            state.remove(&oldest);
+            state.evictions += 1;
+        }
+
+        let tick = state.next_tick;
+        state.next_tick += 1;
+        state.lru.insert(tick, key.to_string());
+        state.entries.insert(
+            key.to_string(),
+            CachedValue {
+                value: value,
+                cached_at: Instant::now(),
+                tick: tick,
+            },
+        );
+        state.bytes += size;
+        state.insertions += 1;
+    }
+
+    // Drop our copy of a key that has been written
+    pub fn invalidate(&self, key: &str) {
+        let mut state = self.state.lock().expect("Mutex poisoned");
+        if state.remove(key) {
+            state.invalidations += 1;
+        }
+    }
+
+    // Remember the nodes that may cache a value we served them
+    pub fn record_requesters(&self, key: &str, requesters: &CacheRequesters) {
+        if requesters.0.is_empty() {
+            return;
+        }
+
+        let mut tracked = self.requesters.lock().expect("Mutex poisoned");
+        if tracked.len() >= MAX_TRACKED_KEYS && !tracked.contains_key(key) {
+            // Their copies have expired by now, there is nothing left to invalidate for them
+            tracked.retain(|_key, readers| {
+                readers.iter().any(|(_requester, read_at)| read_at.elapsed() < self.ttl)
+            });
+            if tracked.len() >= MAX_TRACKED_KEYS {
+                return;
+            }
+        }
+
+        let readers = tracked.entry(key.to_string()).or_insert_with(Vec::new);
+        readers.retain(|(requester, read_at)| {
+            read_at.elapsed() < self.ttl && !requesters.0.contains(requester)
+        });
+        for requester in requesters.0.iter() {
+            readers.push((requester.clone(), Instant::now()));
+        }
+    }
+
+    // Tell the nodes that read a key recently to drop their copy, without waiting for them
+    pub fn invalidate_requesters(&self, key: &str) {
+        let readers = match self.requesters.lock().expect("Mutex poisoned").remove(key) {
+            Some(readers) => readers,
+            None => return,
+        };
+
+        let path = format!("cache/{}", http_connect::encode_component(key));
+        for (requester, read_at) in readers {
+            if read_at.elapsed() >= self.ttl {
+                continue;
+            }
+            let (hostname, port) = match parse_member(&requester) {
+                Some(member) => member,
+                None => continue,
+            };
+            let path = path.clone();
+
+            tokio::spawn(async move {
+                if http_connect::write_body_to_node_async(
+                    http_connect::WriteOperations::Delete,
+                    &hostname,
+                    port,
+                    &path,
+                    "text/plain",
+                    &[],
+                    &[],
+                )
+                .await
+                .is_err()
+                {
+                    log_warn!("Could not invalidate cached copy on {}:{}", hostname, port);
+                }
+            });
+        }
+    }
+
+    pub fn statistics(&self) -> ReadCacheStatistics {
+        let tracked_keys = self.requesters.lock().expect("Mutex poisoned").len();
+        let state = self.state.lock().expect("Mutex poisoned");
+        let lookups = state.hits + state.misses;
+
+        ReadCacheStatistics {
+            enabled: self.is_enabled(),
+            entries: state.entries.len(),
+            bytes: state.bytes,
+            capacity_bytes: self.capacity_bytes,
+            ttl_ms: self.ttl.as_millis() as u64,
+            hits: state.hits,
+            misses: state.misses,
+            hit_rate: if lookups == 0 {
+                0.0
+            } else {
+                state.hits as f64 / lookups as f64
+            },
+            insertions: state.insertions,
+            evictions: state.evictions,
+            expirations: state.expirations,
+            invalidations: state.invalidations,
+            tracked_keys: tracked_keys,
+        }
+    }
+}
+
+// Caching nodes a GET has passed through, read from the X-Cache-Requesters header
+pub struct CacheRequesters(pub Vec<String>);
+
+impl CacheRequesters {
+    // The header value to forward with, including this node if it will cache the answer
+    pub fn with(&self, local: Option<String>) -> String {
+        let mut requesters = self.0.clone();
+        requesters.extend(local);
+        return requesters.join(",");
+    }
+}
+
+#[rocket::async_trait]
+impl<'r> FromRequest<'r> for CacheRequesters {
+    type Error = String;
+
+    async fn from_request(request: &'r Request<'_>) -> request::Outcome<Self, Self::Error> {
+        let requesters = match request.headers().get_one(CACHE_REQUESTERS_HEADER) {
+            None => vec![],
+            Some(value) => value
+                .split(',')
+                .map(|requester| requester.trim())
+                .filter(|requester| parse_member(requester).is_some())
+                .map(String::from)
+                .collect(),
+        };
+        return Outcome::Success(CacheRequesters(requesters));
+    }
+}
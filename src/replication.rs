@@ -0,0 +1,152 @@
+use bytes::Bytes;
+use rocket::http::Status;
+use rocket::request::{self, FromRequest, Outcome, Request};
+use rocket::tokio;
+
+use crate::http_connect;
+use crate::transfer::TransferEntry;
+use crate::Node;
+
+pub const CONSISTENCY_HEADER: &str = "X-Consistency-Level";
+
+// How many copies of a write must be stored before the client gets an answer
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub enum ConsistencyLevel {
+    One,
+    Quorum,
+    All,
+}
+
+impl ConsistencyLevel {
+    pub fn as_str(&self) -> &'static str {
+        match self {
+            ConsistencyLevel::One => "ONE",
+            ConsistencyLevel::Quorum => "QUORUM",
+            ConsistencyLevel::All => "ALL",
+        }
+    }
+
+    fn parse(value: &str) -> Option<Self> {
+        match value.to_uppercase().as_str() {
+            "ONE" => Some(ConsistencyLevel::One),
+            "QUORUM" => Some(ConsistencyLevel::Quorum),
+            "ALL" => Some(ConsistencyLevel::All),
+            _ => None,
+        }
+    }
+
+    // Number of stored copies, including the owner's, needed out of copies in total
+    pub fn required_copies(&self, copies: usize) -> usize {
+        match self {
+            ConsistencyLevel::One => 1,
+            ConsistencyLevel::Quorum => copies / 2 + 1,
+            ConsistencyLevel::All => copies,
+        }
+    }
+}
+
+// Read from the X-Consistency-Level header, requests without it use ONE
+#[rocket::async_trait]
+impl<'r> FromRequest<'r> for ConsistencyLevel {
+    type Error = String;
+
+    async fn from_request(request: &'r Request<'_>) -> request::Outcome<Self, Self::Error> {
+        match request.headers().get_one(CONSISTENCY_HEADER) {
+            None => Outcome::Success(ConsistencyLevel::One),
+            Some(value) => match ConsistencyLevel::parse(value) {
+                Some(level) => Outcome::Success(level),
+                None => Outcome::Error((
+                    Status::BadRequest,
+                    format!("Unknown consistency level: {}", value),
+                )),
+            },
+        }
+    }
+}
+
+// Send a write to every replica in parallel and wait until required_acks of them have stored it
+pub async fn replicate_write(
+    replicas: Vec<Node>,
+    key: &str,
+    value: Bytes,
+    required_acks: usize,
+) -> bool {
+    let path = format!("replica/{}", http_connect::encode_component(key));
+    return replicate(replicas, path, "application/octet-stream", value, required_acks).await;
+}
+
+// Same as replicate_write for many keys at once, every replica gets them in a single request
+pub async fn replicate_entries(
+    replicas: Vec<Node>,
+    entries: &[TransferEntry],
+    required_acks: usize,
+) -> bool {
+    if entries.is_empty() {
+        return true;
+    }
+
+    let body = match rocket::serde::json::to_string(entries) {
+        Ok(body) => Bytes::from(body),
+        Err(_err) => return false,
+    };
+    return replicate(
+        replicas,
+        String::from("transfer/entries"),
+        "application/json",
+        body,
+        required_acks,
+    )
+    .await;
+}
+
+// Replicas that answer after required_acks still get the write, the client just doesn't wait for them
+async fn replicate(
+    replicas: Vec<Node>,
+    path: String,
+    content_type: &'static str,
+    body: Bytes,
+    required_acks: usize,
+) -> bool {
+    let (sender, mut receiver) = tokio::sync::mpsc::channel::<bool>(replicas.len().max(1));
+
+    for replica in replicas {
+        let sender = sender.clone();
+        let path = path.clone();
+        let body = body.clone();
+
+        tokio::spawn(async move {
+            let stored = http_connect::write_body_to_node_async(
+                http_connect::WriteOperations::Put,
+                &replica.hostname,
+                replica.port,
+                &path,
+                content_type,
+                &[],
+                &body,
+            )
+            .await
+            .is_ok();
+
+            if !stored {
+                log_warn!(
+                    "Could not replicate write to {}:{}",
+                    replica.hostname, replica.port
+                );
+            }
+            let _ = sender.send(stored).await;
+        });
+    }
+    drop(sender);
+
+    let mut acks = 0;
+    while acks < required_acks {
+        match receiver.recv().await {
+            Some(true) => acks += 1,
+            Some(false) => (),
+            // Every replica has answered, and not enough of them stored the write
+            None => return false,
+        }
+    }
+
+    return true;
+}
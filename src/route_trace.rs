@@ -0,0 +1,153 @@
+use rocket::http::Status;
+use rocket::request::{self, FromRequest, Outcome, Request};
+use rocket::response::{self, Responder};
+use std::collections::HashMap;
+use std::env;
+use std::sync::OnceLock;
+
+// Times a storage request has been forwarded so far, and on the answer the total it took
+pub const HOP_COUNT_HEADER: &str = "X-Hop-Count";
+// Positions of the nodes a request has passed through, comma separated, only sent while tracing
+pub const ROUTE_PATH_HEADER: &str = "X-Route-Path";
+// Set by a client to have the path recorded, e.g. "X-Route-Trace: true"
+pub const ROUTE_TRACE_HEADER: &str = "X-Route-Trace";
+
+const DEFAULT_MAX_HOPS: u32 = 64; // Forwards a request may take before it is dropped as a loop, override with A1_MAX_HOPS
+
+pub fn max_hops() -> u32 {
+    static MAX_HOPS: OnceLock<u32> = OnceLock::new();
+    return *MAX_HOPS.get_or_init(|| {
+        env::var("A1_MAX_HOPS")
+            .ok()
+            .and_then(|hops| hops.parse().ok())
+            .unwrap_or(DEFAULT_MAX_HOPS)
+    });
+}
+
+// How a storage request got to this node
+#[derive(Clone, Debug, Default)]
+pub struct RouteTrace {
+    pub hops: u32,
+    // None unless the client asked for a trace
+    pub path: Option<Vec<u16>>,
+}
+
+fn parse_path(value: &str) -> Option<Vec<u16>> {
+    return value
+        .split(',')
+        .map(|position| position.trim())
+        .filter(|position| !position.is_empty())
+        .map(|position| position.parse().ok())
+        .collect();
+}
+
+impl RouteTrace {
+    // Another hop may be taken without passing the hop limit
+    pub fn may_forward(&self) -> bool {
+        return self.hops < max_hops();
+    }
+
+    // The trace to send on to the next node, or to answer with when this node serves the request
+    pub fn visit(&self, position: u16, forwarded: bool) -> RouteTrace {
+        let path = self.path.as_ref().map(|path| {
+            let mut path = path.clone();
+            path.push(position);
+            path
+        });
+
+        return RouteTrace {
+            hops: if forwarded { self.hops + 1 } else { self.hops },
+            path: path,
+        };
+    }
+
+    fn path_header(&self) -> Option<String> {
+        return self.path.as_ref().map(|path| {
+            path.iter()
+                .map(|position| position.to_string())
+                .collect::<Vec<String>>()
+                .join(",")
+        });
+    }
+
+    // Header values for a forwarded request or a response
+    pub fn headers(&self) -> Vec<(&'static str, String)> {
+        let mut headers = vec![(HOP_COUNT_HEADER, self.hops.to_string())];
+        if let Some(path) = self.path_header() {
+            headers.push((ROUTE_PATH_HEADER, path));
+        }
+        return headers;
+    }
+
+    // The trace the serving node answered with, from the lowercased headers of its response
+    pub fn from_response(headers: &HashMap<String, String>) -> Option<RouteTrace> {
+        let hops = headers
+            .get(&HOP_COUNT_HEADER.to_lowercase())?
+            .parse()
+            .ok()?;
+        let path = headers
+            .get(&ROUTE_PATH_HEADER.to_lowercase())
+            .and_then(|path| parse_path(path));
+
+        return Some(RouteTrace {
+            hops: hops,
+            path: path,
+        });
+    }
+}
+
+#[rocket::async_trait]
+impl<'r> FromRequest<'r> for RouteTrace {
+    type Error = String;
+
+    async fn from_request(request: &'r Request<'_>) -> request::Outcome<Self, Self::Error> {
+        let headers = request.headers();
+
+        let hops = match headers.get_one(HOP_COUNT_HEADER) {
+            None => 0,
+            Some(value) => match value.parse() {
+                Ok(hops) => hops,
+                Err(_err) => {
+                    return Outcome::Error((
+                        Status::BadRequest,
+                        format!("Invalid hop count: {}", value),
+                    ))
+                }
+            },
+        };
+
+        let path = match headers.get_one(ROUTE_PATH_HEADER) {
+            Some(value) => match parse_path(value) {
+                Some(path) => Some(path),
+                None => {
+                    return Outcome::Error((
+                        Status::BadRequest,
+                        format!("Invalid route path: {}", value),
+                    ))
+                }
+            },
+            None => headers
+                .get_one(ROUTE_TRACE_HEADER)
+                .filter(|value| value.eq_ignore_ascii_case("true") || *value == "1")
+                .map(|_value| Vec::new()),
+        };
+
+        return Outcome::Success(RouteTrace {
+            hops: hops,
+            path: path,
+        });
+    }
+}
+
+// A response carrying the hop count and path of the request it answers
+pub struct Traced<T>(pub T, pub RouteTrace);
+
+impl<'r, T: Responder<'r, 'static>> Responder<'r, 'static> for Traced<T> {
+    fn respond_to(self, request: &'r Request<'_>) -> response::Result<'static> {
+        let mut response = self.0.respond_to(request)?;
+        for (name, value) in self.1.headers() {
+            response.set_raw_header(name, value);
+        }
+        return Ok(response);
+    }
+}
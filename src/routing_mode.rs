@@ -0,0 +1,101 @@
+use rocket::http::{Header, Status};
+use rocket::request::{self, FromRequest, Outcome, Request};
+use rocket::response::{self, Responder, Response};
+use std::env;
+use std::io::Cursor;
+use std::sync::OnceLock;
+
+use crate::Node;
+
+pub const ROUTING_MODE_HEADER: &str = "X-Routing-Mode";
+
+// What a node does with a request for a key it does not own
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub enum RoutingMode {
+    // Forward the request and relay the answer back, the value crosses the network once per hop
+    Proxy,
+    // Point the client at the owner, the value crosses the network once
+    Redirect,
+}
+
+impl RoutingMode {
+    pub fn as_str(&self) -> &'static str {
+        match self {
+            RoutingMode::Proxy => "proxy",
+            RoutingMode::Redirect => "redirect",
+        }
+    }
+
+    fn parse(value: &str) -> Option<Self> {
+        match value.to_lowercase().as_str() {
+            "proxy" => Some(RoutingMode::Proxy),
+            "redirect" => Some(RoutingMode::Redirect),
+            _ => None,
+        }
+    }
+}
+
+// Mode used by requests without the header, set for the whole node with A1_ROUTING_MODE
+fn default_routing_mode() -> RoutingMode {
+    static DEFAULT: OnceLock<RoutingMode> = OnceLock::new();
+    return *DEFAULT.get_or_init(|| {
+        env::var("A1_ROUTING_MODE")
+            .ok()
+            .and_then(|mode| RoutingMode::parse(&mode))
+            .unwrap_or(RoutingMode::Proxy)
+    });
+}
+
+// Read from the X-Routing-Mode header, requests without it use the node's default
+#[rocket::async_trait]
+impl<'r> FromRequest<'r> for RoutingMode {
+    type Error = String;
+
+    async fn from_request(request: &'r Request<'_>) -> request::Outcome<Self, Self::Error> {
+        match request.headers().get_one(ROUTING_MODE_HEADER) {
+            None => Outcome::Success(default_routing_mode()),
+            Some(value) => match RoutingMode::parse(value) {
+                Some(mode) => Outcome::Success(mode),
+                None => Outcome::Error((
+                    Status::BadRequest,
+                    format!("Unknown routing mode: {}", value),
+                )),
+            },
+        }
+    }
+}
+
+// A 307 pointing at the node that should handle the request. 307 keeps the method and body, so a
+// redirected PUT is repeated as a PUT. The body names the node for clients that do not follow redirects.
+pub struct OwnerRedirect {
+    pub node: Node,
+    pub path: String,
+}
+
+impl<'r> Responder<'r, 'static> for OwnerRedirect {
+    fn respond_to(self, _request: &'r Request<'_>) -> response::Result<'static> {
+        let address = format!("{}:{}", self.node.hostname, self.node.port);
+        let location = format!("http://{}/{}", address, self.path);
+
+        Response::build()
+            .status(Status::TemporaryRedirect)
+            .header(Header::new("Location", location))
+            .sized_body(address.len(), Cursor::new(address))
+            .ok()
+    }
+}
+
+// Either the answer to the request, or a redirect to where the client should send it instead
+pub enum Routed<T> {
+    Served(T),
+    Redirect(OwnerRedirect),
+}
+
+impl<'r, T: Responder<'r, 'static>> Responder<'r, 'static> for Routed<T> {
+    fn respond_to(self, request: &'r Request<'_>) -> response::Result<'static> {
+        match self {
+            Routed::Served(served) => served.respond_to(request),
+            Routed::Redirect(redirect) => redirect.respond_to(request),
+        }
+    }
+}
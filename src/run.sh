@@ -78,11 +78,6 @@ remaining_node_count=$requested_node_count
 
 deployed_services=()
 
-deployed_nodes_count=0
-
-previous_node=0
-previous_port=0
-
 while [ $remaining_node_count -gt 0 ]
 do
     for node in $node_list; do
@@ -91,26 +86,27 @@ do
             port=$(shuf -i 49152-65535 -n 1)
             (echo "nodename=$node port=$port"; cat run-node.sh) | ssh $node /bin/bash
 
-            sleep 1
-
             echo "Started server on node: $node:$port"
             deployed_services+=("$node:$port")
             remaining_node_count=$((remaining_node_count-1))
-
-            if [ $deployed_nodes_count -eq 0 ]
-            then
-                echo "Created first node."
-            else
-                echo "Joining node to previous node."
-                curl -v -X "POST" "http://$node:$port/join?nprime=$previous_node:$previous_port"
-            fi
-            deployed_nodes_count=$deployed_nodes_count+1
-            previous_node=$node
-            previous_port=$port
         fi
     done
 done
 
+# Give the servers time to start listening
+sleep 1
+
+# A static deployment knows all its members up front, so the ring is formed in one round
+first_service=${deployed_services[0]}
+members_json=$(printf '"%s",' "${deployed_services[@]}")
+members_json="{\"members\": [${members_json%,}]}"
+echo "Forming ring of ${#deployed_services[@]} nodes through $first_service."
+form_start=$(date +%s.%N)
+curl -s -X "POST" -H "Content-Type: application/json" --data "$members_json" "http://$first_service/network/form"
+echo
+form_end=$(date +%s.%N)
+echo "Ring formed in $(echo "$form_end - $form_start" | bc) seconds."
+
 if [ $finger_table_size -gt 0 ]
 then
     for service in "${deployed_services[@]}"; do
@@ -1,26 +1,413 @@
+use bytes::Bytes;
+use rocket::serde::Serialize;
 use std::collections::HashMap;
-use std::sync::{Arc, RwLock};
+use std::io;
+use std::path::Path;
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::{Arc, Mutex, RwLock, RwLockReadGuard, RwLockWriteGuard, TryLockError};
+use std::time::{Duration, Instant};
+
+use crate::write_log::{FsyncMode, WriteLog, WriteLogStatistics};
+use crate::{is_location_in_range, key_to_location};
+
+// Number of shards, must be a power of two. Each shard covers an equally sized slice of the ring.
+const SHARD_COUNT: usize = 16;
+
+// How long the key snapshot of a range is kept after a transfer last read a chunk from it
+const RANGE_SNAPSHOT_TTL: Duration = Duration::from_secs(30);
+
+#[derive(Serialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct ShardStatistics {
+    pub shard: usize,
+    pub first_location: u16,
+    pub keys: usize,
+    pub bytes: u64,
+    pub reads: u64,
+    pub writes: u64,
+    pub contended_reads: u64,
+    pub contended_writes: u64,
+}
+
+struct Shard {
+    entries: RwLock<HashMap<String, Bytes>>,
+    // Size of the keys and values, only changed while holding the write lock
+    bytes: AtomicU64,
+    reads: AtomicU64,
+    writes: AtomicU64,
+    contended_reads: AtomicU64,
+    contended_writes: AtomicU64,
+}
+
+impl Shard {
+    fn new() -> Self {
+        Shard {
+            entries: RwLock::new(HashMap::new()),
+            bytes: AtomicU64::new(0),
+            reads: AtomicU64::new(0),
+            writes: AtomicU64::new(0),
+            contended_reads: AtomicU64::new(0),
+            contended_writes: AtomicU64::new(0),
+        }
+    }
+
+    // Try the lock first so that we can count how often a reader had to wait
+    fn read(&self) -> RwLockReadGuard<'_, HashMap<String, Bytes>> {
+        self.reads.fetch_add(1, Ordering::Relaxed);
+        match self.entries.try_read() {
+            Ok(entries) => entries,
+            Err(TryLockError::WouldBlock) => {
+                self.contended_reads.fetch_add(1, Ordering::Relaxed);
+                self.entries.read().expect("RWLock poisoned")
+            }
+            Err(TryLockError::Poisoned(_err)) => panic!("RWLock poisoned"),
+        }
+    }
+
+    fn write(&self) -> RwLockWriteGuard<'_, HashMap<String, Bytes>> {
+        self.writes.fetch_add(1, Ordering::Relaxed);
+        match self.entries.try_write() {
+            Ok(entries) => entries,
+            Err(TryLockError::WouldBlock) => {
+                self.contended_writes.fetch_add(1, Ordering::Relaxed);
+                self.entries.write().expect("RWLock poisoned")
+            }
+            Err(TryLockError::Poisoned(_err)) => panic!("RWLock poisoned"),
+        }
+    }
+
+    fn add_bytes(&self, key: &str, value: &Bytes) {
+        self.bytes
+            .fetch_add((key.len() + value.len()) as u64, Ordering::Relaxed);
+    }
+
+    fn remove_bytes(&self, key: &str, value: &Bytes) {
+        self.bytes
+            .fetch_sub((key.len() + value.len()) as u64, Ordering::Relaxed);
+    }
+}
+
+struct RangeSnapshot {
+    position: u16,
+    range: u16,
+    keys: Arc<Vec<String>>,
+    used_at: Instant,
+}
 
 pub struct Storage {
-    storage: Arc<RwLock<HashMap<String, String>>>,
+    shards: Vec<Shard>,
+    // Every change is appended here before it becomes visible, None keeps the storage in memory only
+    write_log: Option<WriteLog>,
+    // Sorted keys of the ranges being transferred, by snapshot id. Every transfer has its own, so
+    // transfers of the same range to different nodes do not replace each other's snapshot.
+    range_snapshots: Mutex<HashMap<u64, RangeSnapshot>>,
+    next_snapshot_id: AtomicU64,
 }
 
 impl Storage {
     pub fn new() -> Self {
-        println!("Initialized HashMap storage!");
+        log_info!("Initialized sharded storage with {} shards!", SHARD_COUNT);
         Storage {
-            storage: Arc::new(RwLock::new(HashMap::new())),
+            shards: (0..SHARD_COUNT).map(|_| Shard::new()).collect(),
+            write_log: None,
+            range_snapshots: Mutex::new(HashMap::new()),
+            next_snapshot_id: AtomicU64::new(1),
+        }
+    }
+
+    // Storage that survives restarts, recovered from the data directory
+    pub fn open(dir: &Path, fsync_mode: FsyncMode, compact_bytes: u64) -> io::Result<Self> {
+        let (write_log, entries) = WriteLog::open(dir, fsync_mode, compact_bytes)?;
+
+        let mut storage = Storage::new();
+        for (key, value) in entries {
+            let shard = &mut storage.shards[Storage::shard_index(key_to_location(&key))];
+            shard.add_bytes(&key, &value);
+            shard
+                .entries
+                .get_mut()
+                .expect("RWLock poisoned")
+                .insert(key, value);
         }
+        storage.write_log = Some(write_log);
+
+        log_info!(
+            "Opened durable storage in {:?} with fsync mode {}",
+            dir,
+            fsync_mode.as_str()
+        );
+        return Ok(storage);
+    }
+
+    // Whether writes go to disk, and may wait for it
+    pub fn is_durable(&self) -> bool {
+        return self.write_log.is_some();
+    }
+
+    // Keys are sharded by their location on the ring, so a range of the ring maps to a few shards
+    fn shard_index(location: u16) -> usize {
+        return usize::from(location) * SHARD_COUNT / (usize::from(u16::MAX) + 1);
+    }
+
+    fn shard_first_location(index: usize) -> u16 {
+        return (index * (usize::from(u16::MAX) + 1) / SHARD_COUNT) as u16;
+    }
+
+    // A range of the ring overlaps a shard if it starts inside the shard, or the shard starts inside it
+    fn shards_in_range(&self, position: u16, range: u16) -> impl Iterator<Item = &Shard> {
+        return self.shards.iter().enumerate().filter_map(move |(index, shard)| {
+            let overlaps = Storage::shard_index(position) == index
+                || is_location_in_range(Storage::shard_first_location(index), position, range);
+            if overlaps {
+                Some(shard)
+            } else {
+                None
+            }
+        });
+    }
+
+    fn shard(&self, key: &str) -> &Shard {
+        return &self.shards[Storage::shard_index(key_to_location(key))];
+    }
+
+    pub fn store(&self, key: &str, value: &str) -> io::Result<()> {
+        return self.store_bytes(key, Bytes::copy_from_slice(value.as_bytes()));
+    }
+
+    // A write that could not be logged is not applied. In always mode the write is visible to readers
+    // while it is synced, but the caller only gets an answer once it is on disk.
+    pub fn store_bytes(&self, key: &str, value: Bytes) -> io::Result<()> {
+        let shard = self.shard(key);
+
+        let sequence = {
+            // Log while holding the shard lock, so the log has the writes to a key in the order they were applied
+            let mut entries = shard.write();
+            let sequence = match &self.write_log {
+                Some(write_log) => Some(write_log.append_put(key, &value)?),
+                None => None,
+            };
+            shard.add_bytes(key, &value);
+            if let Some(replaced) = entries.insert(key.to_string(), value) {
+                shard.remove_bytes(key, &replaced);
+            }
+            sequence
+        };
+
+        return self.sync_to(sequence);
     }
 
-    pub fn store(&self, key: &str, value: &str) {
-        let mut storage = self.storage.write().expect("RWLock poisoned");
-        storage.insert(key.to_string(), value.to_string());
+    // Waits for the disk without holding a shard, so other writers to the shard are not held up
+    fn sync_to(&self, sequence: Option<u64>) -> io::Result<()> {
+        match (&self.write_log, sequence) {
+            (Some(write_log), Some(sequence)) => return write_log.sync_to(sequence),
+            _ => return Ok(()),
+        };
     }
 
     pub fn retrieve(&self, key: &str) -> Option<String> {
-        let storage = self.storage.read().expect("RWLock poisoned");
-        let value = storage.get(key).map_or(None, |v| Some(v.to_string()));
-        return value;
+        let value = self.retrieve_bytes(key);
+        return value.map(|v| String::from_utf8_lossy(&v).into_owned());
+    }
+
+    // Returns a reference counted handle to the stored value, without copying it
+    pub fn retrieve_bytes(&self, key: &str) -> Option<Bytes> {
+        let entries = self.shard(key).read();
+        return entries.get(key).cloned();
+    }
+
+    // Up to limit entries with a location in [position, position + range), ordered by key and
+    // starting after the given key. Used to move a range of keys to another node in chunks.
+    //
+    // The first chunk takes a sorted snapshot of the keys in the range, and returns its id with the
+    // entries. Later chunks that pass the id continue in it, so a transfer scans and sorts the range
+    // once and not once per chunk. Keys written after the snapshot was taken are left out, keys
+    // removed since are skipped. An unknown id, e.g. one that expired, takes a new snapshot.
+    pub fn entries_in_range(
+        &self,
+        position: u16,
+        range: u16,
+        snapshot: Option<u64>,
+        after: Option<&str>,
+        limit: usize,
+    ) -> (u64, Vec<(String, Bytes)>) {
+        let (snapshot, keys) = self.range_snapshot(position, range, snapshot);
+        let start = match after {
+            Some(after) => keys.partition_point(|key| key.as_str() <= after),
+            None => 0,
+        };
+
+        let mut entries: Vec<(String, Bytes)> = Vec::new();
+        for key in keys[start..].iter() {
+            if entries.len() == limit {
+                return (snapshot, entries);
+            }
+            if let Some(value) = self.retrieve_bytes(key) {
+                entries.push((key.clone(), value));
+            }
+        }
+
+        // The transfer has reached the end of the snapshot
+        self.range_snapshots
+            .lock()
+            .expect("Mutex poisoned")
+            .remove(&snapshot);
+        return (snapshot, entries);
+    }
+
+    // The snapshot a transfer of the range continues in, a new one if there is none with that id
+    fn range_snapshot(
+        &self,
+        position: u16,
+        range: u16,
+        snapshot: Option<u64>,
+    ) -> (u64, Arc<Vec<String>>) {
+        {
+            let mut snapshots = self.range_snapshots.lock().expect("Mutex poisoned");
+            snapshots.retain(|_, snapshot| snapshot.used_at.elapsed() < RANGE_SNAPSHOT_TTL);
+            if let Some(id) = snapshot {
+                if let Some(snapshot) = snapshots.get_mut(&id) {
+                    if snapshot.position == position && snapshot.range == range {
+                        snapshot.used_at = Instant::now();
+                        return (id, snapshot.keys.clone());
+                    }
+                }
+            }
+        }
+
+        // Each shard is only locked while its keys are copied, the sort runs without any lock
+        let mut keys: Vec<String> = Vec::new();
+        for shard in self.shards_in_range(position, range) {
+            let shard_entries = shard.read();
+            keys.extend(
+                shard_entries
+                    .keys()
+                    .filter(|key| is_location_in_range(key_to_location(key), position, range))
+                    .cloned(),
+            );
+        }
+        keys.sort_unstable();
+
+        let id = self.next_snapshot_id.fetch_add(1, Ordering::Relaxed);
+        let keys = Arc::new(keys);
+        self.range_snapshots.lock().expect("Mutex poisoned").insert(
+            id,
+            RangeSnapshot {
+                position: position,
+                range: range,
+                keys: keys.clone(),
+                used_at: Instant::now(),
+            },
+        );
+        return (id, keys);
+    }
+
+    // Drop every key with a location in [position, position + range), returns how many were removed.
+    // Stops at the first key whose removal could not be logged, the keys before it stay removed.
+    pub fn remove_range(&self, position: u16, range: u16) -> io::Result<usize> {
+        let mut removed = 0;
+        let mut sequence = None;
+
+        for shard in self.shards_in_range(position, range) {
+            let mut shard_entries = shard.write();
+            let doomed: Vec<String> = shard_entries
+                .keys()
+                .filter(|key| is_location_in_range(key_to_location(key), position, range))
+                .cloned()
+                .collect();
+
+            for key in doomed {
+                if let Some(write_log) = &self.write_log {
+                    sequence = Some(write_log.append_delete(&key)?);
+                }
+                if let Some(value) = shard_entries.remove(&key) {
+                    shard.remove_bytes(&key, &value);
+                    removed += 1;
+                }
+            }
+        }
+
+        self.sync_to(sequence)?;
+        return Ok(removed);
+    }
+
+    pub fn clear(&self) -> io::Result<()> {
+        let sequence = {
+            // Hold every shard so that no write can land between the clear record and the clear itself
+            let mut all_entries: Vec<RwLockWriteGuard<'_, HashMap<String, Bytes>>> =
+                self.shards.iter().map(|shard| shard.write()).collect();
+
+            let sequence = match &self.write_log {
+                Some(write_log) => Some(write_log.append_clear()?),
+                None => None,
+            };
+            for (shard, entries) in self.shards.iter().zip(all_entries.iter_mut()) {
+                entries.clear();
+                shard.bytes.store(0, Ordering::Relaxed);
+            }
+            sequence
+        };
+
+        return self.sync_to(sequence);
+    }
+
+    // Periodic upkeep of the write log: flush or sync it, and compact it into a snapshot once it
+    // has grown past the threshold. Does nothing for in-memory storage.
+    pub fn maintain(&self) {
+        let write_log = match &self.write_log {
+            Some(write_log) => write_log,
+            None => return,
+        };
+
+        if let Err(err) = write_log.flush() {
+            log_error!("Could not flush write log: {}", err);
+        }
+
+        if write_log.needs_compaction() {
+            if let Err(err) = self.compact(write_log) {
+                log_error!("Could not compact write log: {}", err);
+            }
+        }
+    }
+
+    fn compact(&self, write_log: &WriteLog) -> io::Result<()> {
+        let generation = write_log.rotate()?;
+
+        // Values are reference counted, so this copies handles and not the data
+        let mut entries: Vec<(String, Bytes)> = Vec::new();
+        for shard in self.shards.iter() {
+            let shard_entries = shard.read();
+            entries.extend(
+                shard_entries
+                    .iter()
+                    .map(|(key, value)| (key.clone(), value.clone())),
+            );
+        }
+
+        return write_log.write_snapshot(generation, &entries);
+    }
+
+    pub fn write_log_statistics(&self) -> Option<WriteLogStatistics> {
+        return self
+            .write_log
+            .as_ref()
+            .map(|write_log| write_log.statistics());
+    }
+
+    pub fn shard_statistics(&self) -> Vec<ShardStatistics> {
+        return self
+            .shards
+            .iter()
+            .enumerate()
+            .map(|(index, shard)| ShardStatistics {
+                shard: index,
+                first_location: Storage::shard_first_location(index),
+                keys: shard.entries.read().expect("RWLock poisoned").len(),
+                bytes: shard.bytes.load(Ordering::Relaxed),
+                reads: shard.reads.load(Ordering::Relaxed),
+                writes: shard.writes.load(Ordering::Relaxed),
+                contended_reads: shard.contended_reads.load(Ordering::Relaxed),
+                contended_writes: shard.contended_writes.load(Ordering::Relaxed),
+            })
+            .collect();
     }
 }
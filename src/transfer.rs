@@ -0,0 +1,319 @@
+use bytes::Bytes;
+use rocket::serde::{Deserialize, Serialize};
+use std::collections::VecDeque;
+use std::sync::{Mutex, OnceLock};
+use std::time::Instant;
+
+use crate::http_connect;
+use crate::storage::Storage;
+use crate::Node;
+
+// Upper bounds for a single chunk, kept well below Rocket's default 1 MiB JSON limit. A value larger
+// than CHUNK_BYTES is sent in a chunk of its own, the JSON limit is raised in rocket() to allow for it.
+pub const CHUNK_KEYS: usize = 500;
+pub const CHUNK_BYTES: usize = 512 * 1024;
+
+// Number of finished transfers kept for the statistics endpoint
+const RECENT_REPORT_COUNT: usize = 16;
+
+#[derive(Serialize, Deserialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct TransferEntry {
+    pub key: String,
+    pub value: String,
+    // "hex" for values that are not UTF-8, missing for plain text values
+    #[serde(default, skip_serializing_if = "Option::is_none")]
+    pub encoding: Option<String>,
+}
+
+const HEX_ENCODING: &str = "hex";
+const HEX_DIGITS: &[u8; 16] = b"0123456789abcdef";
+
+impl TransferEntry {
+    // Text values are sent as they are, binary values hex encoded so that they survive JSON
+    pub fn new(key: String, value: &Bytes) -> Self {
+        if let Ok(text) = std::str::from_utf8(value) {
+            return TransferEntry {
+                key: key,
+                value: String::from(text),
+                encoding: None,
+            };
+        }
+
+        let mut hex = String::with_capacity(value.len() * 2);
+        for byte in value.iter() {
+            hex.push(HEX_DIGITS[(byte >> 4) as usize] as char);
+            hex.push(HEX_DIGITS[(byte & 0x0f) as usize] as char);
+        }
+        return TransferEntry {
+            key: key,
+            value: hex,
+            encoding: Some(String::from(HEX_ENCODING)),
+        };
+    }
+
+    // The stored value, None if the encoding is unknown or the value is not valid for it
+    pub fn value_bytes(&self) -> Option<Bytes> {
+        match self.encoding.as_deref() {
+            None => return Some(Bytes::copy_from_slice(self.value.as_bytes())),
+            Some(HEX_ENCODING) => (),
+            Some(_) => return None,
+        };
+
+        let hex = self.value.as_bytes();
+        if hex.len() % 2 != 0 {
+            return None;
+        }
+        let digit = |c: u8| (c as char).to_digit(16).map(|d| d as u8);
+        let mut value = Vec::with_capacity(hex.len() / 2);
+        for pair in hex.chunks(2) {
+            value.push(digit(pair[0])? << 4 | digit(pair[1])?);
+        }
+        return Some(Bytes::from(value));
+    }
+}
+
+#[derive(Serialize, Deserialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct TransferChunk {
+    pub entries: Vec<TransferEntry>,
+    // Key to continue after, None when this was the last chunk of the range
+    pub next_after: Option<String>,
+    // Key snapshot the next chunk continues in, passed back with next_after
+    #[serde(default)]
+    pub snapshot: Option<u64>,
+}
+
+#[derive(Serialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct TransferReport {
+    pub direction: String,
+    pub peer: String,
+    pub position: u16,
+    pub range: u16,
+    pub keys: usize,
+    pub bytes: usize,
+    pub chunks: usize,
+    pub duration_ms: u64,
+    pub keys_per_second: f64,
+    pub bytes_per_second: f64,
+}
+
+struct TransferProgress {
+    direction: &'static str,
+    peer: String,
+    position: u16,
+    range: u16,
+    keys: usize,
+    bytes: usize,
+    chunks: usize,
+    started_at: Instant,
+}
+
+impl TransferProgress {
+    fn new(direction: &'static str, peer: &Node, position: u16, range: u16) -> Self {
+        TransferProgress {
+            direction: direction,
+            peer: format!("{}:{}", peer.hostname, peer.port),
+            position: position,
+            range: range,
+            keys: 0,
+            bytes: 0,
+            chunks: 0,
+            started_at: Instant::now(),
+        }
+    }
+
+    fn add_chunk(&mut self, entries: &[TransferEntry]) {
+        self.chunks += 1;
+        self.keys += entries.len();
+        self.bytes += entries
+            .iter()
+            .map(|entry| entry.key.len() + entry.value.len())
+            .sum::<usize>();
+    }
+
+    fn finish(self) -> TransferReport {
+        let elapsed = self.started_at.elapsed();
+        let seconds = elapsed.as_secs_f64().max(f64::EPSILON);
+
+        let report = TransferReport {
+            direction: String::from(self.direction),
+            peer: self.peer,
+            position: self.position,
+            range: self.range,
+            keys: self.keys,
+            bytes: self.bytes,
+            chunks: self.chunks,
+            duration_ms: elapsed.as_millis() as u64,
+            keys_per_second: self.keys as f64 / seconds,
+            bytes_per_second: self.bytes as f64 / seconds,
+        };
+
+        log_info!(
+            "Transfer ({}) with {}: {} keys, {} bytes in {} chunks, {} ms",
+            report.direction,
+            report.peer,
+            report.keys,
+            report.bytes,
+            report.chunks,
+            report.duration_ms
+        );
+
+        let mut recent = recent_reports_store().lock().expect("Mutex poisoned");
+        if recent.len() == RECENT_REPORT_COUNT {
+            recent.pop_front();
+        }
+        recent.push_back(report.clone());
+
+        return report;
+    }
+}
+
+fn recent_reports_store() -> &'static Mutex<VecDeque<TransferReport>> {
+    static RECENT: OnceLock<Mutex<VecDeque<TransferReport>>> = OnceLock::new();
+    return RECENT.get_or_init(|| Mutex::new(VecDeque::new()));
+}
+
+pub fn recent_reports() -> Vec<TransferReport> {
+    let recent = recent_reports_store().lock().expect("Mutex poisoned");
+    return recent.iter().cloned().collect();
+}
+
+// Read the next chunk of a range from local storage, bounded by both key count and size
+pub fn read_chunk(
+    storage: &Storage,
+    position: u16,
+    range: u16,
+    snapshot: Option<u64>,
+    after: Option<&str>,
+    limit: usize,
+) -> TransferChunk {
+    let limit = limit.clamp(1, CHUNK_KEYS);
+    let (snapshot, candidates) = storage.entries_in_range(position, range, snapshot, after, limit);
+    let candidate_count = candidates.len();
+
+    let mut entries: Vec<TransferEntry> = Vec::new();
+    let mut bytes = 0;
+
+    for (key, value) in candidates {
+        let entry_bytes = key.len() + value.len();
+        if !entries.is_empty() && bytes + entry_bytes > CHUNK_BYTES {
+            break;
+        }
+        bytes += entry_bytes;
+        entries.push(TransferEntry::new(key, &value));
+    }
+
+    // There may be more to send if the chunk is full or was cut short by its size
+    let next_after = if entries.len() < candidate_count || candidate_count == limit {
+        entries.last().map(|entry| entry.key.clone())
+    } else {
+        None
+    };
+
+    return TransferChunk {
+        snapshot: next_after.as_ref().map(|_next_after| snapshot),
+        entries: entries,
+        next_after: next_after,
+    };
+}
+
+// Stops at the first entry that could not be stored, see Storage::store_bytes
+pub fn store_chunk(storage: &Storage, entries: &[TransferEntry]) -> Result<(), String> {
+    for entry in entries.iter() {
+        match entry.value_bytes() {
+            Some(value) => {
+                if let Err(err) = storage.store_bytes(&entry.key, value) {
+                    return Err(format!("Could not store transferred key {}: {}", entry.key, err));
+                }
+            }
+            None => log_warn!("Skipping transferred key {} with an invalid value", entry.key),
+        };
+    }
+    return Ok(());
+}
+
+// Copy all keys in [position, position + range) from the peer into local storage. Chunks are
+// requested one at a time, so the peer never sends faster than we store.
+pub fn pull_range(
+    storage: &Storage,
+    peer: &Node,
+    position: u16,
+    range: u16,
+) -> Result<TransferReport, String> {
+    let mut progress = TransferProgress::new("pull", peer, position, range);
+    let mut after: Option<String> = None;
+    let mut snapshot: Option<u64> = None;
+
+    loop {
+        let mut path = format!(
+            "transfer/range?position={}&range={}&limit={}",
+            position, range, CHUNK_KEYS
+        );
+        if let Some(after) = after.as_ref() {
+            path.push_str(&format!("&after={}", http_connect::encode_component(after)));
+        }
+        if let Some(snapshot) = snapshot {
+            path.push_str(&format!("&snapshot={}", snapshot));
+        }
+
+        let chunk = match http_connect::get_from_node(&peer.hostname, peer.port, &path) {
+            Err(_err) => return Err(String::from("Could not pull range from node.")),
+            Ok(response) => match response.json::<TransferChunk>() {
+                Err(_err) => return Err(String::from("Unable to parse transfer chunk from JSON.")),
+                Ok(chunk) => chunk,
+            },
+        };
+
+        store_chunk(storage, &chunk.entries)?;
+        progress.add_chunk(&chunk.entries);
+
+        snapshot = chunk.snapshot;
+        match chunk.next_after {
+            Some(next_after) => after = Some(next_after),
+            None => break,
+        }
+    }
+
+    return Ok(progress.finish());
+}
+
+// Send all local keys in [position, position + range) to the peer. The next chunk is only sent
+// once the peer has acknowledged the previous one.
+pub fn push_range(
+    storage: &Storage,
+    peer: &Node,
+    position: u16,
+    range: u16,
+) -> Result<TransferReport, String> {
+    let mut progress = TransferProgress::new("push", peer, position, range);
+    let mut after: Option<String> = None;
+    let mut snapshot: Option<u64> = None;
+
+    loop {
+        let chunk = read_chunk(storage, position, range, snapshot, after.as_deref(), CHUNK_KEYS);
+
+        if !chunk.entries.is_empty() {
+            match http_connect::write_json_to_node(
+                http_connect::WriteOperations::Put,
+                &peer.hostname,
+                peer.port,
+                "transfer/entries",
+                &chunk.entries,
+            ) {
+                Err(_err) => return Err(String::from("Could not push range to node.")),
+                Ok(_response) => (),
+            };
+            progress.add_chunk(&chunk.entries);
+        }
+
+        snapshot = chunk.snapshot;
+        match chunk.next_after {
+            Some(next_after) => after = Some(next_after),
+            None => break,
+        }
+    }
+
+    return Ok(progress.finish());
+}
@@ -0,0 +1,462 @@
+use bytes::Bytes;
+use memmap2::Mmap;
+use rocket::serde::Serialize;
+use std::collections::HashMap;
+use std::fs::{self, File, OpenOptions};
+use std::io::{self, BufWriter, Write};
+use std::path::{Path, PathBuf};
+use std::sync::atomic::{AtomicU64, Ordering};
+use std::sync::Mutex;
+use std::time::Instant;
+
+const SNAPSHOT_MAGIC: &[u8; 8] = b"A1SNAP01";
+
+const RECORD_PUT: u8 = 1;
+const RECORD_DELETE: u8 = 2;
+const RECORD_CLEAR: u8 = 3;
+
+// Op, key length and value length in front of every log record, followed by key, value and a CRC32
+const RECORD_HEADER_LEN: usize = 9;
+
+// When a write counts as durable
+#[derive(Clone, Copy, Debug, PartialEq)]
+pub enum FsyncMode {
+    // Every write is synced to disk before it is acknowledged
+    Always,
+    // Writes are synced by the maintenance thread, a crash loses at most one interval of writes
+    Batched,
+    // Writes are handed to the OS but never synced, a power loss can lose anything not yet written back
+    Off,
+}
+
+impl FsyncMode {
+    pub fn parse(value: &str) -> Option<Self> {
+        match value.to_lowercase().as_str() {
+            "always" => Some(FsyncMode::Always),
+            "batched" => Some(FsyncMode::Batched),
+            "off" => Some(FsyncMode::Off),
+            _ => None,
+        }
+    }
+
+    pub fn as_str(&self) -> &'static str {
+        match self {
+            FsyncMode::Always => "always",
+            FsyncMode::Batched => "batched",
+            FsyncMode::Off => "off",
+        }
+    }
+}
+
+#[derive(Serialize, Clone, Debug)]
+#[serde(crate = "rocket::serde")]
+pub struct WriteLogStatistics {
+    pub fsync_mode: String,
+    pub generation: u64,
+    pub uncompacted_bytes: u64,
+    pub records: u64,
+    pub fsyncs: u64,
+    pub compactions: u64,
+    pub recovered_keys: usize,
+    pub recovery_ms: u64,
+    pub broken: bool,
+}
+
+struct ActiveLog {
+    writer: BufWriter<File>,
+    generation: u64,
+    // Bytes written to every log since the last snapshot, replayed on restart
+    uncompacted_bytes: u64,
+    dirty: bool,
+    // Sequence number of the last record appended
+    sequence: u64,
+    // Set once a write or sync has failed. The log may end in a torn record then, and recovery stops
+    // at it, so nothing appended after it could be recovered.
+    broken: bool,
+}
+
+impl ActiveLog {
+    // Marks the log as broken if the operation on its file failed
+    fn check<T>(&mut self, result: io::Result<T>) -> io::Result<T> {
+        if result.is_err() {
+            self.broken = true;
+        }
+        return result;
+    }
+}
+
+// Append-only log of every change to the storage, compacted into snapshots.
+//
+// The data directory holds snapshot-<generation> files with the full state at the moment
+// log-<generation> was started, and the logs written since. Recovery maps the newest snapshot and
+// replays the logs of that generation and later, so restart time follows the snapshot and not the
+// write history.
+pub struct WriteLog {
+    dir: PathBuf,
+    fsync_mode: FsyncMode,
+    compact_bytes: u64,
+    active: Mutex<ActiveLog>,
+    // Held while syncing in always mode, so that concurrent writers share one sync
+    syncing: Mutex<()>,
+    // Sequence number of the last record known to be on disk
+    synced: AtomicU64,
+    records: AtomicU64,
+    fsyncs: AtomicU64,
+    compactions: AtomicU64,
+    recovered_keys: usize,
+    recovery_ms: u64,
+}
+
+fn file_name(prefix: &str, generation: u64) -> String {
+    return format!("{}-{:020}", prefix, generation);
+}
+
+fn parse_generation(name: &str, prefix: &str) -> Option<u64> {
+    return name.strip_prefix(prefix)?.strip_prefix('-')?.parse().ok();
+}
+
+// Generations of the snapshots and logs in the directory, each sorted
+fn list_generations(dir: &Path) -> io::Result<(Vec<u64>, Vec<u64>)> {
+    let mut snapshots = Vec::new();
+    let mut logs = Vec::new();
+
+    for entry in fs::read_dir(dir)? {
+        let name = entry?.file_name();
+        let name = name.to_string_lossy();
+        if let Some(generation) = parse_generation(&name, "snapshot") {
+            snapshots.push(generation);
+        } else if let Some(generation) = parse_generation(&name, "log") {
+            logs.push(generation);
+        }
+    }
+
+    snapshots.sort_unstable();
+    logs.sort_unstable();
+    return Ok((snapshots, logs));
+}
+
+fn broken_log() -> io::Error {
+    return io::Error::new(
+        io::ErrorKind::Other,
+        "Write log failed earlier and takes no more writes, restart the node",
+    );
+}
+
+fn sync_dir(dir: &Path) -> io::Result<()> {
+    return File::open(dir)?.sync_all();
+}
+
+fn read_u32(data: &[u8], offset: usize) -> Option<u32> {
+    let bytes = data.get(offset..offset + 4)?;
+    return Some(u32::from_le_bytes(bytes.try_into().ok()?));
+}
+
+// Load a snapshot through a memory map. Values are slices of the map, so nothing is copied and
+// pages are only read from disk once a value is served.
+fn load_snapshot(path: &Path, entries: &mut HashMap<String, Bytes>) -> io::Result<()> {
+    let file = File::open(path)?;
+    let map = unsafe { Mmap::map(&file)? };
+    let data = Bytes::from_owner(map);
+
+    let corrupt = || io::Error::new(io::ErrorKind::InvalidData, "Corrupt snapshot");
+
+    if data.len() < SNAPSHOT_MAGIC.len() + 8 || &data[..SNAPSHOT_MAGIC.len()] != SNAPSHOT_MAGIC {
+        return Err(corrupt());
+    }
+    let mut offset = SNAPSHOT_MAGIC.len();
+    let count = u64::from_le_bytes(data[offset..offset + 8].try_into().map_err(|_err| corrupt())?);
+    offset += 8;
+
+    for _entry in 0..count {
+        let key_len = read_u32(&data, offset).ok_or_else(corrupt)? as usize;
+        let value_len = read_u32(&data, offset + 4).ok_or_else(corrupt)? as usize;
+        offset += 8;
+
+        if data.len() < offset + key_len + value_len {
+            return Err(corrupt());
+        }
+        let key = std::str::from_utf8(&data[offset..offset + key_len]).map_err(|_err| corrupt())?;
+        let value = data.slice(offset + key_len..offset + key_len + value_len);
+        entries.insert(key.to_string(), value);
+        offset += key_len + value_len;
+    }
+
+    return Ok(());
+}
+
+// Apply the records of a log in order, stopping at the first torn or corrupt record. Returns the
+// number of bytes replayed.
+fn replay_log(path: &Path, entries: &mut HashMap<String, Bytes>) -> io::Result<u64> {
+    let data = Bytes::from(fs::read(path)?);
+    let mut offset = 0;
+
+    while offset + RECORD_HEADER_LEN <= data.len() {
+        let op = data[offset];
+        let key_len = read_u32(&data, offset + 1).unwrap_or(0) as usize;
+        let value_len = read_u32(&data, offset + 5).unwrap_or(0) as usize;
+        let body_end = offset + RECORD_HEADER_LEN + key_len + value_len;
+
+        let checksum = match read_u32(&data, body_end) {
+            Some(checksum) => checksum,
+            None => break,
+        };
+        if crc32fast::hash(&data[offset..body_end]) != checksum {
+            log_warn!("Write log {:?} has a corrupt record, ignoring the rest", path);
+            break;
+        }
+
+        let key_start = offset + RECORD_HEADER_LEN;
+        let key = String::from_utf8_lossy(&data[key_start..key_start + key_len]).into_owned();
+        match op {
+            RECORD_PUT => {
+                entries.insert(key, data.slice(key_start + key_len..body_end));
+            }
+            RECORD_DELETE => {
+                entries.remove(&key);
+            }
+            RECORD_CLEAR => entries.clear(),
+            _ => break,
+        };
+
+        offset = body_end + 4;
+    }
+
+    return Ok(offset as u64);
+}
+
+fn open_log(dir: &Path, generation: u64) -> io::Result<BufWriter<File>> {
+    let file = OpenOptions::new()
+        .create(true)
+        .append(true)
+        .open(dir.join(file_name("log", generation)))?;
+    sync_dir(dir)?;
+    return Ok(BufWriter::new(file));
+}
+
+impl WriteLog {
+    // Recover the state stored in the directory and start a new log generation on top of it
+    pub fn open(
+        dir: &Path,
+        fsync_mode: FsyncMode,
+        compact_bytes: u64,
+    ) -> io::Result<(WriteLog, HashMap<String, Bytes>)> {
+        let started_at = Instant::now();
+        fs::create_dir_all(dir)?;
+
+        let (snapshots, logs) = list_generations(dir)?;
+        let mut entries: HashMap<String, Bytes> = HashMap::new();
+
+        let snapshot_generation = snapshots.last().copied().unwrap_or(0);
+        if let Some(generation) = snapshots.last() {
+            load_snapshot(&dir.join(file_name("snapshot", *generation)), &mut entries)?;
+        }
+
+        let mut uncompacted_bytes = 0;
+        for generation in logs.iter().filter(|log| **log >= snapshot_generation) {
+            uncompacted_bytes += replay_log(&dir.join(file_name("log", *generation)), &mut entries)?;
+        }
+
+        // Never append to a log that may end in a torn record, start a fresh one
+        let generation = logs
+            .last()
+            .copied()
+            .max(snapshots.last().copied())
+            .map_or(1, |last| last + 1);
+
+        let write_log = WriteLog {
+            dir: dir.to_path_buf(),
+            fsync_mode: fsync_mode,
+            compact_bytes: compact_bytes,
+            active: Mutex::new(ActiveLog {
+                writer: open_log(dir, generation)?,
+                generation: generation,
+                uncompacted_bytes: uncompacted_bytes,
+                dirty: false,
+                sequence: 0,
+                broken: false,
+            }),
+            syncing: Mutex::new(()),
+            synced: AtomicU64::new(0),
+            records: AtomicU64::new(0),
+            fsyncs: AtomicU64::new(0),
+            compactions: AtomicU64::new(0),
+            recovered_keys: entries.len(),
+            recovery_ms: started_at.elapsed().as_millis() as u64,
+        };
+
+        log_info!(
+            "Recovered {} keys from {:?} in {} ms",
+            write_log.recovered_keys, dir, write_log.recovery_ms
+        );
+        return Ok((write_log, entries));
+    }
+
+    // Appends a record and returns its sequence number. Nothing is synced here, in always mode the
+    // caller syncs with sync_to once it no longer blocks other writers.
+    fn append(&self, op: u8, key: &str, value: &[u8]) -> io::Result<u64> {
+        let mut record = Vec::with_capacity(RECORD_HEADER_LEN + key.len() + value.len() + 4);
+        record.push(op);
+        record.extend_from_slice(&(key.len() as u32).to_le_bytes());
+        record.extend_from_slice(&(value.len() as u32).to_le_bytes());
+        record.extend_from_slice(key.as_bytes());
+        record.extend_from_slice(value);
+        record.extend_from_slice(&crc32fast::hash(&record).to_le_bytes());
+
+        let mut active = self.active.lock().expect("Mutex poisoned");
+        if active.broken {
+            return Err(broken_log());
+        }
+        let written = active.writer.write_all(&record);
+        active.check(written)?;
+        active.uncompacted_bytes += record.len() as u64;
+        active.sequence += 1;
+        active.dirty = true;
+        self.records.fetch_add(1, Ordering::Relaxed);
+
+        return Ok(active.sequence);
+    }
+
+    pub fn append_put(&self, key: &str, value: &[u8]) -> io::Result<u64> {
+        return self.append(RECORD_PUT, key, value);
+    }
+
+    pub fn append_delete(&self, key: &str) -> io::Result<u64> {
+        return self.append(RECORD_DELETE, key, &[]);
+    }
+
+    pub fn append_clear(&self) -> io::Result<u64> {
+        return self.append(RECORD_CLEAR, "", &[]);
+    }
+
+    // In always mode, returns once the record with the given sequence number is on disk. A sync
+    // covers every record appended before it, so writers that wait at the same time share one.
+    // The log lock is only held to flush the buffer, other writers append while the disk syncs.
+    pub fn sync_to(&self, sequence: u64) -> io::Result<()> {
+        if self.fsync_mode != FsyncMode::Always || self.synced.load(Ordering::Acquire) >= sequence {
+            return Ok(());
+        }
+
+        let _syncing = self.syncing.lock().expect("Mutex poisoned");
+        if self.synced.load(Ordering::Acquire) >= sequence {
+            return Ok(());
+        }
+
+        let (file, last_sequence) = {
+            let mut active = self.active.lock().expect("Mutex poisoned");
+            if active.broken {
+                return Err(broken_log());
+            }
+            let flushed = active.writer.flush();
+            active.check(flushed)?;
+            let file = active.writer.get_ref().try_clone();
+            (active.check(file)?, active.sequence)
+        };
+
+        if let Err(err) = file.sync_data() {
+            self.active.lock().expect("Mutex poisoned").broken = true;
+            return Err(err);
+        }
+        self.fsyncs.fetch_add(1, Ordering::Relaxed);
+        self.synced.fetch_max(last_sequence, Ordering::Release);
+
+        return Ok(());
+    }
+
+    // Hand buffered records to the OS, and sync them in batched mode. Run periodically.
+    pub fn flush(&self) -> io::Result<()> {
+        let mut active = self.active.lock().expect("Mutex poisoned");
+
+        if !active.dirty || active.broken {
+            return Ok(());
+        }
+        let flushed = active.writer.flush();
+        active.check(flushed)?;
+        if self.fsync_mode == FsyncMode::Batched {
+            let synced = active.writer.get_ref().sync_data();
+            active.check(synced)?;
+            self.fsyncs.fetch_add(1, Ordering::Relaxed);
+        }
+        active.dirty = false;
+
+        return Ok(());
+    }
+
+    pub fn needs_compaction(&self) -> bool {
+        return self.active.lock().expect("Mutex poisoned").uncompacted_bytes >= self.compact_bytes;
+    }
+
+    // First half of a compaction: close the current log and start the next generation. Every record
+    // in the older logs is in memory by now, so a snapshot taken after this covers all of them.
+    pub fn rotate(&self) -> io::Result<u64> {
+        let mut active = self.active.lock().expect("Mutex poisoned");
+        if active.broken {
+            return Err(broken_log());
+        }
+
+        let flushed = active.writer.flush();
+        active.check(flushed)?;
+        let synced = active.writer.get_ref().sync_data();
+        active.check(synced)?;
+        // Records of the old log are on disk now, a sync_to waiting for them has nothing left to do
+        self.synced.fetch_max(active.sequence, Ordering::Release);
+
+        let generation = active.generation + 1;
+        active.writer = open_log(&self.dir, generation)?;
+        active.generation = generation;
+        active.uncompacted_bytes = 0;
+        active.dirty = false;
+
+        return Ok(generation);
+    }
+
+    // Second half of a compaction: write the snapshot for the generation returned by rotate, then drop
+    // the files it replaces. Records in the new log may already be in the snapshot, replaying them
+    // again on restart is harmless since the log is applied in order on top of it.
+    pub fn write_snapshot(&self, generation: u64, entries: &[(String, Bytes)]) -> io::Result<()> {
+        let final_path = self.dir.join(file_name("snapshot", generation));
+        let temporary_path = self.dir.join(format!("{}.tmp", file_name("snapshot", generation)));
+
+        let mut writer = BufWriter::new(File::create(&temporary_path)?);
+        writer.write_all(SNAPSHOT_MAGIC)?;
+        writer.write_all(&(entries.len() as u64).to_le_bytes())?;
+        for (key, value) in entries.iter() {
+            writer.write_all(&(key.len() as u32).to_le_bytes())?;
+            writer.write_all(&(value.len() as u32).to_le_bytes())?;
+            writer.write_all(key.as_bytes())?;
+            writer.write_all(value)?;
+        }
+        writer.flush()?;
+        writer.get_ref().sync_all()?;
+
+        // The rename makes the snapshot visible only once it is complete
+        fs::rename(&temporary_path, &final_path)?;
+        sync_dir(&self.dir)?;
+
+        let (snapshots, logs) = list_generations(&self.dir)?;
+        for old in snapshots.iter().filter(|old| **old < generation) {
+            fs::remove_file(self.dir.join(file_name("snapshot", *old)))?;
+        }
+        for old in logs.iter().filter(|old| **old < generation) {
+            fs::remove_file(self.dir.join(file_name("log", *old)))?;
+        }
+
+        self.compactions.fetch_add(1, Ordering::Relaxed);
+        return Ok(());
+    }
+
+    pub fn statistics(&self) -> WriteLogStatistics {
+        let active = self.active.lock().expect("Mutex poisoned");
+
+        WriteLogStatistics {
+            fsync_mode: String::from(self.fsync_mode.as_str()),
+            generation: active.generation,
+            uncompacted_bytes: active.uncompacted_bytes,
+            records: self.records.load(Ordering::Relaxed),
+            fsyncs: self.fsyncs.load(Ordering::Relaxed),
+            compactions: self.compactions.load(Ordering::Relaxed),
+            recovered_keys: self.recovered_keys,
+            recovery_ms: self.recovery_ms,
+            broken: active.broken,
+        }
+    }
+}